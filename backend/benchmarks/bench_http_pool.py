@@ -0,0 +1,95 @@
+"""
+Compare a fresh httpx.AsyncClient per upstream call (the old behaviour)
+against the shared pooled clients in main_osrm.
+
+Both modes replay the call pattern of one /trips/create (one route, three
+Overpass radii per meal and one duration table covering twelve candidates
+per meal) against a local stand-in server and report TCP connections opened
+and wall time.
+
+    cd backend && python -m benchmarks.bench_http_pool --trips 20 --latency 0.005
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+
+import main_osrm
+from main_osrm import LatLng
+from benchmarks.fake_upstreams import FakeUpstreamServer, synthetic_handler
+
+SOURCE = LatLng(lat=12.9716, lng=77.5946)
+DESTINATION = LatLng(lat=13.0827, lng=80.2707)
+VIA = LatLng(lat=12.95, lng=78.9)
+
+
+def trip_points(meals: int):
+    """Source, destination and twelve candidates per meal, as plan_trip_events lays out the trip matrix."""
+    return [SOURCE, DESTINATION] + [LatLng(lat=VIA.lat + k / 1000, lng=VIA.lng) for k in range(12 * meals)]
+
+
+async def trip_calls_fresh(base_url: str, meals: int):
+    coords = f"{SOURCE.lng},{SOURCE.lat};{DESTINATION.lng},{DESTINATION.lat}"
+    async with httpx.AsyncClient(timeout=20) as client:
+        (await client.get(f"{base_url}/route/v1/driving/{coords}")).raise_for_status()
+    for _ in range(meals):
+        for radius in (3000, 7000, 15000):
+            q = f'node["amenity"="restaurant"](around:{radius},{VIA.lat},{VIA.lng});'
+            async with httpx.AsyncClient(timeout=30) as client:
+                (await client.post(f"{base_url}/api/interpreter", data={"data": q})).raise_for_status()
+    points = trip_points(meals)
+    coords = ";".join(f"{p.lng},{p.lat}" for p in points)
+    params = {"sources": ";".join(str(i) for i in range(len(points)) if i != 1),
+              "destinations": ";".join(str(i) for i in range(1, len(points)))}
+    async with httpx.AsyncClient(timeout=15) as client:
+        (await client.get(f"{base_url}/table/v1/driving/{coords}", params=params)).raise_for_status()
+
+
+async def trip_calls_pooled(base_url: str, meals: int):
+    await main_osrm.call_osrm_route(SOURCE, DESTINATION)
+    for _ in range(meals):
+        for radius in (3000, 7000, 15000):
+            await main_osrm.search_places(VIA.lat, VIA.lng, radius=radius)
+    await main_osrm.trip_duration_matrix(trip_points(meals), origin=0, destination=1)
+
+
+async def run(trips: int, meals: int, latency: float):
+    async with FakeUpstreamServer(synthetic_handler, latency=latency) as server:
+        main_osrm.OSRM_BASE_URL = server.base_url
+        main_osrm.OVERPASS_URL = f"{server.base_url}/api/interpreter"
+        # Measure connection reuse only: every call has to reach the server
+        main_osrm.POI_CACHE_PATH = ""
+
+        results = {}
+        for mode, fn in (("fresh client per call", trip_calls_fresh), ("shared pool", trip_calls_pooled)):
+            server.reset_stats()
+            start = time.perf_counter()
+            for _ in range(trips):
+                main_osrm.route_cache.clear()
+                main_osrm.duration_cache.clear()
+                await fn(server.base_url, meals)
+            elapsed = time.perf_counter() - start
+            results[mode] = (server.connections, server.requests, elapsed)
+        await main_osrm.close_http_clients()
+
+    print(f"{trips} trips x {meals} meals, injected latency {latency * 1000:.1f} ms")
+    print(f"{'mode':<24}{'connections':>12}{'requests':>10}{'total s':>10}{'ms/trip':>10}")
+    for mode, (conns, reqs, elapsed) in results.items():
+        print(f"{mode:<24}{conns:>12}{reqs:>10}{elapsed:>10.3f}{elapsed / trips * 1000:>10.1f}")
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--trips", type=int, default=20)
+    ap.add_argument("--meals", type=int, default=2)
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds of injected server latency per request")
+    args = ap.parse_args()
+    asyncio.run(run(args.trips, args.meals, args.latency))
+
+
+if __name__ == "__main__":
+    main()
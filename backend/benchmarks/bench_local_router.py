@@ -0,0 +1,105 @@
+"""
+Build time and query latency of the local router (local_router.py).
+
+By default it builds synthetic cities: a jittered grid of junctions whose
+blocks are joined by streets with 0-4 bends each (shape points), with
+one-way streets and mixed road classes, at each --grid size. --extract
+builds a real .osm / .osm.pbf extract instead. Each build reports its
+junctions, shape points and shortcuts, the build time, and the latency of
+random routes and of a 25x25 table.
+
+    cd backend && python -m benchmarks.bench_local_router --grid 50 100 200
+    cd backend && python -m benchmarks.bench_local_router --extract bengaluru.osm.pbf
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from local_router import LocalRouter, build_graph
+
+
+def write_city(path: str, n: int, seed: int = 7) -> None:
+    rng = random.Random(seed)
+    junction = lambda i, j: 1 + i * n + j
+    nodes = {junction(i, j): (12.9 + i * 0.004 + rng.uniform(-0.001, 0.001), 77.5 + j * 0.004 + rng.uniform(-0.001, 0.001))
+             for i in range(n) for j in range(n)}
+    next_id = n * n
+    ways = []
+    for k in range(n):
+        for line, oneway in (([junction(k, j) for j in range(n)], "yes" if k % 7 == 3 else None),
+                             ([junction(i, k) for i in range(n)], "-1" if k % 9 == 4 else None)):
+            refs = [line[0]]
+            for a, b in zip(line, line[1:]):
+                (lat1, lon1), (lat2, lon2) = nodes[a], nodes[b]
+                bends = rng.randint(0, 4)
+                for s in range(1, bends + 1):
+                    f = s / (bends + 1)
+                    next_id += 1
+                    nodes[next_id] = (lat1 + (lat2 - lat1) * f + rng.uniform(-0.0003, 0.0003),
+                                      lon1 + (lon2 - lon1) * f + rng.uniform(-0.0003, 0.0003))
+                    refs.append(next_id)
+                refs.append(b)
+            kind = "primary" if k % 10 == 0 else "secondary" if k % 5 == 0 else rng.choice(["residential", "tertiary"])
+            ways.append((refs, kind, oneway))
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0"?>\n<osm version="0.6">\n')
+        for nid, (lat, lon) in nodes.items():
+            f.write(f'<node id="{nid}" lat="{lat:.7f}" lon="{lon:.7f}"/>\n')
+        for w, (refs, kind, oneway) in enumerate(ways, start=1):
+            f.write(f'<way id="{w}">' + "".join(f'<nd ref="{r}"/>' for r in refs) + f'<tag k="highway" v="{kind}"/>'
+                    + (f'<tag k="oneway" v="{oneway}"/>' if oneway else "") + "</way>\n")
+        f.write("</osm>\n")
+
+
+def bench(extract: str, graph_dir: str, routes: int) -> None:
+    start = time.perf_counter()
+    build_graph(extract, graph_dir, max_nodes=10**9)
+    built = time.perf_counter() - start
+    with open(os.path.join(graph_dir, "meta.json")) as f:
+        meta = json.load(f)
+
+    router = LocalRouter(graph_dir)
+    rng = random.Random(1)
+    lat, lon = router.point_lat, router.point_lon
+    south, north, west, east = float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max())
+
+    def point():
+        return rng.uniform(west, east), rng.uniform(south, north)
+
+    start = time.perf_counter()
+    for _ in range(routes):
+        router.route([point(), point()])
+    route_ms = (time.perf_counter() - start) / routes * 1000
+    points = [point() for _ in range(25)]
+    start = time.perf_counter()
+    router.table(points)
+    table_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{meta['source']}: {meta['nodes']} junctions, {meta['points']} shape points, "
+          f"{meta['shortcuts']} shortcuts")
+    print(f"  build {built:7.1f} s   route {route_ms:7.1f} ms   25x25 table {table_ms:7.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--grid", type=int, nargs="+", default=[50, 100], help="synthetic city sizes (junctions per side)")
+    ap.add_argument("--extract", help="build this .osm / .osm.pbf extract instead of synthetic cities")
+    ap.add_argument("--routes", type=int, default=50)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.extract:
+            bench(args.extract, os.path.join(tmp, "graph"), args.routes)
+            return
+        for n in args.grid:
+            extract = os.path.join(tmp, f"city_{n}x{n}.osm")
+            write_city(extract, n)
+            bench(extract, os.path.join(tmp, f"graph_{n}"), args.routes)
+
+
+if __name__ == "__main__":
+    main()
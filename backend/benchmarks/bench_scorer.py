@@ -0,0 +1,79 @@
+"""
+Per-place cost of personalization scoring: the reference
+score_place_enhanced (tables rebuilt and keywords rescanned per place)
+against scoring.CompiledScorer.score_batch, for a candidate pool and a
+handful of preference profiles.
+
+    cd backend && python -m benchmarks.bench_scorer --places 12 --rounds 2000
+"""
+
+import argparse
+import logging
+import random
+import time
+
+from main_osrm import UserPreferences, score_place_enhanced
+from poi_flags import classify_place
+from scoring import CompiledScorer
+
+PROFILES = {
+    "default": UserPreferences(),
+    "veg + activities": UserPreferences(foodPreference="vegetarian", budget="budget", mood="relax",
+                                        activities=["heritage", "photography", "wellness"],
+                                        accessibility="wheelchair"),
+}
+
+NAMES = ["Sri Krishna Pure Veg", "Highway Dhaba", "A2B Adyar Ananda Bhavan", "Cafe Coffee Day",
+         "Hotel Saravana Bhavan", "Murugan Idli Shop", "Chicken Corner", "Rooftop Grill"]
+CUISINES = ["vegetarian", "south_indian", "indian;regional", "coffee_shop", "chicken;bbq", ""]
+
+
+def make_places(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    places = []
+    for i in range(n):
+        tags = {"amenity": "restaurant", "name": rng.choice(NAMES), "cuisine": rng.choice(CUISINES)}
+        if rng.random() < 0.3:
+            tags["rating"] = f"{rng.uniform(2.5, 4.9):.1f}"
+        if rng.random() < 0.3:
+            tags["price_level"] = str(rng.randint(1, 4))
+        if rng.random() < 0.2:
+            tags["wheelchair"] = "yes"
+        # Classified at ingest, as _places_from_elements does
+        places.append(classify_place({"osm_id": str(i), "name": tags["name"], "tags": tags}))
+    return places
+
+
+def per_place_us(fn, rounds: int, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / (rounds * n) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--places", type=int, default=12, help="candidates scored per call (CANDIDATE_POOL_SIZE)")
+    ap.add_argument("--rounds", type=int, default=2000)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    places = make_places(args.places)
+    detours = [i % 15 for i in range(args.places)]
+    print(f"{args.places} places per call, {args.rounds} rounds")
+    print(f"{'profile':<20}{'reference us/place':>20}{'compiled us/place':>20}{'speedup':>10}")
+    for label, prefs in PROFILES.items():
+        def reference():
+            for p, d in zip(places, detours):
+                score_place_enhanced(p, d, prefs, 15)
+
+        def compiled():
+            CompiledScorer.for_prefs(prefs).score_batch(places, detours, 15)
+
+        ref = per_place_us(reference, args.rounds, args.places)
+        comp = per_place_us(compiled, args.rounds, args.places)
+        print(f"{label:<20}{ref:>20.2f}{comp:>20.2f}{ref / comp:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Serialize time and bytes on the wire for a typical two-meal TripResponse
+(five suggestions per meal, each with a realistic OSM tag set, plus a
+medium-level route polyline).
+
+Encoders compared:
+  jsonable_encoder + json   what FastAPI did before it gained its pydantic-core path
+  pydantic dump_json        FastAPI's current path for response_model endpoints
+  model_dump + orjson       responses.dumps / FastJSONResponse
+  msgpack                   Accept: application/msgpack (re-encoded from the JSON body)
+
+Each encoding's size is shown raw, gzipped (level 6) and, if the brotli
+package is installed, brotli-compressed (quality 4), matching the
+CompressionMiddleware defaults.
+
+    cd backend && python -m benchmarks.bench_serialization --repeat 2000
+"""
+
+import argparse
+import json
+import timeit
+import zlib
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from main_osrm import LatLng, PlaceSuggestion, RouteSummary, TripResponse
+from polyline import encode
+from responses import BROTLI_AVAILABLE, MSGPACK_AVAILABLE, brotli, dumps, to_msgpack
+
+OSM_TAGS = {
+    "amenity": "restaurant",
+    "cuisine": "south_indian;vegetarian",
+    "diet:vegetarian": "only",
+    "opening_hours": "Mo-Su 07:00-22:30",
+    "addr:street": "NH 48",
+    "addr:city": "Krishnagiri",
+    "addr:postcode": "635001",
+    "phone": "+91 4343 123456",
+    "website": "https://example.org",
+    "wheelchair": "limited",
+    "outdoor_seating": "yes",
+    "takeaway": "yes",
+    "payment:cash": "yes",
+    "payment:upi": "yes",
+    "check_date": "2024-03-01",
+}
+
+
+def typical_plan() -> TripResponse:
+    def suggestion(meal: str, i: int) -> PlaceSuggestion:
+        name = f"{meal.title()} Stop {i}"
+        return PlaceSuggestion(
+            osm_id=str(4_000_000_000 + 97 * i),
+            name=name,
+            location=LatLng(lat=12.52 + i / 97, lng=78.21 + i / 89),
+            detour_minutes=3 + i,
+            eta_iso="2024-01-15T13:05:00",
+            tags={**OSM_TAGS, "name": name},
+            personalization_score=3.25 - i / 10,
+            match_reasons=["Vegetarian friendly", "Within budget", "Quick stop for your pace"],
+        )
+
+    # ~350 km drive, simplified to a few hundred vertices like the medium level
+    route = [[77.5946 + 2.676 * t / 400, 12.9716 + 0.111 * t / 400 + 0.02 * ((t * 7) % 13) / 13] for t in range(401)]
+    return TripResponse(
+        trip_id="temp_20240115080000",
+        recommended_departure_iso="2024-01-15T08:12:45",
+        recommended_departure_window=["2024-01-15T07:57:45", "2024-01-15T08:27:45"],
+        route_summary=RouteSummary(
+            total_distance_km=346.2, total_duration_min=371.5, stops=[], geometry=[],
+            polyline={"medium": encode(route)}, polyline_precision=5,
+        ),
+        meal_suggestions={meal: [suggestion(meal, i) for i in range(5)] for meal in ("lunch", "dinner")},
+        personalization_used=True,
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=2000)
+    args = ap.parse_args()
+
+    plan = typical_plan()
+    adapter = TypeAdapter(TripResponse)
+    json_body = adapter.dump_json(plan)
+
+    encoders = {
+        "jsonable_encoder + json": lambda: json.dumps(jsonable_encoder(plan), ensure_ascii=False, allow_nan=False,
+                                                      separators=(",", ":")).encode(),
+        "pydantic dump_json": lambda: adapter.dump_json(plan),
+        "model_dump + orjson": lambda: dumps(plan.model_dump(mode="json")),
+    }
+    if MSGPACK_AVAILABLE:
+        encoders["msgpack (from JSON)"] = lambda: to_msgpack(json_body)
+
+    print(f"Two-meal TripResponse, {args.repeat} runs each")
+    header = f"{'encoder':<26}{'us/op':>9}{'bytes':>8}{'gzip':>8}"
+    print(header + (f"{'br':>8}" if BROTLI_AVAILABLE else ""))
+    for name, fn in encoders.items():
+        seconds = timeit.timeit(fn, number=args.repeat) / args.repeat
+        body = fn()
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+        gz_size = len(gz.compress(body) + gz.flush())
+        row = f"{name:<26}{seconds * 1e6:>9.0f}{len(body):>8}{gz_size:>8}"
+        if BROTLI_AVAILABLE:
+            row += f"{len(brotli.compress(body, quality=4)):>8}"
+        print(row)
+    if not BROTLI_AVAILABLE:
+        print("(brotli not installed; responses are gzip-only)")
+
+
+if __name__ == "__main__":
+    main()
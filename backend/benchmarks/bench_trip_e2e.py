@@ -0,0 +1,200 @@
+"""
+End-to-end latency and throughput of POST /trips/create.
+
+Requests go through the whole FastAPI app in-process (httpx ASGITransport,
+app lifespan included) while OSRM and Overpass are local stand-ins with
+injected latency. Each concurrency level sends ``--requests`` copies of the
+payload (test_request.json by default) from that many concurrent clients
+and reports p50/p95/p99 latency, throughput, and upstream calls per
+request. Results are also written as JSON so runs can be compared.
+
+The stand-ins replay a fixture recorded from the real services (anything
+not in it falls back to synthetic responses). No fixture is committed, so
+record one once, with network access:
+
+    cd backend && python -m benchmarks.bench_trip_e2e --record
+    python -m benchmarks.bench_trip_e2e --osrm-latency 0.03 --overpass-latency 0.3 --concurrency 1,4,16
+
+Without a fixture the run stops, unless --synthetic asks for made-up
+routes and places. Those exercise the same code paths, but their numbers
+are not comparable with fixture runs.
+
+Caches are cleared before every request so each one pays for its upstream
+calls; pass --warm to measure the cached path instead. All requests carry
+the same payload, so at higher concurrency single-flight coalesces some of
+their upstream calls, which shows up as fewer calls per request.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+import main_osrm
+from benchmarks.fake_upstreams import FakeUpstreamServer, RecordingHandler, ReplayHandler, synthetic_handler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PAYLOAD = os.path.join(HERE, "..", "test_request.json")
+DEFAULT_FIXTURE = os.path.join(HERE, "fixtures", "bangalore_chennai.json")
+REAL_OSRM = "https://router.project-osrm.org"
+REAL_OVERPASS = "https://overpass-api.de/api/interpreter"
+
+
+def _clear_caches():
+    main_osrm.route_cache.clear()
+    main_osrm.duration_cache.clear()
+    main_osrm.timeline_cache.clear()
+    main_osrm.polyline_cache.clear()
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=HERE).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def _run_level(client: httpx.AsyncClient, payload: Dict, servers: List[FakeUpstreamServer],
+                     concurrency: int, requests: int, warm: bool) -> Dict:
+    for server in servers:
+        server.reset_stats()
+    pending = iter(range(requests))
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            if not warm:
+                _clear_caches()
+            start = time.perf_counter()
+            r = await client.post("/trips/create", json=payload)
+            latencies.append(time.perf_counter() - start)
+            if r.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    upstream = {name: server.requests / requests for name, server in zip(("osrm", "overpass"), servers)}
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2),
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "max_ms": round(float(ms.max()), 1),
+        "upstream_calls_per_request": {k: round(v, 2) for k, v in upstream.items()},
+    }
+
+
+async def run(args) -> Dict:
+    with open(args.payload) as f:
+        payload = json.load(f)
+
+    replay = None
+    if args.record:
+        handler = RecordingHandler(REAL_OSRM, REAL_OVERPASS)
+    elif args.synthetic:
+        handler = synthetic_handler
+    elif os.path.exists(args.fixture):
+        handler = replay = ReplayHandler(args.fixture)
+    else:
+        raise SystemExit(f"No fixture at {args.fixture}: record one with --record (network required), "
+                         f"or pass --synthetic to use made-up upstream responses")
+
+    async with FakeUpstreamServer(handler, latency=args.osrm_latency) as osrm, \
+            FakeUpstreamServer(handler, latency=args.overpass_latency) as overpass:
+        main_osrm.OSRM_BASE_URL = osrm.base_url
+        main_osrm.OVERPASS_URL = f"{overpass.base_url}/api/interpreter"
+        # The SQLite tile cache would turn every request after the first into a cache hit
+        main_osrm.POI_CACHE_PATH = ""
+
+        transport = httpx.ASGITransport(app=main_osrm.app)
+        async with main_osrm.lifespan(main_osrm.app), \
+                httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            if args.record:
+                _clear_caches()
+                r = await client.post("/trips/create", json=payload)
+                r.raise_for_status()
+                handler.save(args.fixture, payload=os.path.basename(args.payload))
+                await handler.close()
+                print(f"Recorded {len(handler.responses)} upstream responses to {args.fixture}")
+                return {}
+
+            # One untimed request so imports, pools and lazy setup are out of the way
+            _clear_caches()
+            await client.post("/trips/create", json=payload)
+
+            levels = [await _run_level(client, payload, [osrm, overpass], c, args.requests, args.warm)
+                      for c in args.concurrency]
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "payload": os.path.basename(args.payload),
+        "upstreams": "fixture" if replay else "synthetic",
+        "fixture_misses": replay.misses if replay else None,
+        "osrm_latency_s": args.osrm_latency,
+        "overpass_latency_s": args.overpass_latency,
+        "cache": "warm" if args.warm else "cold",
+        "levels": levels,
+    }
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--payload", default=DEFAULT_PAYLOAD, help="TripRequest JSON to send")
+    ap.add_argument("--fixture", default=DEFAULT_FIXTURE, help="recorded upstream responses to replay")
+    ap.add_argument("--record", action="store_true", help="record --fixture from the public OSRM/Overpass servers")
+    ap.add_argument("--synthetic", action="store_true",
+                    help="answer with made-up routes and places instead of replaying --fixture")
+    ap.add_argument("--osrm-latency", type=float, default=0.03, help="seconds injected per OSRM request")
+    ap.add_argument("--overpass-latency", type=float, default=0.3, help="seconds injected per Overpass request")
+    ap.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16])
+    ap.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    ap.add_argument("--warm", action="store_true", help="keep route/duration caches between requests")
+    ap.add_argument("--out", default=os.path.join(HERE, "results", "trip_e2e.json"))
+    args = ap.parse_args()
+
+    results = asyncio.run(run(args))
+    if not results:
+        return
+
+    print(f"/trips/create, {results['upstreams']} upstreams, {results['cache']} caches, latency "
+          f"osrm {args.osrm_latency * 1000:.0f} ms / overpass {args.overpass_latency * 1000:.0f} ms")
+    print(f"{'conc':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'osrm/req':>10}{'ovp/req':>9}")
+    for level in results["levels"]:
+        calls = level["upstream_calls_per_request"]
+        print(f"{level['concurrency']:>5}{level['throughput_rps']:>9.2f}{level['p50_ms']:>9.1f}"
+              f"{level['p95_ms']:>9.1f}{level['p99_ms']:>9.1f}{level['errors']:>8}"
+              f"{calls['osrm']:>10.2f}{calls['overpass']:>9.2f}")
+    if results["upstreams"] == "synthetic":
+        print("Note: synthetic upstream responses, not comparable with runs replaying a recorded fixture")
+    elif results["fixture_misses"]:
+        print(f"Note: {results['fixture_misses']} upstream requests were not in the fixture and got synthetic answers")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
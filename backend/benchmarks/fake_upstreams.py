@@ -0,0 +1,300 @@
+"""
+Local stand-ins for the OSRM and Overpass servers used by the benchmarks.
+
+The server is a deliberately small HTTP/1.1 implementation on top of
+asyncio streams so that it can count TCP connections exactly and inject a
+fixed latency per request without pulling in another web framework.
+
+Handlers decide what it answers: ``synthetic_handler`` makes up plausible
+responses, ``RecordingHandler`` forwards to the real OSRM/Overpass and
+keeps every response, and ``ReplayHandler`` serves a recorded fixture
+(falling back to another handler for requests it has not seen).
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote_plus, urlsplit
+
+import httpx
+
+# handler(method, path, query, body) -> (status, json payload)
+Handler = Callable[[str, str, Dict[str, str], bytes], Awaitable[Tuple[int, Dict]]]
+
+
+class FakeUpstreamServer:
+    def __init__(self, handler: Handler, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.handler = handler
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def reset_stats(self):
+        self.connections = 0
+        self.requests = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = b""
+                length = int(headers.get("content-length", "0"))
+                if length:
+                    body = await reader.readexactly(length)
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                parts = urlsplit(target)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                try:
+                    status, payload = await self.handler(method, unquote_plus(parts.path), query, body)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+
+# ----------------------------
+# Synthetic upstream behaviour
+# ----------------------------
+def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    R = 6371000.0
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    x = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * R * math.asin(math.sqrt(x))
+
+
+def _parse_coords(path: str) -> List[Tuple[float, float]]:
+    coords = path.rsplit("/", 1)[-1]
+    return [tuple(float(v) for v in c.split(",")) for c in coords.split(";")]
+
+
+def synthetic_route(coords: List[Tuple[float, float]], speed_mps: float = 16.0, step_m: float = 5000.0) -> Dict:
+    """Straight-line OSRM-shaped route through lon,lat coords with a step every ``step_m``."""
+    legs = []
+    geometry = [list(coords[0])]
+    total_d = total_t = 0.0
+    for (lon1, lat1), (lon2, lat2) in zip(coords, coords[1:]):
+        dist = _haversine_m(lat1, lon1, lat2, lon2)
+        n = max(1, int(dist // step_m))
+        steps = []
+        for i in range(1, n + 1):
+            f = i / n
+            loc = [lon1 + (lon2 - lon1) * f, lat1 + (lat2 - lat1) * f]
+            geometry.append(loc)
+            steps.append({"maneuver": {"location": loc}, "duration": dist / n / speed_mps, "distance": dist / n})
+        legs.append({"steps": steps, "duration": dist / speed_mps, "distance": dist,
+                     "annotation": {"duration": [dist / n / speed_mps] * n}})
+        total_d += dist
+        total_t += dist / speed_mps
+    return {
+        "duration": total_t,
+        "distance": total_d,
+        "geometry": {"type": "LineString", "coordinates": geometry},
+        "legs": legs,
+    }
+
+
+def synthetic_table(coords: List[Tuple[float, float]], query: Dict[str, str], speed_mps: float = 16.0) -> Dict:
+    def indices(key):
+        raw = query.get(key)
+        if not raw or raw == "all":
+            return list(range(len(coords)))
+        return [int(i) for i in raw.split(";")]
+
+    durations = [
+        [_haversine_m(coords[s][1], coords[s][0], coords[d][1], coords[d][0]) * 1.3 / speed_mps for d in indices("destinations")]
+        for s in indices("sources")
+    ]
+    return {"code": "Ok", "durations": durations}
+
+
+_AROUND_RE = re.compile(r"around:(\d+),(-?[\d.]+),(-?[\d.]+)\)")
+_BBOX_RE = re.compile(r"\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)")
+
+
+def _restaurant(osm_id: int, lat: float, lon: float, i: int) -> Dict:
+    return {
+        "type": "node",
+        "id": osm_id,
+        "lat": lat,
+        "lon": lon,
+        "tags": {
+            "amenity": "restaurant",
+            "name": f"Stand-in Restaurant {i}",
+            "cuisine": ["indian", "vegetarian", "chicken", "regional"][i % 4],
+        },
+    }
+
+
+def synthetic_overpass(body: bytes, per_point: int = 8) -> Dict:
+    """
+    A handful of restaurants scattered around every ``around:`` filter in the
+    query, and a small grid of them inside every bbox filter.
+    """
+    q = parse_qs(body.decode()).get("data", [""])[0]
+    elements = []
+    seen = set()
+    for south, west, north, east in _BBOX_RE.findall(q):
+        south, west, north, east = float(south), float(west), float(north), float(east)
+        key = (south, west, north, east)
+        if key in seen:
+            continue
+        seen.add(key)
+        side = max(1, int(math.sqrt(per_point)))
+        for i in range(side * side):
+            lat = south + (north - south) * (i // side + 0.5) / side
+            lon = west + (east - west) * (i % side + 0.5) / side
+            elements.append(_restaurant(abs(hash(key + (i,))) % 10**10, lat, lon, i))
+    for radius, lat, lon in _AROUND_RE.findall(q):
+        lat, lon, radius = float(lat), float(lon), int(radius)
+        key = (lat, lon, radius)
+        if key in seen:
+            continue
+        seen.add(key)
+        for i in range(per_point):
+            angle = 2 * math.pi * i / per_point
+            dist = radius * (i + 1) / (per_point + 1)
+            elements.append(_restaurant(
+                abs(hash((lat, lon, i))) % 10**10,
+                lat + dist / 111320.0 * math.sin(angle),
+                lon + dist / (111320.0 * math.cos(math.radians(lat))) * math.cos(angle),
+                i,
+            ))
+    return {"elements": elements}
+
+
+async def synthetic_handler(method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict]:
+    if path.startswith("/route/"):
+        return 200, {"code": "Ok", "routes": [synthetic_route(_parse_coords(path))]}
+    if path.startswith("/table/"):
+        return 200, synthetic_table(_parse_coords(path), query)
+    if path.endswith("/interpreter"):
+        return 200, synthetic_overpass(body)
+    return 404, {"error": f"unknown path {path}"}
+
+
+# ----------------------------
+# Recorded fixtures
+# ----------------------------
+def fixture_key(method: str, path: str, query: Dict[str, str], body: bytes) -> str:
+    key = f"{method} {path}"
+    if query:
+        key += "?" + "&".join(f"{k}={v}" for k, v in sorted(query.items()))
+    if body:
+        key += "#" + hashlib.sha1(body).hexdigest()[:16]
+    return key
+
+
+class RecordingHandler:
+    """Forward to the real upstreams and remember each (request -> response)."""
+
+    def __init__(self, osrm_base_url: str, overpass_url: str):
+        self.osrm_base_url = osrm_base_url.rstrip("/")
+        self.overpass_url = overpass_url
+        self.responses: Dict[str, Dict] = {}
+        self._client = httpx.AsyncClient(timeout=60)
+
+    async def __call__(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict]:
+        if path.endswith("/interpreter"):
+            r = await self._client.post(self.overpass_url, content=body,
+                                        headers={"Content-Type": "application/x-www-form-urlencoded"})
+        else:
+            r = await self._client.request(method, self.osrm_base_url + path, params=query)
+        payload = r.json()
+        self.responses[fixture_key(method, path, query, body)] = {"status": r.status_code, "body": payload}
+        return r.status_code, payload
+
+    def save(self, path: str, **meta):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                       **meta, "responses": self.responses}, f)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class ReplayHandler:
+    """Serve responses from a fixture written by RecordingHandler.save."""
+
+    def __init__(self, fixture_path: str, fallback: Optional[Handler] = synthetic_handler):
+        with open(fixture_path) as f:
+            self.responses: Dict[str, Dict] = json.load(f)["responses"]
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+
+    async def __call__(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict]:
+        recorded = self.responses.get(fixture_key(method, path, query, body))
+        if recorded is not None:
+            self.hits += 1
+            return recorded["status"], recorded["body"]
+        self.misses += 1
+        if self.fallback is None:
+            return 404, {"error": f"no recorded response for {method} {path}"}
+        return await self.fallback(method, path, query, body)
@@ -0,0 +1,147 @@
+"""
+Replay traffic captured by traffic_capture.py (TRAFFIC_CAPTURE_FILE)
+against a running server.
+
+Requests are sent on the captured schedule: at the original pace with
+--speed 1, or compressed by that factor (--speed 10 sends an hour of
+traffic in six minutes). They are not held back by slow responses, so the
+server sees the captured arrival pattern rather than a closed loop.
+--speed 0 sends everything as fast as --max-inflight allows. Rotated
+files (capture.jsonl.1, .2, ...) are read too, oldest first.
+
+    cd backend && python -m benchmarks.replay_traffic traffic.jsonl --target http://localhost:8000 --speed 10
+
+Reports latency percentiles and error rates per endpoint, how far sends
+fell behind schedule, and, with --out, saves the same numbers as JSON.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+
+def load_capture(path: str) -> List[Dict]:
+    # RotatingFileHandler keeps the oldest records in the highest-numbered file
+    rotated = [p for p in glob.glob(glob.escape(path) + ".*") if p.rsplit(".", 1)[1].isdigit()]
+    rotated.sort(key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+    entries = []
+    for name in rotated + [path]:
+        if not os.path.exists(name):
+            continue
+        with open(name) as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda e: e["ts"])
+    return entries
+
+
+def _summary(latencies: List[float], statuses: Counter) -> Dict:
+    total = sum(statuses.values())
+    errors = sum(n for status, n in statuses.items() if status == "error" or int(status) >= 400)
+    result = {"requests": total, "errors": errors, "error_rate": round(errors / total, 4) if total else 0.0,
+              "statuses": dict(sorted(statuses.items()))}
+    if latencies:
+        ms = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        result.update(p50_ms=round(float(p50), 1), p95_ms=round(float(p95), 1),
+                      p99_ms=round(float(p99), 1), max_ms=round(float(ms.max()), 1))
+    return result
+
+
+async def replay(entries: List[Dict], target: str, speed: float, max_inflight: int, timeout: float) -> Dict:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    lag: List[float] = []
+    inflight = asyncio.Semaphore(max_inflight)
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits) as client:
+        async def send(entry: Dict):
+            try:
+                start = time.perf_counter()
+                r = await client.request(entry["method"], entry["path"], json=entry["body"])
+                latencies[entry["path"]].append(time.perf_counter() - start)
+                statuses[entry["path"]][str(r.status_code)] += 1
+            except httpx.HTTPError:
+                statuses[entry["path"]]["error"] += 1
+            finally:
+                inflight.release()
+
+        tasks = []
+        t0, ts0 = time.perf_counter(), entries[0]["ts"]
+        for entry in entries:
+            if speed > 0:
+                due = t0 + (entry["ts"] - ts0) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await inflight.acquire()
+            if speed > 0:
+                lag.append(max(time.perf_counter() - due, 0.0))
+            tasks.append(asyncio.create_task(send(entry)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+
+    all_latencies = [x for values in latencies.values() for x in values]
+    all_statuses = sum(statuses.values(), Counter())
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "target": target,
+        "speed": speed,
+        "captured_span_s": round(entries[-1]["ts"] - ts0, 3),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(entries) / wall, 2) if wall else None,
+        "max_send_lag_ms": round(max(lag) * 1000, 1) if lag else None,
+        "overall": _summary(all_latencies, all_statuses),
+        "by_path": {path: _summary(latencies[path], statuses[path]) for path in sorted(statuses)},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("capture", help="JSONL file written by the capture middleware")
+    ap.add_argument("--target", default="http://localhost:8000")
+    ap.add_argument("--speed", type=float, default=1.0, help="time compression factor; 0 = no pacing")
+    ap.add_argument("--max-inflight", type=int, default=64, help="cap on concurrent requests")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--path", action="append", help="only replay this endpoint (repeatable)")
+    ap.add_argument("--limit", type=int, help="replay only the first N captured requests")
+    ap.add_argument("--out", help="write the report as JSON")
+    args = ap.parse_args()
+
+    entries = load_capture(args.capture)
+    if args.path:
+        entries = [e for e in entries if e["path"] in args.path]
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit(f"No captured requests in {args.capture}")
+
+    report = asyncio.run(replay(entries, args.target, args.speed, args.max_inflight, args.timeout))
+
+    print(f"Replayed {len(entries)} requests ({report['captured_span_s']:.1f}s captured) in {report['wall_s']:.1f}s "
+          f"against {args.target}, {report['throughput_rps']} req/s")
+    if report["max_send_lag_ms"] is not None:
+        print(f"Max lag behind the captured schedule: {report['max_send_lag_ms']:.1f} ms")
+    print(f"{'endpoint':<22}{'requests':>9}{'err %':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for path, s in list(report["by_path"].items()) + [("all", report["overall"])]:
+        print(f"{path:<22}{s['requests']:>9}{s['error_rate'] * 100:>8.1f}{s.get('p50_ms', 0):>9.1f}"
+              f"{s.get('p95_ms', 0):>9.1f}{s.get('p99_ms', 0):>9.1f}{s.get('max_ms', 0):>9.1f}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
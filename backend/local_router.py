@@ -0,0 +1,751 @@
+"""
+In-process road router built from a local OSM extract.
+
+``build`` turns the drivable highways of an ``.osm.pbf`` (needs ``osmium``)
+or ``.osm`` XML extract into a compressed-sparse-row graph over road
+junctions (way ends and nodes shared by several ways), saved as ``.npy``
+files. The nodes between two junctions only shape the road, so each such
+chain becomes one edge. Its shape points are kept in per-chain arrays,
+with seconds and meters from the chain's start, for snapping, geometry
+and per-segment annotations. At startup the arrays are memory-mapped, so
+every worker shares the same pages:
+
+    python local_router.py build bengaluru.osm.pbf -o road_graph
+    python local_router.py route road_graph 12.9716,77.5946 12.9352,77.6245
+
+A coordinate snaps to the nearest shape point. A search starts from the
+junctions at either end of that point's chain (only the one ahead on a
+one-way street), with the seconds along the chain as head start.
+
+The build also contracts the graph into a contraction hierarchy: every
+node gets a rank, and shortcut edges keep shortest paths intact as the
+less important nodes are removed. A query then only searches upward in
+rank, from both ends. Routes are a bidirectional search that meets at the
+path's highest node; shortcuts are unpacked into road edges afterwards.
+Duration tables are bucket-based many-to-many: one backward upward search
+per destination leaves (destination, seconds) in a bucket at every node it
+reaches, and one forward upward search per source reads the buckets. Both
+return OSRM-shaped results so main_osrm can swap this in for the HTTP server
+with ROUTING_BACKEND=local.
+
+Contraction is the slow part of a build, so builds stop at MAX_GRAPH_NODES
+junctions, which is a city. A synthetic city of 250,000 junctions and 2
+million shape points takes about two minutes and 1.2 GB
+(benchmarks/bench_local_router.py). Larger areas should go through OSRM.
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+GRAPH_VERSION = 3
+# Junctions a build accepts: contraction time grows faster than the graph
+MAX_GRAPH_NODES = int(os.getenv("LOCAL_ROUTER_MAX_NODES", "250000"))
+
+# Default speeds (km/h) for drivable highway types
+HIGHWAY_SPEEDS = {
+    "motorway": 100, "trunk": 80, "primary": 65, "secondary": 55, "tertiary": 45,
+    "unclassified": 35, "residential": 25, "living_street": 10, "service": 15,
+    "motorway_link": 60, "trunk_link": 50, "primary_link": 45, "secondary_link": 40, "tertiary_link": 35,
+}
+# Routes are split into steps of roughly this many seconds (OSRM-style checkpoints)
+STEP_SECONDS = 60.0
+
+Way = Tuple[List[int], Dict[str, str]]
+
+
+def way_speed_kmh(tags: Dict[str, str]) -> Optional[float]:
+    highway = tags.get("highway")
+    if highway not in HIGHWAY_SPEEDS or tags.get("access") in ("no", "private"):
+        return None
+    speed = HIGHWAY_SPEEDS[highway]
+    maxspeed = tags.get("maxspeed", "").split()[0] if tags.get("maxspeed") else ""
+    if maxspeed.isdigit():
+        speed = min(speed, int(maxspeed)) if int(maxspeed) > 0 else speed
+    return float(speed)
+
+
+def way_direction(tags: Dict[str, str]) -> int:
+    """1 forward only, -1 backward only, 0 both ways."""
+    oneway = tags.get("oneway", "")
+    if oneway in ("yes", "true", "1"):
+        return 1
+    if oneway == "-1":
+        return -1
+    if oneway == "no":
+        return 0
+    if tags.get("highway") == "motorway" or tags.get("junction") == "roundabout":
+        return 1
+    return 0
+
+
+# ----------------------------
+# Extract readers
+# ----------------------------
+def _read_osm_xml(path: str) -> Tuple[Dict[int, Tuple[float, float]], Iterator[Way]]:
+    # Nodes come before ways in the file, so the drivable ways are collected
+    # first and a second pass keeps only the coordinates they use
+    ways: List[Way] = []
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+            if way_speed_kmh(tags) is not None:
+                ways.append(([int(nd.get("ref")) for nd in el.iter("nd")], tags))
+            el.clear()
+        elif el.tag == "node":
+            el.clear()
+    wanted = {ref for refs, _ in ways for ref in refs}
+    coords: Dict[int, Tuple[float, float]] = {}
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "node":
+            osm_id = int(el.get("id"))
+            if osm_id in wanted:
+                coords[osm_id] = (float(el.get("lat")), float(el.get("lon")))
+            el.clear()
+        elif el.tag == "way":
+            el.clear()
+    return coords, iter(ways)
+
+
+def _read_pbf(path: str) -> Tuple[Dict[int, Tuple[float, float]], Iterator[Way]]:
+    try:
+        import osmium
+    except ImportError:
+        sys.exit("Reading .osm.pbf needs the osmium package (pip install osmium)")
+
+    coords: Dict[int, Tuple[float, float]] = {}
+    ways: List[Way] = []
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            tags = dict(w.tags)
+            if way_speed_kmh(tags) is None:
+                return
+            refs = []
+            for nd in w.nodes:
+                if nd.location.valid():
+                    coords[nd.ref] = (nd.location.lat, nd.location.lon)
+                    refs.append(nd.ref)
+            ways.append((refs, tags))
+
+    Handler().apply_file(path, locations=True)
+    return coords, iter(ways)
+
+
+# ----------------------------
+# Graph build
+# ----------------------------
+def _cell_keys(lats: np.ndarray, lons: np.ndarray, cell_deg: float) -> np.ndarray:
+    rows = np.floor((lats + 90.0) / cell_deg).astype(np.int64)
+    cols = np.floor((lons + 180.0) / cell_deg).astype(np.int64)
+    return (rows << 32) | cols
+
+
+def contract_graph(n: int, frm: np.ndarray, to: np.ndarray, seconds: np.ndarray,
+                   witness_settles: int = 64) -> Tuple[np.ndarray, List[Tuple[int, int, float, int]]]:
+    """
+    Contract the nodes one at a time, least important first. Importance is
+    twice the shortcuts a node needs minus the edges it removes, plus its
+    contracted neighbours and its depth in the hierarchy so far (which
+    spreads contraction evenly over the map). It is re-evaluated lazily when
+    a node comes up. Removing v adds a shortcut u->w of d(u,v)+d(v,w) unless
+    a witness search from u (bounded to witness_settles nodes) finds a path
+    at least as short that avoids v; a missed witness only costs a
+    superfluous shortcut. Returns every node's rank and the hierarchy's
+    edges as (from, to, seconds, middle), middle being the node a shortcut
+    bypasses or -1 for a road segment.
+    """
+    out: List[Dict[int, Tuple[float, int]]] = [{} for _ in range(n)]
+    inn: List[Dict[int, Tuple[float, int]]] = [{} for _ in range(n)]
+    for a, b, w in zip(frm.tolist(), to.tolist(), seconds.tolist()):
+        if a != b and w < out[a].get(b, (math.inf,))[0]:
+            out[a][b] = inn[b][a] = (w, -1)
+
+    def shortcuts(v: int) -> List[Tuple[int, int, float]]:
+        needed = []
+        outs = out[v]
+        if not outs or not inn[v]:
+            return needed
+        max_out = max(w for w, _ in outs.values())
+        for u, (wu, _) in inn[v].items():
+            limit = wu + max_out
+            dist = {u: 0.0}
+            heap = [(0.0, u)]
+            settled = 0
+            unsettled = len(outs) - (u in outs)
+            while heap and settled < witness_settles and unsettled:
+                d, x = heapq.heappop(heap)
+                if d > limit:
+                    break
+                if d > dist[x]:
+                    continue
+                settled += 1
+                if x in outs and x != u:
+                    unsettled -= 1
+                for y, (w, _) in out[x].items():
+                    nd = d + w
+                    if y != v and nd < dist.get(y, math.inf):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            for x, (wx, _) in outs.items():
+                if x != u and dist.get(x, math.inf) > wu + wx:
+                    needed.append((u, x, wu + wx))
+        return needed
+
+    contracted_neighbours = [0] * n
+    level = [0] * n
+
+    def priority(v: int, needed: List) -> int:
+        return 2 * len(needed) - len(inn[v]) - len(out[v]) + contracted_neighbours[v] + level[v]
+
+    queue = [(priority(v, shortcuts(v)), v) for v in range(n)]
+    heapq.heapify(queue)
+    rank = np.empty(n, dtype=np.int32)
+    edges: List[Tuple[int, int, float, int]] = []
+    next_rank = 0
+    while queue:
+        _, v = heapq.heappop(queue)
+        needed = shortcuts(v)
+        p = priority(v, needed)
+        if queue and p > queue[0][0]:
+            heapq.heappush(queue, (p, v))
+            continue
+        rank[v] = next_rank
+        next_rank += 1
+        # v's remaining edges all lead to higher-ranked nodes: they are final
+        for x, (w, middle) in out[v].items():
+            edges.append((v, x, w, middle))
+            del inn[x][v]
+            contracted_neighbours[x] += 1
+            level[x] = max(level[x], level[v] + 1)
+        for u, (w, middle) in inn[v].items():
+            edges.append((u, v, w, middle))
+            del out[u][v]
+            contracted_neighbours[u] += 1
+            level[u] = max(level[u], level[v] + 1)
+        out[v], inn[v] = {}, {}
+        for u, x, w in needed:
+            if w < out[u].get(x, (math.inf,))[0]:
+                out[u][x] = inn[x][u] = (w, v)
+    return rank, edges
+
+
+def _haversine_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    x = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(x, 1.0)))
+
+
+def build_graph(extract_path: str, out_dir: str, cell_deg: float = 0.01,
+                max_nodes: int = MAX_GRAPH_NODES) -> Tuple[int, int]:
+    reader = _read_osm_xml if extract_path.endswith(".osm") else _read_pbf
+    coords, ways = reader(extract_path)
+
+    # Drivable ways as (OSM node refs, m/s, drivable both ways); oneway=-1 is turned around
+    roads: List[Tuple[List[int], float, bool]] = []
+    uses: Dict[int, int] = {}
+    for refs, tags in ways:
+        refs = [r for r in refs if r in coords]
+        refs = [r for i, r in enumerate(refs) if i == 0 or r != refs[i - 1]]
+        if len(refs) < 2:
+            continue
+        direction = way_direction(tags)
+        if direction < 0:
+            refs.reverse()
+        roads.append((refs, way_speed_kmh(tags) / 3.6, direction == 0))
+        for r in refs:
+            uses[r] = uses.get(r, 0) + 1
+    if not roads:
+        raise ValueError(f"No drivable roads found in {extract_path}")
+
+    # Split the ways at junctions (way ends and nodes used more than once):
+    # each piece is a chain of shape points that becomes one graph edge
+    node_ids: Dict[int, int] = {}
+    point_refs: List[int] = []
+    chain_indptr = [0]
+    chain_speed: List[float] = []
+    chain_both: List[bool] = []
+    for refs, speed, both in roads:
+        start = 0
+        for i in range(1, len(refs)):
+            if i == len(refs) - 1 or uses[refs[i]] > 1:
+                point_refs.extend(refs[start:i + 1])
+                chain_indptr.append(len(point_refs))
+                chain_speed.append(speed)
+                chain_both.append(both)
+                node_ids.setdefault(refs[start], len(node_ids))
+                node_ids.setdefault(refs[i], len(node_ids))
+                start = i
+    n = len(node_ids)
+    if n > max_nodes:
+        raise ValueError(
+            f"{extract_path} has {n} road junctions; the local router builds graphs of up to {max_nodes} "
+            "(a city). Cut a smaller area out with `osmium extract --bbox`, or route through OSRM."
+        )
+
+    point_lat = np.array([coords[r][0] for r in point_refs], dtype=np.float64)
+    point_lon = np.array([coords[r][1] for r in point_refs], dtype=np.float64)
+    chain_indptr_a = np.array(chain_indptr, dtype=np.int64)
+    chain_start, chain_end = chain_indptr_a[:-1], chain_indptr_a[1:] - 1
+    # Seconds and meters from the start of the point's chain
+    step_m = np.zeros(len(point_refs))
+    step_m[1:] = _haversine_m(point_lat[:-1], point_lon[:-1], point_lat[1:], point_lon[1:])
+    step_m[chain_start] = 0.0
+    chain_points = np.diff(chain_indptr_a)
+    step_s = step_m / np.repeat(np.array(chain_speed), chain_points)
+    point_meters = np.cumsum(step_m)
+    point_seconds = np.cumsum(step_s)
+    point_meters -= np.repeat(point_meters[chain_start], chain_points)
+    point_seconds -= np.repeat(point_seconds[chain_start], chain_points)
+
+    lats = np.empty(n, dtype=np.float64)
+    lons = np.empty(n, dtype=np.float64)
+    for osm_id, i in node_ids.items():
+        lats[i], lons[i] = coords[osm_id]
+
+    # Renumber junctions in grid-cell order, so searches touch nearby memory
+    order = np.argsort(_cell_keys(lats, lons, cell_deg), kind="stable")
+    new_id = np.empty(n, dtype=np.int64)
+    new_id[order] = np.arange(n)
+    chain_from = new_id[np.array([node_ids[point_refs[i]] for i in chain_start], dtype=np.int64)]
+    chain_to = new_id[np.array([node_ids[point_refs[i]] for i in chain_end], dtype=np.int64)]
+    both_a = np.array(chain_both, dtype=bool)
+
+    # One edge per chain and direction; a closed loop with one junction is only kept for snapping.
+    # ``chain`` is the chain index, or ~index for a chain driven against its point order.
+    chains = np.arange(len(chain_speed), dtype=np.int64)
+    forward = chain_from != chain_to
+    backward = forward & both_a
+    src_a = np.concatenate([chain_from[forward], chain_to[backward]])
+    dst_a = np.concatenate([chain_to[forward], chain_from[backward]])
+    chain_a = np.concatenate([chains[forward], ~chains[backward]])
+    dur_a = np.concatenate([point_seconds[chain_end][forward], point_seconds[chain_end][backward]]).astype(np.float32)
+    len_a = np.concatenate([point_meters[chain_end][forward], point_meters[chain_end][backward]]).astype(np.float32)
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    def save(name, arr):
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+
+    save("lat", lats[order])
+    save("lon", lons[order])
+    save("point_lat", point_lat)
+    save("point_lon", point_lon)
+    save("point_seconds", point_seconds)
+    save("point_meters", point_meters)
+    save("chain_indptr", chain_indptr_a)
+    save("chain_from", chain_from.astype(np.int32))
+    save("chain_to", chain_to.astype(np.int32))
+    save("chain_both", both_a.astype(np.uint8))
+    # Snapping index: every shape point, in grid-cell order
+    point_keys = _cell_keys(point_lat, point_lon, cell_deg)
+    snap_order = np.argsort(point_keys, kind="stable")
+    cell_keys, cell_starts = np.unique(point_keys[snap_order], return_index=True)
+    save("snap_point", snap_order.astype(np.int64))
+    save("cell_keys", cell_keys)
+    save("cell_starts", np.append(cell_starts, len(point_refs)).astype(np.int64))
+
+    edge_order = np.argsort(src_a, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src_a, minlength=n), out=indptr[1:])
+    save("fwd_indptr", indptr)
+    save("fwd_indices", dst_a[edge_order].astype(np.int32))
+    save("fwd_duration", dur_a[edge_order])
+    save("fwd_length", len_a[edge_order])
+    save("fwd_chain", chain_a[edge_order].astype(np.int64))
+
+    rank, ch_edges = contract_graph(n, src_a, dst_a, dur_a)
+    ch = np.array(ch_edges, dtype=np.float64).reshape(-1, 4)
+    ch_from, ch_to, ch_middle = (ch[:, k].astype(np.int64) for k in (0, 1, 3))
+    upward = rank[ch_from] < rank[ch_to]
+    # "up": upward edges at their lower end; "down": downward edges reversed,
+    # also at their lower end, which is what a backward search walks up
+    for prefix, mask, at, other in (("up", upward, ch_from, ch_to), ("down", ~upward, ch_to, ch_from)):
+        at = at[mask]
+        edge_order = np.argsort(at, kind="stable")
+        ch_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(at, minlength=n), out=ch_indptr[1:])
+        save(f"{prefix}_indptr", ch_indptr)
+        save(f"{prefix}_indices", other[mask][edge_order].astype(np.int32))
+        save(f"{prefix}_duration", ch[mask, 2][edge_order])
+        save(f"{prefix}_middle", ch_middle[mask][edge_order].astype(np.int32))
+    save("rank", rank)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"version": GRAPH_VERSION, "cell_deg": cell_deg, "nodes": n, "edges": len(src_a),
+                   "points": len(point_refs), "chains": len(chain_speed),
+                   "shortcuts": int((ch_middle >= 0).sum()), "source": os.path.basename(extract_path)}, f, indent=2)
+    return n, len(src_a)
+
+
+# ----------------------------
+# Runtime router
+# ----------------------------
+class LocalRouter:
+    def __init__(self, graph_dir: str):
+        with open(os.path.join(graph_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != GRAPH_VERSION:
+            raise ValueError(f"Unsupported road graph version {meta.get('version')} in {graph_dir}")
+        self.cell_deg = float(meta["cell_deg"])
+
+        def load(name):
+            return np.load(os.path.join(graph_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.lat = load("lat")
+        self.lon = load("lon")
+        self.point_lat = load("point_lat")
+        self.point_lon = load("point_lon")
+        self.chain_indptr = load("chain_indptr")
+        self.snap_point = load("snap_point")
+        self.cell_keys = load("cell_keys")
+        self.cell_starts = load("cell_starts")
+        # memoryviews over the mapped arrays: element access returns plain
+        # Python numbers, which keeps the search loops fast without copying
+        self._point_lat = memoryview(self.point_lat)
+        self._point_lon = memoryview(self.point_lon)
+        self._point_seconds = memoryview(load("point_seconds"))
+        self._point_meters = memoryview(load("point_meters"))
+        self._chain_indptr = memoryview(self.chain_indptr)
+        self._chain_from = memoryview(load("chain_from"))
+        self._chain_to = memoryview(load("chain_to"))
+        self._chain_both = memoryview(load("chain_both"))
+        self._fwd = tuple(memoryview(load(f"fwd_{k}")) for k in ("indptr", "indices", "duration", "length", "chain"))
+        self._up = tuple(memoryview(load(f"up_{k}")) for k in ("indptr", "indices", "duration", "middle"))
+        self._down = tuple(memoryview(load(f"down_{k}")) for k in ("indptr", "indices", "duration", "middle"))
+
+    def __len__(self):
+        return len(self.lat)
+
+    # --- snapping ---
+    def snap(self, lat: float, lon: float, max_radius_m: float = 5000.0) -> int:
+        """Nearest road shape point to a coordinate."""
+        radius = self.cell_deg * 111320.0
+        while True:
+            dlat = math.degrees(radius / EARTH_RADIUS_M)
+            dlon = math.degrees(radius / (EARTH_RADIUS_M * max(math.cos(math.radians(lat)), 1e-6)))
+            r0 = int(math.floor((lat - dlat + 90.0) / self.cell_deg))
+            r1 = int(math.floor((lat + dlat + 90.0) / self.cell_deg))
+            c0 = int(math.floor((lon - dlon + 180.0) / self.cell_deg))
+            c1 = int(math.floor((lon + dlon + 180.0) / self.cell_deg))
+            chunks = []
+            for row in range(r0, r1 + 1):
+                lo = np.searchsorted(self.cell_keys, (row << 32) | c0, side="left")
+                hi = np.searchsorted(self.cell_keys, (row << 32) | c1, side="right")
+                if hi > lo:
+                    chunks.append(self.snap_point[self.cell_starts[lo]:self.cell_starts[hi]])
+            if chunks:
+                idx = np.concatenate(chunks)
+                d = (np.radians(self.point_lat[idx] - lat) ** 2
+                     + (np.radians(self.point_lon[idx] - lon) * math.cos(math.radians(lat))) ** 2)
+                best = int(idx[int(np.argmin(d))])
+                if math.sqrt(float(d.min())) * EARTH_RADIUS_M <= radius:
+                    return best
+            if radius >= max_radius_m:
+                raise ValueError(f"No road within {max_radius_m:.0f} m of {lat},{lon}")
+            radius = min(radius * 2, max_radius_m)
+
+    def _locate(self, lat: float, lon: float) -> Tuple[int, int]:
+        """(chain, point) of the nearest shape point."""
+        point = self.snap(lat, lon)
+        return int(np.searchsorted(self.chain_indptr, point, side="right")) - 1, point
+
+    def _seeds(self, chain: int, point: int, outbound: bool) -> Dict[int, float]:
+        """
+        Junctions a snapped point leaves by (outbound) or is reached from,
+        with the seconds along its chain in between.
+        """
+        start, end = self._chain_indptr[chain], self._chain_indptr[chain + 1] - 1
+        if point == start:
+            return {self._chain_from[chain]: 0.0}
+        if point == end:
+            return {self._chain_to[chain]: 0.0}
+        seconds = self._point_seconds
+        ahead, behind = seconds[end] - seconds[point], seconds[point] - seconds[start]
+        # with the chain's direction, and against it where that is allowed
+        seeds = {self._chain_to[chain]: ahead} if outbound else {self._chain_from[chain]: behind}
+        if self._chain_both[chain]:
+            node, cost = (self._chain_from[chain], behind) if outbound else (self._chain_to[chain], ahead)
+            if cost < seeds.get(node, math.inf):
+                seeds[node] = cost
+        return seeds
+
+    def _along_chain(self, source: Tuple[int, int], target: Tuple[int, int]) -> float:
+        """Seconds from source to target without leaving their chain (inf if they are not on one)."""
+        if source[0] != target[0]:
+            return math.inf
+        seconds = self._point_seconds
+        if target[1] >= source[1]:
+            return seconds[target[1]] - seconds[source[1]]
+        return seconds[source[1]] - seconds[target[1]] if self._chain_both[source[0]] else math.inf
+
+    # --- searches ---
+    def _shortest_path(self, sources: Dict[int, float], targets: Dict[int, float]) -> Tuple[float, Optional[List[int]]]:
+        """
+        Bidirectional search over the hierarchy: forward up from the source
+        seeds, backward up from the target seeds (over "down"), alternating.
+        A side stops once its frontier is no shorter than the best meeting so
+        far. Returns the seconds and the junctions of the path, shortcuts
+        unpacked, from a source seed to a target seed.
+        """
+        graphs = (self._up, self._down)
+        dist = (dict(sources), dict(targets))
+        parent = ({v: (-1, -1) for v in sources}, {v: (-1, -1) for v in targets})
+        heaps = ([(d, v) for v, d in sources.items()], [(d, v) for v, d in targets.items()])
+        for heap in heaps:
+            heapq.heapify(heap)
+        active = [True, True]
+        best, meet = math.inf, -1
+        while active[0] or active[1]:
+            for side in (0, 1):
+                heap = heaps[side]
+                if not active[side] or not heap or heap[0][0] >= best:
+                    active[side] = False
+                    continue
+                du, u = heapq.heappop(heap)
+                d = dist[side]
+                if du > d[u]:
+                    continue
+                other = dist[1 - side].get(u)
+                if other is not None and du + other < best:
+                    best, meet = du + other, u
+                indptr, indices, duration, middle = graphs[side]
+                for e in range(indptr[u], indptr[u + 1]):
+                    v = indices[e]
+                    nd = du + duration[e]
+                    if nd < d.get(v, math.inf):
+                        d[v] = nd
+                        parent[side][v] = (u, middle[e])
+                        heapq.heappush(heap, (nd, v))
+        if meet == -1:
+            return math.inf, None
+
+        # hierarchy edges in path order: (from, to, middle)
+        edges = []
+        v = meet
+        while parent[0][v][0] != -1:
+            u, middle = parent[0][v]
+            edges.append((u, v, middle))
+            v = u
+        edges.reverse()
+        path = [v]
+        v = meet
+        while parent[1][v][0] != -1:
+            u, middle = parent[1][v]
+            edges.append((v, u, middle))
+            v = u
+        for a, b, middle in edges:
+            self._unpack(a, b, middle, path)
+        return best, path
+
+    def _middle_of(self, graph: Tuple, at: int, other: int) -> int:
+        indptr, indices, duration, middle = graph
+        best, found = math.inf, -1
+        for e in range(indptr[at], indptr[at + 1]):
+            if indices[e] == other and duration[e] < best:
+                best, found = duration[e], middle[e]
+        return found
+
+    def _unpack(self, a: int, b: int, middle: int, path: List[int]):
+        """Append the junctions after a, up to b, of the hierarchy edge a->b."""
+        stack = [(a, b, middle)]
+        while stack:
+            a, b, middle = stack.pop()
+            if middle < 0:
+                path.append(b)
+                continue
+            # middle ranks below both ends: a->middle is a downward edge kept at
+            # middle in "down", middle->b an upward one kept at middle in "up"
+            stack.append((middle, b, self._middle_of(self._up, middle, b)))
+            stack.append((a, middle, self._middle_of(self._down, middle, a)))
+
+    def _upward(self, graph: Tuple, seeds: Dict[int, float]) -> Dict[int, float]:
+        """Every node reachable upward from the seeds, with its distance."""
+        indptr, indices, duration, _ = graph
+        dist = dict(seeds)
+        heap = [(d, v) for v, d in seeds.items()]
+        heapq.heapify(heap)
+        settled: Dict[int, float] = {}
+        while heap:
+            du, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled[u] = du
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = du + duration[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return settled
+
+    def _many_to_many(self, sources: Sequence[Dict[int, float]], targets: Sequence[Dict[int, float]]) -> List[List[float]]:
+        """
+        Seconds from every source to every target (inf if unreachable), each
+        given by its seeds. A shortest path's highest-ranked node is reached
+        by the forward search from its source and the backward one from its
+        target, both at their exact distance, so the buckets there hold the
+        answer.
+        """
+        buckets: Dict[int, List[Tuple[int, float]]] = {}
+        for j, seeds in enumerate(targets):
+            for v, d in self._upward(self._down, seeds).items():
+                buckets.setdefault(v, []).append((j, d))
+        rows = []
+        for seeds in sources:
+            row = [math.inf] * len(targets)
+            for v, d in self._upward(self._up, seeds).items():
+                for j, dj in buckets.get(v, ()):
+                    if d + dj < row[j]:
+                        row[j] = d + dj
+            rows.append(row)
+        return rows
+
+    def _edge(self, u: int, v: int) -> Tuple[float, float, int]:
+        """Seconds, meters and chain of the fastest road edge u->v."""
+        indptr, indices, duration, length, chain = self._fwd
+        best = None
+        for e in range(indptr[u], indptr[u + 1]):
+            if indices[e] == v and (best is None or duration[e] < best[0]):
+                best = (duration[e], length[e], chain[e])
+        return best
+
+    # --- geometry ---
+    def _edge_points(self, u: int, v: int) -> range:
+        chain = self._edge(u, v)[2]
+        if chain >= 0:
+            return range(self._chain_indptr[chain], self._chain_indptr[chain + 1])
+        chain = ~chain
+        return range(self._chain_indptr[chain + 1] - 1, self._chain_indptr[chain] - 1, -1)
+
+    def _partial_points(self, chain: int, point: int, node: int, outbound: bool) -> range:
+        """Shape points from a snapped point to the junction it leaves by, or from the junction it is reached from."""
+        start, end = self._chain_indptr[chain], self._chain_indptr[chain + 1] - 1
+        if point in (start, end):
+            return range(point, point + 1)
+        seconds = self._point_seconds
+        ahead, behind = seconds[end] - seconds[point], seconds[point] - seconds[start]
+        loop = self._chain_from[chain] == self._chain_to[chain] and self._chain_both[chain]
+        # the same choice _seeds made: with the chain's direction unless against it is shorter
+        if outbound:
+            if node == self._chain_to[chain] and not (loop and behind < ahead):
+                return range(point, end + 1)
+            return range(point, start - 1, -1)
+        if node == self._chain_from[chain] and not (loop and ahead < behind):
+            return range(start, point + 1)
+        return range(end, point - 1, -1)
+
+    # --- OSRM-shaped API ---
+    def route(self, points: Sequence[Tuple[float, float]]) -> Dict:
+        """Route through (lon, lat) points; returns an OSRM /route response body."""
+        located = [self._locate(lat, lon) for lon, lat in points]
+        seconds, meters = self._point_seconds, self._point_meters
+        legs = []
+        geometry: List[List[float]] = []
+        for a, b in zip(located, located[1:]):
+            direct = self._along_chain(a, b)
+            cost, path = self._shortest_path(self._seeds(*a, outbound=True), self._seeds(*b, outbound=False))
+            if path is None and direct == math.inf:
+                return {"code": "NoRoute", "message": "No route found"}
+            if direct <= cost:
+                step = 1 if b[1] >= a[1] else -1
+                pieces = [range(a[1], b[1] + step, step)]
+            else:
+                pieces = [self._partial_points(*a, path[0], outbound=True)]
+                pieces += [self._edge_points(u, v) for u, v in zip(path, path[1:])]
+                pieces.append(self._partial_points(*b, path[-1], outbound=False))
+
+            # Consecutive pieces share their junction; each segment is two points of one chain
+            seg_dur, seg_len = [], []
+            coords = [[self._point_lon[pieces[0][0]], self._point_lat[pieces[0][0]]]]
+            for piece in pieces:
+                for p, q in zip(piece, piece[1:]):
+                    seg_dur.append(round(abs(seconds[q] - seconds[p]), 1))
+                    seg_len.append(round(abs(meters[q] - meters[p]), 1))
+                    coords.append([self._point_lon[q], self._point_lat[q]])
+            geometry.extend(coords if not geometry else coords[1:])
+
+            # Group segments into ~STEP_SECONDS steps; maneuver at each step start
+            steps = []
+            start, acc_d, acc_l = 0, 0.0, 0.0
+            for i, (d, l) in enumerate(zip(seg_dur, seg_len)):
+                acc_d += d
+                acc_l += l
+                if acc_d >= STEP_SECONDS or i == len(seg_dur) - 1:
+                    steps.append({"maneuver": {"location": coords[start]}, "duration": acc_d, "distance": acc_l})
+                    start, acc_d, acc_l = i + 1, 0.0, 0.0
+            steps.append({"maneuver": {"location": coords[-1]}, "duration": 0.0, "distance": 0.0})
+            legs.append({
+                "duration": sum(seg_dur),
+                "distance": sum(seg_len),
+                "steps": steps,
+                "annotation": {"duration": seg_dur, "distance": seg_len},
+            })
+        route = {
+            "duration": sum(leg["duration"] for leg in legs),
+            "distance": sum(leg["distance"] for leg in legs),
+            "geometry": {"type": "LineString", "coordinates": geometry},
+            "legs": legs,
+        }
+        return {"code": "Ok", "routes": [route]}
+
+    def table(self, points: Sequence[Tuple[float, float]], sources: Optional[Sequence[int]] = None,
+              destinations: Optional[Sequence[int]] = None) -> Dict:
+        """Duration matrix between (lon, lat) points; returns an OSRM /table response body."""
+        located = [self._locate(lat, lon) for lon, lat in points]
+        sources = list(range(len(points))) if sources is None else list(sources)
+        destinations = list(range(len(points))) if destinations is None else list(destinations)
+        found = self._many_to_many([self._seeds(*located[i], outbound=True) for i in sources],
+                                   [self._seeds(*located[j], outbound=False) for j in destinations])
+        for row, i in zip(found, sources):
+            for k, j in enumerate(destinations):
+                row[k] = min(row[k], self._along_chain(located[i], located[j]))
+        durations = [[round(d, 1) if d < math.inf else None for d in row] for row in found]
+        return {"code": "Ok", "durations": durations}
+
+
+def _parse_point(text: str) -> Tuple[float, float]:
+    lat, lon = (float(v) for v in text.split(","))
+    return lon, lat
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build and query the local road graph")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="build the CSR road graph from an .osm.pbf or .osm extract")
+    b.add_argument("extract")
+    b.add_argument("-o", "--out", default="road_graph")
+    b.add_argument("--cell-deg", type=float, default=0.01, help="snapping grid cell size in degrees")
+    b.add_argument("--max-nodes", type=int, default=MAX_GRAPH_NODES, help="refuse extracts with more junctions")
+
+    r = sub.add_parser("route", help="route between lat,lon points")
+    r.add_argument("graph")
+    r.add_argument("points", nargs="+", type=_parse_point, help="lat,lon")
+
+    args = ap.parse_args()
+    if args.command == "build":
+        try:
+            nodes, edges = build_graph(args.extract, args.out, args.cell_deg, args.max_nodes)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"Built road graph with {nodes} junctions and {edges} edges in {args.out}")
+    else:
+        router = LocalRouter(args.graph)
+        result = router.route(args.points)
+        if result["code"] != "Ok":
+            sys.exit(result.get("message", "No route"))
+        route = result["routes"][0]
+        print(f"{route['distance'] / 1000:.1f} km, {route['duration'] / 60:.1f} min, "
+              f"{len(route['geometry']['coordinates'])} points")
+
+
+if __name__ == "__main__":
+    main()
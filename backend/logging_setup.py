@@ -0,0 +1,171 @@
+"""
+Logging pipeline: the request path only enqueues records.
+
+setup_logging() gives the root logger a single QueueHandler. Records are
+filtered (per-logger sampling) and stamped with the current request ID on
+the calling thread, then handed to a QueueListener thread that does all
+formatting and I/O: a size-rotated log file plus the console, as one JSON
+object per line (LOG_FORMAT=json, the default) or the old text layout.
+
+Large payload dumps belong at DEBUG with %-style arguments (or lazy()), so
+nothing is rendered unless DEBUG is enabled, and then only on the listener
+thread.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "request_id", "color_message",
+}
+
+
+class lazy:
+    """Defer building an expensive log argument until a handler renders it."""
+
+    def __init__(self, fn: Callable[[], object]):
+        self.fn = fn
+
+    def __str__(self):
+        return str(self.fn())
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a fraction of a logger's records below WARNING. ``rates`` maps
+    logger names to keep-probabilities and applies to child loggers too.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, probe = 1.0, name
+            while probe:
+                if probe in self.rates:
+                    rate = self.rates[probe]
+                    break
+                probe = probe.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text or record.exc_info:
+            entry["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare() renders the message on the calling thread; here
+    that is the listener's job. Tracebacks are still rendered up front so
+    the record does not keep frames alive while it waits in the queue.
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+class _Listener(logging.handlers.QueueListener):
+    def prepare(self, record):
+        # Render once here rather than once per sink
+        try:
+            record.msg = record.getMessage()
+        except Exception:
+            record.msg = f"{record.msg} (unformattable args: {record.args!r})"
+        record.args = None
+        return record
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """``"httpx=0.01,main_osrm=0.5"`` -> {"httpx": 0.01, "main_osrm": 0.5}"""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, rate = part.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", log_file: Optional[str] = "routivity.log", fmt: str = "json",
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                  sampling: Optional[Dict[str, float]] = None) -> logging.handlers.QueueListener:
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    sinks = [logging.StreamHandler()]
+    if log_file:
+        sinks.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = _Listener(log_queue, *sinks, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush everything still queued; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
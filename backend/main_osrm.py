@@ -1,12 +1,23 @@
 import os
 import math
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, time as dtime
-from typing import List, Optional, Tuple, Dict, Any
+from typing import AsyncIterator, List, Optional, Sequence, Tuple, Dict, Any
 import json
+import heapq
+import bisect
+import re
+import base64
+import uuid
+import time
 
 import httpx
-from fastapi import FastAPI, HTTPException, Depends
+import numpy as np
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.datastructures import Default
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dateutil import parser as dateparser
@@ -14,12 +25,33 @@ import uvicorn
 import firebase_admin
 from firebase_admin import credentials, firestore
 from google.cloud.firestore_v1 import Client as FirestoreClient
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("routivity.log"), logging.StreamHandler()],
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from local_router import LocalRouter
+from logging_setup import lazy, parse_sampling, request_id_var, setup_logging
+from meal_sequence import plan_meal_stops
+from metrics import RequestTimings, REQUEST_SECONDS, STAGE_SECONDS, record_upstream, render as render_metrics, request_timings, stage, timed
+from places_offline import OfflinePlacesIndex
+from poi_cache import PoiCache
+from preferences import PreferenceService
+from responses import (CompressionMiddleware, FastJSONResponse, MSGPACK_AVAILABLE, MSGPACK_MEDIA_TYPE, accepts_msgpack,
+                       dumps, to_msgpack)
+from polyline import encode as encode_polyline, simplify as simplify_polyline
+from poi_flags import NON_VEG, OVERPASS_VEG_CUISINE_HIT, OVERPASS_VEG_NAME_HIT, VEG_FRIENDLY, classify_place, place_class
+from scoring import CompiledScorer
+from singleflight import SingleFlight
+from traffic_capture import TrafficRecorder
+from trip_writer import WriteBehindQueue
+from ttl_cache import TTLCache, quantize
+
+# Configure logging: records are queued and written by a background thread
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    log_file=os.getenv("LOG_FILE", "routivity.log") or None,
+    fmt=os.getenv("LOG_FORMAT", "json"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+    sampling=parse_sampling(os.getenv("LOG_SAMPLING", "")),
 )
 logger = logging.getLogger(__name__)
 
@@ -43,7 +75,134 @@ except Exception as e:
     logger.warning(f"Firebase Admin initialization failed: {e}. Some features may not work.")
     db = None
 
-app = FastAPI(title="Routivity — Trip Planner Backend MVP")
+# ----------------------------
+# Upstream HTTP clients
+# ----------------------------
+# One pooled client per upstream so OSRM and Overpass calls reuse keep-alive
+# connections instead of paying TCP/TLS setup on every request.
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Server-side limit sent with the multi-tile and corridor Overpass queries
+OVERPASS_QUERY_TIMEOUT = int(os.getenv("OVERPASS_QUERY_TIMEOUT", "60"))
+# Read timeouts of the pooled clients, used by every request. Overpass's has
+# to outlast the [timeout:N] the queries themselves carry (OVERPASS_QUERY_TIMEOUT)
+UPSTREAM_TIMEOUTS = {
+    "osrm": float(os.getenv("OSRM_TIMEOUT", "20")),
+    "overpass": float(os.getenv("OVERPASS_TIMEOUT", "75")),
+}
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.getenv("HTTP2_ENABLED", "1") != "0"
+
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _build_http_client(upstream: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(UPSTREAM_TIMEOUTS[upstream], connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=HTTP2_ENABLED)
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """Return the shared pooled client for an upstream ("osrm" or "overpass").
+
+    Clients are normally created by the app lifespan; scripts that call the
+    helpers without running the app get one lazily.
+    """
+    client = _http_clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _build_http_client(upstream)
+        _http_clients[upstream] = client
+    return client
+
+
+async def close_http_clients():
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+# Identical concurrent upstream requests share one in-flight call
+_singleflight: Dict[str, SingleFlight] = {upstream: SingleFlight() for upstream in UPSTREAM_TIMEOUTS}
+
+
+async def upstream_json(upstream: str, method: str, url: str, params: Optional[Dict[str, Any]] = None,
+                        data: Optional[Dict[str, Any]] = None, timeout: Any = httpx.USE_CLIENT_DEFAULT) -> Any:
+    """
+    Send a request through the upstream's pooled client and return the JSON
+    body. Concurrent calls with the same method, URL, params and form body
+    are coalesced into one request; its result or error goes to every caller.
+    The client's timeouts apply unless ``timeout`` overrides them (None
+    means no timeout at all, as in httpx).
+    """
+    key = (
+        method,
+        url,
+        tuple(sorted((params or {}).items())),
+        tuple(sorted((data or {}).items())),
+    )
+
+    async def send():
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            r = await get_http_client(upstream).request(method, url, params=params, data=data, timeout=timeout)
+            outcome = str(r.status_code)
+            r.raise_for_status()
+            return r.json()
+        finally:
+            record_upstream(upstream, time.perf_counter() - start, outcome)
+
+    return await _singleflight[upstream].do(key, send)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for upstream in UPSTREAM_TIMEOUTS:
+        get_http_client(upstream)
+    # Fail at startup rather than on the first trip if a local index is missing
+    get_offline_places()
+    get_local_router()
+    if PLACES_PROVIDER != "offline":
+        # Opening the SQLite file would otherwise happen on the loop, in the first trip
+        get_poi_cache()
+    if trip_writer is not None:
+        trip_writer.start()
+    logger.info(
+        f"Upstream pools ready: max_connections={HTTP_POOL_MAX_CONNECTIONS} "
+        f"keepalive={HTTP_POOL_MAX_KEEPALIVE} http2={HTTP2_ENABLED}"
+    )
+    try:
+        yield
+    finally:
+        if trip_writer is not None:
+            # Everything already acknowledged to a client gets written before exit
+            await trip_writer.close()
+        await close_http_clients()
+        logger.info("Upstream pools closed")
+        if _poi_cache is not None:
+            _poi_cache.close()
+        if preference_service is not None:
+            preference_service.close()
+        if traffic_recorder is not None:
+            traffic_recorder.close()
+
+
+# Default() keeps FastAPI's pydantic-core fast path for endpoints with a response_model
+app = FastAPI(title="Routivity — Trip Planner Backend MVP", lifespan=lifespan,
+              default_response_class=Default(FastJSONResponse))
 
 # CORS middleware
 app.add_middleware(
@@ -54,6 +213,131 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+MSGPACK_ENABLED = MSGPACK_AVAILABLE and os.getenv("MSGPACK_ENABLED", "1") != "0"
+
+
+async def msgpack_middleware(request: Request, call_next):
+    """MessagePack instead of JSON for clients that send Accept: application/msgpack"""
+    response = await call_next(request)
+    response.headers.add_vary_header("Accept")
+    if not (accepts_msgpack(request.headers.get("accept", ""))
+            and response.headers.get("content-type", "").startswith("application/json")):
+        return response
+    # Endpoints render JSON (for response models, in pydantic-core); re-encoding is cheaper than a second path
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    packed = Response(to_msgpack(body), status_code=response.status_code, media_type=MSGPACK_MEDIA_TYPE)
+    packed.raw_headers += [(k, v) for k, v in response.raw_headers if k not in (b"content-length", b"content-type")]
+    return packed
+
+
+if MSGPACK_ENABLED:
+    app.middleware("http")(msgpack_middleware)
+
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tag every log record of a request with its ID (X-Request-ID if the client sent one)"""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    Request latency histogram plus a Server-Timing header with the per-stage
+    breakdown. The histogram runs until the last body chunk is sent, so a
+    streamed plan counts in full. The header goes out before the body, so
+    its total is the time to the first byte.
+    """
+    timings = RequestTimings()
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+
+    def observe(status: str):
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                path=getattr(route, "path", "unmatched"), status=status)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        observe("500")
+        raise
+    finally:
+        request_timings.reset(token)
+    elapsed = time.perf_counter() - start
+    handler = timings.stages.pop("handler", None)
+    if handler is not None:
+        # Response validation and JSON encoding happen after the endpoint returns
+        serialize = max(elapsed - handler, 0.0)
+        timings.add("serialize", serialize)
+        STAGE_SECONDS.observe(serialize, stage="serialize")
+    response.headers["Server-Timing"] = timings.server_timing(elapsed)
+    body_iterator = response.body_iterator
+
+    async def timed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            observe(str(response.status_code))
+
+    response.body_iterator = timed_body()
+    return response
+
+
+# Sanitized /trips/create (plain and streamed) and /trips/finalize bodies for
+# benchmarks/replay_traffic.py; off unless TRAFFIC_CAPTURE_FILE is set
+TRAFFIC_CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE", "")
+traffic_recorder = TrafficRecorder(
+    TRAFFIC_CAPTURE_FILE,
+    max_bytes=int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024))),
+    backup_count=int(os.getenv("TRAFFIC_CAPTURE_BACKUP_COUNT", "5")),
+    sample_rate=float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0")),
+    salt=os.getenv("TRAFFIC_CAPTURE_SALT", ""),
+) if TRAFFIC_CAPTURE_FILE else None
+
+
+async def traffic_capture_middleware(request: Request, call_next):
+    if not traffic_recorder.wants(request.method, request.url.path):
+        return await call_next(request)
+    ts = time.time()
+    start = time.perf_counter()
+    body = await request.body()
+    response = await call_next(request)
+    body_iterator = response.body_iterator
+
+    async def recorded_body():
+        # A streamed plan is still running when the headers go out: record once it is sent
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            traffic_recorder.record(request.method, request.url.path, body, response.status_code,
+                                    time.perf_counter() - start, ts=ts)
+
+    response.body_iterator = recorded_body()
+    return response
+
+
+if traffic_recorder is not None:
+    app.middleware("http")(traffic_capture_middleware)
+
+# Added last so it wraps everything else, including streamed responses
+if os.getenv("COMPRESSION_ENABLED", "1") != "0":
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+        gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+        brotli_quality=int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4")),
+    )
+
 # ----------------------------
 # Enhanced Models
 # ----------------------------
@@ -85,6 +369,8 @@ class TripRequest(BaseModel):
     max_detour_minutes: int = 15
     meal_duration_min: int = 30
     user_id: Optional[str] = None  # Add user_id to fetch preferences
+    geometry_levels: List[str] = ["medium"]  # keys of POLYLINE_LEVELS
+    polyline_precision: int = 5  # 5 or 6 decimals
 
 class PlaceSuggestion(BaseModel):
     osm_id: str
@@ -101,6 +387,8 @@ class RouteSummary(BaseModel):
     total_duration_min: float
     stops: List[str]
     geometry: List[List[float]]
+    polyline: Dict[str, str] = {}  # level -> encoded polyline
+    polyline_precision: int = 5
 
 class TripResponse(BaseModel):
     trip_id: str
@@ -108,6 +396,7 @@ class TripResponse(BaseModel):
     recommended_departure_window: List[str]
     route_summary: RouteSummary
     meal_suggestions: Dict[str, List[PlaceSuggestion]]
+    recommended_meal_stops: Dict[str, str] = {}  # meal -> osm_id of the stop the departure assumes
     personalization_used: bool = False
 
 class FinalizeTripRequest(BaseModel):
@@ -119,40 +408,64 @@ class FinalizeTripRequest(BaseModel):
 # ----------------------------
 # Firebase Helper Functions
 # ----------------------------
+def _preferences_from_doc(data: Dict[str, Any]) -> UserPreferences:
+    return UserPreferences(
+        foodPreference=data.get("foodPreference", "any"),
+        budget=data.get("budget", "moderate"),
+        pace=data.get("pace", "balanced"),
+        mood=data.get("mood", "adventure"),
+        companions=data.get("companions", "solo"),
+        activities=data.get("activities", []),
+        accessibility=data.get("accessibility", "none")
+    )
+
+
+# Cached for PREFERENCES_CACHE_TTL seconds and refreshed by Firestore listeners;
+# PREFERENCES_WATCH=0 turns the listeners off and relies on the TTL alone
+PREFERENCES_CACHE_TTL = float(os.getenv("PREFERENCES_CACHE_TTL", "600"))
+PREFERENCES_CACHE_SIZE = int(os.getenv("PREFERENCES_CACHE_SIZE", "10000"))
+PREFERENCES_WATCH = os.getenv("PREFERENCES_WATCH", "1") != "0"
+PREFERENCES_MAX_LISTENERS = int(os.getenv("PREFERENCES_MAX_LISTENERS", "1000"))
+preference_service: Optional[PreferenceService] = (
+    PreferenceService(db, _preferences_from_doc, ttl=PREFERENCES_CACHE_TTL, maxsize=PREFERENCES_CACHE_SIZE,
+                      watch=PREFERENCES_WATCH, max_watches=PREFERENCES_MAX_LISTENERS)
+    if db else None
+)
+
+
 async def get_user_preferences(user_id: str) -> Optional[UserPreferences]:
-    """Fetch user preferences from Firebase"""
-    if not db:
+    """Fetch user preferences from Firebase (cached; the read runs off the event loop)"""
+    if not preference_service:
         logger.warning("Firebase not initialized, cannot fetch user preferences")
         return None
     
     try:
-        doc_ref = db.collection("preferences").document(user_id)
-        doc = doc_ref.get()
-        
-        if doc.exists:
-            data = doc.to_dict()
-            logger.info(f"Retrieved preferences for user {user_id}: {data}")
-            
-            return UserPreferences(
-                foodPreference=data.get("foodPreference", "any"),
-                budget=data.get("budget", "moderate"),
-                pace=data.get("pace", "balanced"),
-                mood=data.get("mood", "adventure"),
-                companions=data.get("companions", "solo"),
-                activities=data.get("activities", []),
-                accessibility=data.get("accessibility", "none")
-            )
+        prefs = await preference_service.get(user_id)
+        if prefs:
+            logger.debug("Retrieved preferences for user %s: %s", user_id, prefs)
         else:
             logger.warning(f"No preferences found for user {user_id}")
-            return None
+        return prefs
             
     except Exception as e:
         logger.error(f"Error fetching user preferences: {e}")
         return None
 
+# Trip documents are written behind the response, grouped into WriteBatch commits
+TRIP_WRITE_BATCH_SIZE = int(os.getenv("TRIP_WRITE_BATCH_SIZE", "100"))
+TRIP_WRITE_MAX_DELAY = float(os.getenv("TRIP_WRITE_MAX_DELAY", "0.25"))
+TRIP_WRITE_QUEUE_SIZE = int(os.getenv("TRIP_WRITE_QUEUE_SIZE", "10000"))
+TRIP_WRITE_MAX_RETRIES = int(os.getenv("TRIP_WRITE_MAX_RETRIES", "5"))
+trip_writer: Optional[WriteBehindQueue] = (
+    WriteBehindQueue(db, "trips", max_batch=TRIP_WRITE_BATCH_SIZE, max_delay=TRIP_WRITE_MAX_DELAY,
+                     max_queue=TRIP_WRITE_QUEUE_SIZE, max_retries=TRIP_WRITE_MAX_RETRIES)
+    if db else None
+)
+
+
 async def save_trip_to_firebase(trip_data: Dict[str, Any]) -> str:
-    """Save trip data to Firebase and return trip ID"""
-    if not db:
+    """Queue trip data for Firebase and return its trip ID without waiting for the write"""
+    if not trip_writer:
         logger.warning("Firebase not initialized, cannot save trip")
         return "local_" + datetime.utcnow().strftime("%Y%m%d%H%M%S")
     
@@ -163,10 +476,14 @@ async def save_trip_to_firebase(trip_data: Dict[str, Any]) -> str:
         trip_data["created_at"] = firestore.SERVER_TIMESTAMP
         trip_data["status"] = "planned"  # planned, active, completed
         
-        doc_ref = db.collection("trips").document(trip_id)
-        doc_ref.set(trip_data)
+        try:
+            trip_writer.submit(trip_id, trip_data)
+        except asyncio.QueueFull:
+            # Backlog is full: write this one inline (still off the event loop)
+            logger.warning(f"Trip write queue full ({trip_writer.depth}), saving {trip_id} inline")
+            await asyncio.to_thread(db.collection("trips").document(trip_id).set, trip_data)
         
-        logger.info(f"Trip saved to Firebase with ID: {trip_id}")
+        logger.info(f"Trip {trip_id} queued for Firebase")
         return trip_id
         
     except Exception as e:
@@ -283,7 +600,8 @@ def calculate_personalization_score(place: Dict, user_prefs: UserPreferences, de
 # ----------------------------
 def score_place_enhanced(place: Dict, detour_minutes: int, user_prefs: UserPreferences, max_detour: int) -> Tuple[float, List[str]]:
     """
-    Enhanced scoring that combines personalization with basic factors
+    Enhanced scoring that combines personalization with basic factors.
+    Request handling uses scoring.CompiledScorer; this stays as its reference.
     """
     # Get personalization score
     personalization_score, match_reasons = calculate_personalization_score(
@@ -314,28 +632,92 @@ def score_place_enhanced(place: Dict, detour_minutes: int, user_prefs: UserPrefe
 # ----------------------------
 # OSRM ROUTING
 # ----------------------------
-OSRM_BASE_URL = "http://router.project-osrm.org"
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+OSRM_BASE_URL = os.getenv("OSRM_BASE_URL", "http://router.project-osrm.org")
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+
+# Route and duration-matrix results are cached on coordinates rounded to
+# ROUTE_CACHE_PRECISION decimals (4 ~ 11 m), bounded by entry count and TTL.
+ROUTE_CACHE_PRECISION = int(os.getenv("ROUTE_CACHE_PRECISION", "4"))
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "3600"))
+route_cache = TTLCache(maxsize=int(os.getenv("ROUTE_CACHE_MAX_ROUTES", "256")), ttl=ROUTE_CACHE_TTL)
+duration_cache = TTLCache(maxsize=int(os.getenv("DURATION_CACHE_MAX_CELLS", "50000")), ttl=ROUTE_CACHE_TTL)
+
+
+def _route_cache_key(*points: LatLng) -> Tuple:
+    return tuple(quantize(p.lat, p.lng, ROUTE_CACHE_PRECISION) for p in points)
+
+
+# Routing backend: "osrm" (HTTP server at OSRM_BASE_URL) or "local" (in-process
+# router over a graph built by local_router.py). Both speak OSRM's JSON shapes.
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "osrm")
+LOCAL_ROUTER_GRAPH = os.getenv("LOCAL_ROUTER_GRAPH", "road_graph")
+
+_local_router: Optional[LocalRouter] = None
 
-async def call_osrm_route(origin: LatLng, destination: LatLng, waypoints: List[LatLng] = None) -> Dict:
-    # ... (keep existing implementation exactly as is)
-    coords = f"{origin.lng},{origin.lat}"
-    if waypoints:
-        coords += ";" + ";".join([f"{p.lng},{p.lat}" for p in waypoints])
-    coords += f";{destination.lng},{destination.lat}"
 
-    url = f"{OSRM_BASE_URL}/route/v1/driving/{coords}"
-    params = {"overview": "full", "geometries": "geojson", "steps": "true"}
+def get_local_router() -> Optional[LocalRouter]:
+    """The memory-mapped local router when ROUTING_BACKEND=local, else None."""
+    global _local_router
+    if ROUTING_BACKEND != "local":
+        return None
+    if _local_router is None:
+        _local_router = LocalRouter(LOCAL_ROUTER_GRAPH)
+        logger.info(f"Local router loaded from {LOCAL_ROUTER_GRAPH} ({len(_local_router)} nodes)")
+    return _local_router
+
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
+async def call_osrm_route(origin: LatLng, destination: LatLng, waypoints: List[LatLng] = None) -> Dict:
+    points = [origin, *(waypoints or []), destination]
+    cache_key = _route_cache_key(*points)
+    cached = route_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    router = get_local_router()
+    if router is not None:
+        # CPU-bound search: keep it off the event loop
+        data = await asyncio.to_thread(router.route, [(p.lng, p.lat) for p in points])
+    else:
+        coords = _coords_for_table(*points)
+        url = f"{OSRM_BASE_URL}/route/v1/driving/{coords}"
+        params = {"overview": "full", "geometries": "geojson", "steps": "true", "annotations": "duration"}
+        data = await upstream_json("osrm", "GET", url, params=params)
 
     if "routes" not in data:
         raise HTTPException(status_code=502, detail="OSRM routing failed")
 
-    return data["routes"][0]
+    route = data["routes"][0]
+    route_cache.set(cache_key, route)
+    return route
+
+
+# Douglas-Peucker tolerances in metres, roughly one screen pixel at zoom 15 / 12 / 9
+POLYLINE_LEVELS = {"full": 0.0, "high": 5.0, "medium": 30.0, "low": 200.0}
+polyline_cache = TTLCache(maxsize=int(os.getenv("POLYLINE_CACHE_SIZE", "1024")), ttl=ROUTE_CACHE_TTL)
+
+
+async def route_polylines(route_key: Tuple, route: Dict, levels: List[str], precision: int) -> Dict[str, str]:
+    """Encoded polyline of the route at each requested level, cached alongside the route"""
+    polylines = {}
+    missing = []
+    for level in levels:
+        cached = polyline_cache.get((route_key, level, precision))
+        if cached is None:
+            missing.append(level)
+        else:
+            polylines[level] = cached
+    if missing:
+        coords = (route.get("geometry") or {}).get("coordinates") or []
+
+        def build():
+            return {level: encode_polyline(simplify_polyline(coords, POLYLINE_LEVELS[level]), precision)
+                    for level in missing}
+
+        # Tens of milliseconds for a long route; keep it off the event loop
+        for level, encoded in (await asyncio.to_thread(build)).items():
+            polyline_cache.set((route_key, level, precision), encoded)
+            polylines[level] = encoded
+    return {level: polylines[level] for level in levels}
 
 
 # ----------------------------
@@ -343,23 +725,14 @@ async def call_osrm_route(origin: LatLng, destination: LatLng, waypoints: List[L
 # ----------------------------
 
 
-async def search_places(lat: float, lon: float, radius: int = 2000, query: str = "restaurant") -> List[Dict]:
-    # ... (keep existing implementation exactly as is)
-    q = f"""
-    [out:json][timeout:25];
-    (
-      node["amenity"="{query}"](around:{radius},{lat},{lon});
-      way["amenity"="{query}"](around:{radius},{lat},{lon});
-      relation["amenity"="{query}"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(OVERPASS_URL, data={"data": q})
-        r.raise_for_status()
-        data = r.json()
+# Overpass results are tiered by distance from the meal point; the closest
+# tier with places wins. Only the largest radius is ever queried.
+SEARCH_RADII = [3000, 7000, 15000]
+# Fetch the places for every meal of a trip with one Overpass query
+OVERPASS_CORRIDOR_MODE = os.getenv("OVERPASS_CORRIDOR_MODE", "1") != "0"
+
 
-    elements = data.get("elements", [])
+def _places_from_elements(elements: List[Dict]) -> List[Dict]:
     places = []
     for el in elements:
         if "tags" not in el:
@@ -373,44 +746,284 @@ async def search_places(lat: float, lon: float, radius: int = 2000, query: str =
                 "tags": el.get("tags", {}),
             }
         )
+        classify_place(places[-1])
+    return places
+
+
+# Tile cache in front of Overpass; set POI_CACHE_PATH="" to disable
+POI_CACHE_PATH = os.getenv("POI_CACHE_PATH", "poi_cache.sqlite3")
+POI_CACHE_ZOOM = int(os.getenv("POI_CACHE_ZOOM", "12"))
+POI_CACHE_TTL = float(os.getenv("POI_CACHE_TTL", str(7 * 86400)))
+POI_CACHE_NEGATIVE_TTL = float(os.getenv("POI_CACHE_NEGATIVE_TTL", "86400"))
+POI_CACHE_MAX_TILES = int(os.getenv("POI_CACHE_MAX_TILES", "20000"))
+
+_poi_cache: Optional[PoiCache] = None
+
+
+def get_poi_cache() -> Optional[PoiCache]:
+    global _poi_cache
+    if _poi_cache is None and POI_CACHE_PATH:
+        try:
+            _poi_cache = PoiCache(
+                POI_CACHE_PATH,
+                zoom=POI_CACHE_ZOOM,
+                ttl=POI_CACHE_TTL,
+                negative_ttl=POI_CACHE_NEGATIVE_TTL,
+                max_tiles=POI_CACHE_MAX_TILES,
+            )
+            logger.info(f"POI cache opened at {POI_CACHE_PATH} (zoom {POI_CACHE_ZOOM})")
+        except Exception as e:
+            logger.warning(f"POI cache unavailable ({e}), querying Overpass directly")
+            return None
+    return _poi_cache
+
+
+# Where search_places gets its data: "overpass" (public API behind the POI
+# cache) or "offline" (index built by places_offline.py from a local extract)
+PLACES_PROVIDER = os.getenv("PLACES_PROVIDER", "overpass")
+OFFLINE_PLACES_INDEX = os.getenv("OFFLINE_PLACES_INDEX", "places_index")
+
+_offline_places: Optional[OfflinePlacesIndex] = None
+
+
+def get_offline_places() -> Optional[OfflinePlacesIndex]:
+    """The memory-mapped offline index when PLACES_PROVIDER=offline, else None."""
+    global _offline_places
+    if PLACES_PROVIDER != "offline":
+        return None
+    if _offline_places is None:
+        _offline_places = OfflinePlacesIndex(OFFLINE_PLACES_INDEX)
+        logger.info(f"Offline places index loaded from {OFFLINE_PLACES_INDEX} ({len(_offline_places)} places)")
+    return _offline_places
+
+
+async def _overpass_query(q: str) -> List[Dict]:
+    data = await upstream_json("overpass", "POST", OVERPASS_URL, data={"data": q})
+    # A query that hit its timeout or memory limit still answers 200, with
+    # whatever it had found so far and a "remark"; that is no answer to cache
+    if data.get("remark"):
+        raise RuntimeError(f"Overpass returned an incomplete result: {data['remark']}")
+    return _places_from_elements(data.get("elements", []))
+
+
+def _overpass_union(query: str, filters: List[str], timeout: int = 25) -> str:
+    sets = "\n".join(
+        f"""      node["amenity"="{query}"]({f});
+      way["amenity"="{query}"]({f});
+      relation["amenity"="{query}"]({f});"""
+        for f in filters
+    )
+    return f"""
+    [out:json][timeout:{timeout}];
+    (
+{sets}
+    );
+    out center;
+    """
+
+
+async def _fill_poi_cache(cache: PoiCache, tiles: List[Tuple[int, int]], query: str):
+    """
+    Fetch the missing/expired tiles in one Overpass bbox query and store them.
+    If the query fails or comes back incomplete, nothing is stored.
+    """
+    missing = await asyncio.to_thread(cache.missing_tiles, query, tiles)
+    if not missing:
+        return
+    bboxes = [",".join(f"{v:.6f}" for v in cache.tile_bbox(t)) for t in missing]
+    places = await _overpass_query(_overpass_union(query, bboxes, timeout=OVERPASS_QUERY_TIMEOUT))
+    await asyncio.to_thread(cache.put_tiles, query, missing, places)
+    logger.info(f"POI cache filled {len(missing)} of {len(set(tiles))} tiles with {len(places)} places")
+
+
+async def search_places(lat: float, lon: float, radius: int = 2000, query: str = "restaurant") -> List[Dict]:
+    offline = get_offline_places()
+    if offline is not None:
+        return await asyncio.to_thread(offline.radius_query, lat, lon, radius, query)
+
+    cache = get_poi_cache()
+    if cache is None:
+        return await _overpass_query(_overpass_union(query, [f"around:{radius},{lat},{lon}"]))
+
+    await _fill_poi_cache(cache, cache.covering_tiles(lat, lon, radius), query)
+    return await asyncio.to_thread(cache.query_radius, query, lat, lon, radius)
+
+
+async def search_places_corridor(points: List[LatLng], radius: int = 2000, query: str = "restaurant") -> List[List[Dict]]:
+    """
+    Corridor mode: one Overpass request with an ``around:`` set per point
+    (or, with the POI cache, one request for every tile not cached yet).
+    The combined result is split back into one candidate list per point
+    (a place near two points shows up in both), in Overpass response order.
+    """
+    if not points:
+        return []
+
+    offline = get_offline_places()
+    if offline is not None:
+        return await asyncio.to_thread(lambda: [offline.radius_query(p.lat, p.lng, radius, query) for p in points])
+
+    cache = get_poi_cache()
+    if cache is not None:
+        tiles = [t for p in points for t in cache.covering_tiles(p.lat, p.lng, radius)]
+        await _fill_poi_cache(cache, tiles, query)
+        return await asyncio.to_thread(lambda: [cache.query_radius(query, p.lat, p.lng, radius) for p in points])
+
+    q = _overpass_union(query, [f"around:{radius},{p.lat},{p.lng}" for p in points], timeout=OVERPASS_QUERY_TIMEOUT)
+    places = [p for p in await _overpass_query(q) if p["lat"] is not None and p["lon"] is not None]
+    if not places:
+        return [[] for _ in points]
+
+    lats = np.array([p["lat"] for p in places], dtype=float)
+    lons = np.array([p["lon"] for p in places], dtype=float)
+    per_point: List[List[Dict]] = []
+    for p in points:
+        within = haversine_km_array(p.lat, p.lng, lats, lons) * 1000.0 <= radius
+        per_point.append([places[i] for i in np.flatnonzero(within)])
+    return per_point
+
+
+def tier_places_by_distance(places: List[Dict], point: LatLng, radii: List[int] = SEARCH_RADII) -> Tuple[List[Dict], Optional[int]]:
+    """
+    Local replacement for re-querying Overpass at growing radii: return the
+    places inside the smallest radius that has any (keeping response order),
+    together with that radius.
+    """
+    located = [p for p in places if p.get("lat") is not None and p.get("lon") is not None]
+    if not located:
+        return [], None
+
+    dist_m = haversine_km_array(
+        point.lat, point.lng,
+        np.array([p["lat"] for p in located], dtype=float),
+        np.array([p["lon"] for p in located], dtype=float),
+    ) * 1000.0
+    for r in radii:
+        within = np.flatnonzero(dist_m <= r)
+        if within.size:
+            return [located[i] for i in within], r
+    return [], None
+
+
+async def search_places_tiered(point: LatLng, label: str, query: str = "restaurant") -> List[Dict]:
+    """One Overpass query at the largest radius around a point, tiered locally."""
+    fetched = await search_places(point.lat, point.lng, radius=max(SEARCH_RADII), query=query)
+    places, radius = tier_places_by_distance(fetched, point)
+    logger.info(f"Overpass returned {len(fetched)} places for {label}; using {len(places)} within {radius}m")
+    for i, place in enumerate(places[:5]):  # Log first 5 places
+        logger.debug(f"Place {i+1}: {place.get('name')} - Cuisine: {place.get('tags', {}).get('cuisine', 'unknown')}")
     return places
 
+
+async def search_corridor_tiered(points: Dict[str, LatLng], query: str = "restaurant") -> Dict[str, List[Dict]]:
+    """
+    Corridor version of search_places_tiered: a single Overpass request at the
+    largest radius for every point, split per point and tiered locally.
+    """
+    labels = list(points)
+    per_point = await search_places_corridor([points[label] for label in labels], radius=max(SEARCH_RADII), query=query)
+    found: Dict[str, List[Dict]] = {}
+    for label, fetched in zip(labels, per_point):
+        found[label], radius = tier_places_by_distance(fetched, points[label])
+        logger.info(f"Overpass corridor returned {len(fetched)} places for {label}; using {len(found[label])} within {radius}m")
+    return found
+
 # ----------------------------
 # Utilities
 # ----------------------------
-def extract_checkpoints(route: Dict) -> List[Dict]:
-    # ... (keep existing implementation exactly as is)
-    checkpoints = []
-    cum = 0
-    for leg in route.get("legs", []):
-        for step in leg.get("steps", []):
-            end = step["maneuver"]["location"]
-            duration = step["duration"]
-            cum += duration
-            checkpoints.append({"lat": end[1], "lng": end[0], "cum_seconds": cum})
-    return checkpoints
-
-
-
-def find_point_for_window(checkpoints, departure_dt: datetime, window_start: dtime, window_end: dtime):
-    # ... (keep existing implementation exactly as is)
-    start_dt = departure_dt.replace(hour=window_start.hour, minute=window_start.minute, second=0, microsecond=0)
-    end_dt = departure_dt.replace(hour=window_end.hour, minute=window_end.minute, second=0, microsecond=0)
-    if end_dt <= start_dt:
-        end_dt += timedelta(days=1)
-
-    candidate = None
-    min_dist = None
-    center = start_dt + (end_dt - start_dt) / 2
-    for cp in checkpoints:
-        eta = departure_dt + timedelta(seconds=cp["cum_seconds"])
-        if start_dt <= eta <= end_dt:
-            return (LatLng(lat=cp["lat"], lng=cp["lng"]), eta)
-        dist = abs((eta - center).total_seconds())
-        if min_dist is None or dist < min_dist:
-            min_dist = dist
-            candidate = (LatLng(lat=cp["lat"], lng=cp["lng"]), eta)
-    return candidate
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    R = 6371.0
+    p1 = math.radians(lat1); p2 = math.radians(lat2)
+    dlat = p2 - p1; dlon = math.radians(lon2 - lon1)
+    x = math.sin(dlat/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dlon/2)**2
+    return R * 2 * math.atan2(math.sqrt(x), math.sqrt(1 - x))
+
+
+def haversine_km_array(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Vectorized haversine_km from one point to arrays of points."""
+    p1 = math.radians(lat)
+    p2 = np.radians(lats)
+    dlat = p2 - p1
+    dlon = np.radians(lons) - math.radians(lon)
+    x = np.sin(dlat / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(dlon / 2) ** 2
+    return 6371.0 * 2 * np.arctan2(np.sqrt(x), np.sqrt(1 - x))
+
+
+class RouteTimeline:
+    """
+    Where the trip is at any time after departure.
+
+    Built once per route from OSRM's per-segment ``annotations=duration``:
+    parallel lists of cumulative seconds and coordinates for every vertex of
+    the route geometry, so position_at() is a bisect plus a linear
+    interpolation within one segment. Routes without annotations assume a
+    constant speed along the geometry, or fall back to the step maneuvers.
+    """
+
+    def __init__(self, route: Dict):
+        coords = (route.get("geometry") or {}).get("coordinates") or []
+        segments = [d for leg in route.get("legs", []) for d in (leg.get("annotation") or {}).get("duration") or []]
+        if len(coords) >= 2 and len(segments) == len(coords) - 1:
+            pts = np.asarray(coords, dtype=float)
+            seconds = np.asarray(segments, dtype=float)
+        elif len(coords) >= 2:
+            pts = np.asarray(coords, dtype=float)
+            # Relative segment lengths are all that matter here
+            lengths = np.hypot(np.diff(pts[:, 0]) * np.cos(np.radians(pts[:-1, 1])), np.diff(pts[:, 1]))
+            total = lengths.sum()
+            seconds = lengths / total * float(route.get("duration", 0)) if total > 0 else np.zeros(len(lengths))
+        else:
+            steps = [step for leg in route.get("legs", []) for step in leg.get("steps", [])]
+            pts = np.asarray([step["maneuver"]["location"] for step in steps], dtype=float).reshape(-1, 2)
+            seconds = np.asarray([step["duration"] for step in steps[:-1]], dtype=float)
+        self.times: List[float] = np.concatenate(([0.0], np.cumsum(seconds))).tolist() if len(pts) else []
+        self.lngs: List[float] = pts[:, 0].tolist()
+        self.lats: List[float] = pts[:, 1].tolist()
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def total_seconds(self) -> float:
+        return self.times[-1] if self.times else 0.0
+
+    def position_at(self, seconds: float) -> LatLng:
+        """Interpolated position ``seconds`` after departure (clamped to the route)."""
+        i = bisect.bisect_right(self.times, seconds) - 1
+        if i < 0:
+            return LatLng(lat=self.lats[0], lng=self.lngs[0])
+        if i >= len(self.times) - 1:
+            return LatLng(lat=self.lats[-1], lng=self.lngs[-1])
+        span = self.times[i + 1] - self.times[i]
+        f = (seconds - self.times[i]) / span if span > 0 else 0.0
+        return LatLng(lat=self.lats[i] + (self.lats[i + 1] - self.lats[i]) * f,
+                      lng=self.lngs[i] + (self.lngs[i + 1] - self.lngs[i]) * f)
+
+    def point_for_window(self, departure_dt: datetime, window_start: dtime,
+                         window_end: dtime) -> Optional[Tuple[LatLng, datetime]]:
+        """
+        Where the trip first reaches a meal window, with the ETA there. If the
+        trip is never on the road during the window, the route end closest to
+        the window's midpoint.
+        """
+        if not self.times:
+            return None
+        start_dt = departure_dt.replace(hour=window_start.hour, minute=window_start.minute, second=0, microsecond=0)
+        end_dt = departure_dt.replace(hour=window_end.hour, minute=window_end.minute, second=0, microsecond=0)
+        if end_dt <= start_dt:
+            end_dt += timedelta(days=1)
+
+        start = (start_dt - departure_dt).total_seconds()
+        end = (end_dt - departure_dt).total_seconds()
+        if end >= 0 and start <= self.total_seconds:
+            t = max(start, 0.0)
+        else:
+            t = min(max((start + end) / 2, 0.0), self.total_seconds)
+        return self.position_at(t), departure_dt + timedelta(seconds=t)
+
+
+# Built once per cached route (a few ms for a long route's full geometry)
+timeline_cache = TTLCache(maxsize=int(os.getenv("ROUTE_CACHE_MAX_ROUTES", "256")), ttl=ROUTE_CACHE_TTL)
 
 
 # ----------------------------
@@ -448,29 +1061,32 @@ def filter_meal_windows(meal_windows, departure: datetime, arrival: datetime):
 
 # --- Insert/replace these helpers & endpoint in your main.py ---
 
-# Replace existing compute_detour_osrm with this implementation
-
-import asyncio
-from functools import lru_cache
-
-OSRM_TABLE_URL = OSRM_BASE_URL + "/table/v1/driving/"
+# Max meal windows processed at once within a single /trips/create
+MEAL_CONCURRENCY = int(os.getenv("MEAL_CONCURRENCY", "4"))
 
-async def _osrm_table_request(coords: str, retries: int = 2, backoff: float = 0.5, timeout: int = 15):
+async def _osrm_table_request(coords: str, sources: Optional[List[int]] = None, destinations: Optional[List[int]] = None,
+                              retries: int = 2, backoff: float = 0.5):
     """
     Low-level helper to call OSRM table endpoint with retries.
     coords: semicolon-separated "lon,lat;lon,lat;..."
+    sources/destinations: optional coordinate indices restricting the matrix rows/columns
     returns parsed JSON or raises.
     """
+    router = get_local_router()
+    if router is not None:
+        points = [tuple(float(v) for v in c.split(",")) for c in coords.split(";")]
+        return await asyncio.to_thread(router.table, points, sources, destinations)
+
     params = {"annotations": "duration"}  # we only need durations
-    url = OSRM_TABLE_URL + coords
+    if sources is not None:
+        params["sources"] = ";".join(str(i) for i in sources)
+    if destinations is not None:
+        params["destinations"] = ";".join(str(i) for i in destinations)
+    url = f"{OSRM_BASE_URL}/table/v1/driving/{coords}"
     attempt = 0
     while True:
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                r = await client.get(url, params=params)
-                r.raise_for_status()
-                payload = r.json()
-                return payload
+            return await upstream_json("osrm", "GET", url, params=params)
         except Exception as e:
             attempt += 1
             if attempt > retries:
@@ -486,49 +1102,6 @@ def _coords_for_table(*points: LatLng) -> str:
     return ";".join(f"{p.lng},{p.lat}" for p in points)
 
 
-@lru_cache(maxsize=256)
-def _cached_base_duration_key(orig_lat, orig_lng, dest_lat, dest_lng):
-    # small helper to create cache key for base duration; we will store base seconds in memory
-    return f"{orig_lat:.6f}_{orig_lng:.6f}_{dest_lat:.6f}_{dest_lng:.6f}"
-
-
-async def compute_detour_osrm(origin: LatLng, destination: LatLng, via: LatLng) -> Optional[int]:
-    # ... (keep existing implementation exactly as is)
-    try:
-        cache_key = f"{origin.lat:.6f}_{origin.lng:.6f}_{destination.lat:.6f}_{destination.lng:.6f}"
-        base_seconds = getattr(compute_detour_osrm, "_base_cache", {}).get(cache_key)
-        
-        coords3 = f"{origin.lng},{origin.lat};{via.lng},{via.lat};{destination.lng},{destination.lat}"
-        url = f"{OSRM_BASE_URL}/table/v1/driving/{coords3}"
-        params = {"annotations": "duration"}
-        
-        async with httpx.AsyncClient(timeout=15) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            payload = r.json()
-        
-        durations = payload.get("durations")
-        if not durations:
-            raise ValueError("OSRM table returned no durations")
-
-        od_seconds = durations[0][2]
-        ov_seconds = durations[0][1]
-        vd_seconds = durations[1][2]
-
-        if base_seconds is None:
-            base_seconds = od_seconds
-            if not hasattr(compute_detour_osrm, "_base_cache"):
-                compute_detour_osrm._base_cache = {}
-            compute_detour_osrm._base_cache[cache_key] = base_seconds
-
-        extra_sec = max(0, int((ov_seconds or 0) + (vd_seconds or 0) - (od_seconds or 0)))
-        detour_min = math.ceil(extra_sec / 60.0)
-        return int(detour_min)
-    except Exception as e:
-        logger.warning(f"compute_detour_osrm failed: {e}")
-        return None
-
-
 def estimate_detour_heuristic(origin: LatLng, destination: LatLng, via: LatLng, avg_speed_kmph: float = 40.0) -> int:
     """
     Quick fallback: compute extra time by:
@@ -536,19 +1109,9 @@ def estimate_detour_heuristic(origin: LatLng, destination: LatLng, via: LatLng,
       detour_minutes = ceil((extra_distance_km / avg_speed_kmph) * 60)
     Uses Haversine distance.
     """
-    def haversine_km(a: LatLng, b: LatLng) -> float:
-        import math
-        R = 6371.0
-        lat1 = math.radians(a.lat); lon1 = math.radians(a.lng)
-        lat2 = math.radians(b.lat); lon2 = math.radians(b.lng)
-        dlat = lat2 - lat1; dlon = lon2 - lon1
-        x = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(x), math.sqrt(1 - x))
-        return R * c
-
-    od = haversine_km(origin, destination)
-    ov = haversine_km(origin, via)
-    vd = haversine_km(via, destination)
+    od = haversine_km(origin.lat, origin.lng, destination.lat, destination.lng)
+    ov = haversine_km(origin.lat, origin.lng, via.lat, via.lng)
+    vd = haversine_km(via.lat, via.lng, destination.lat, destination.lng)
     extra_km = max(0.0, (ov + vd) - od)
     detour_minutes = math.ceil((extra_km / avg_speed_kmph) * 60.0)
     logger.debug(f"heuristic: od={od:.2f}km ov={ov:.2f}km vd={vd:.2f}km extra={extra_km:.2f}km -> {detour_minutes}min")
@@ -556,6 +1119,157 @@ def estimate_detour_heuristic(origin: LatLng, destination: LatLng, via: LatLng,
 
 
 
+# Coordinates per OSRM table request (the server's --max-table-size; 100 on
+# the public demo server). Larger matrices are split into several requests.
+OSRM_TABLE_MAX_COORDS = int(os.getenv("OSRM_TABLE_MAX_COORDS", "100"))
+
+
+def _table_chunks(rows: List[int], cols: List[int], limit: int) -> List[Tuple[List[int], List[int]]]:
+    """Split a rows x cols table into blocks of at most limit distinct points each."""
+    if len(set(rows) | set(cols)) <= limit:
+        return [(rows, cols)]
+    half = max(limit // 2, 1)
+    return [(rows[r:r + half], cols[c:c + half])
+            for r in range(0, len(rows), half) for c in range(0, len(cols), half)]
+
+
+async def duration_matrix(points: List[LatLng], blocks: List[Tuple[Sequence[int], Sequence[int]]],
+                          avg_speed_kmph: float = 40.0) -> np.ndarray:
+    """
+    Driving seconds between points, as an n x n matrix. For each
+    (sources, destinations) block, the cells from every source to every
+    destination come from duration_cache when present. Only the rows and
+    columns with an uncached cell go to OSRM, in as few table requests as
+    fit OSRM_TABLE_MAX_COORDS coordinates (sent concurrently), and are cached
+    cell by cell. Every other cell, and any cell OSRM cannot route (or whose
+    request fails), is estimated like estimate_detour_heuristic: straight-line
+    distance at avg_speed_kmph.
+    """
+    n = len(points)
+    lats = np.array([p.lat for p in points])
+    lngs = np.array([p.lng for p in points])
+    matrix = np.vstack([haversine_km_array(p.lat, p.lng, lats, lngs) for p in points]) / avg_speed_kmph * 3600.0
+    np.fill_diagonal(matrix, 0.0)
+
+    keys = [_route_cache_key(p) for p in points]
+    rows, cols = set(), set()
+    for sources, destinations in blocks:
+        for i in sources:
+            for j in destinations:
+                if i != j:
+                    cached = duration_cache.get(keys[i] + keys[j])
+                    if cached is None:
+                        rows.add(i)
+                        cols.add(j)
+                    else:
+                        matrix[i, j] = cached
+    if not rows:
+        return matrix
+
+    async def fetch(sources: List[int], destinations: List[int]):
+        used = sorted(set(sources) | set(destinations))
+        position = {i: k for k, i in enumerate(used)}
+        try:
+            payload = await _osrm_table_request(_coords_for_table(*(points[i] for i in used)),
+                                                sources=[position[i] for i in sources],
+                                                destinations=[position[j] for j in destinations])
+            durations = payload.get("durations")
+            if not durations:
+                raise ValueError("OSRM table returned no durations")
+        except Exception as e:
+            logger.warning(f"OSRM table of {len(sources)}x{len(destinations)} failed, estimating it: {e}")
+            return
+        for i, row in zip(sources, durations):
+            for j, seconds in zip(destinations, row):
+                if seconds is not None and i != j:
+                    matrix[i, j] = seconds
+                    duration_cache.set(keys[i] + keys[j], seconds)
+
+    await asyncio.gather(*(fetch(r, c) for r, c in _table_chunks(sorted(rows), sorted(cols), OSRM_TABLE_MAX_COORDS)))
+    return matrix
+
+
+async def trip_duration_matrix(points: List[LatLng], origin: int = 0, destination: int = -1,
+                               avg_speed_kmph: float = 40.0) -> np.ndarray:
+    """
+    duration_matrix over a whole trip: points[origin] is the trip's source
+    and points[destination] its destination, so every row but the
+    destination's and every column but the source's is needed.
+    """
+    n = len(points)
+    origin, destination = origin % n, destination % n
+    sources = [i for i in range(n) if i != destination]
+    destinations = [j for j in range(n) if j != origin]
+    return await duration_matrix(points, [(sources, destinations)], avg_speed_kmph)
+
+
+# Candidates per meal that get a real (OSRM) detour evaluation
+CANDIDATE_POOL_SIZE = int(os.getenv("CANDIDATE_POOL_SIZE", "12"))
+# Route polylines are decimated to at most this many segments for the prefilter
+PREFILTER_MAX_SEGMENTS = int(os.getenv("PREFILTER_MAX_SEGMENTS", "200"))
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON_EQUATOR = 111.320
+
+
+class RouteLine:
+    """Route polyline projected to a local planar frame (km), for point-to-route distances."""
+
+    def __init__(self, coordinates: List[List[float]], max_segments: int = PREFILTER_MAX_SEGMENTS):
+        pts = np.asarray(coordinates, dtype=float).reshape(-1, 2)  # [lon, lat]
+        if len(pts) > max_segments + 1:
+            keep = np.unique(np.append(np.linspace(0, len(pts) - 1, max_segments + 1).astype(int), len(pts) - 1))
+            pts = pts[keep]
+        self.lat0 = float(pts[:, 1].mean()) if len(pts) else 0.0
+        xy = self.project(pts[:, 1], pts[:, 0])
+        self.a = xy[:-1]
+        self.ab = xy[1:] - xy[:-1]
+        self.ab_len2 = np.maximum((self.ab ** 2).sum(axis=1), 1e-12)
+
+    def project(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        kx = KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(self.lat0))
+        return np.column_stack((np.asarray(lons) * kx, np.asarray(lats) * KM_PER_DEG_LAT))
+
+    def distance_km(self, lats: np.ndarray, lons: np.ndarray, chunk: int = 256) -> np.ndarray:
+        """Perpendicular distance from each point to the nearest route segment."""
+        pts = self.project(lats, lons)
+        if len(self.a) == 0:
+            return np.full(len(pts), np.inf)
+        out = np.empty(len(pts))
+        for start in range(0, len(pts), chunk):
+            p = pts[start:start + chunk, None, :]                          # (n, 1, 2)
+            t = np.clip(((p - self.a) * self.ab).sum(axis=2) / self.ab_len2, 0.0, 1.0)
+            closest = self.a + t[..., None] * self.ab                       # (n, m, 2)
+            out[start:start + chunk] = np.sqrt(((p - closest) ** 2).sum(axis=2)).min(axis=1)
+        return out
+
+
+def prefilter_candidates(places: List[Dict], origin: LatLng, destination: LatLng, route_line: Optional[RouteLine],
+                         k: int = CANDIDATE_POOL_SIZE, avg_speed_kmph: float = 40.0) -> List[Dict]:
+    """
+    Pick the k most promising places for OSRM detour evaluation.
+
+    For all places at once: the estimate_detour_heuristic detour plus the time
+    to drive out to the place and back from the nearest point of the route
+    polyline. A heap then selects the k cheapest, cheapest first.
+    """
+    located = [p for p in places if p.get("lat") is not None and p.get("lon") is not None]
+    if len(located) <= 1:
+        return located[:k]
+
+    lats = np.array([p["lat"] for p in located], dtype=float)
+    lons = np.array([p["lon"] for p in located], dtype=float)
+    od = haversine_km(origin.lat, origin.lng, destination.lat, destination.lng)
+    ov = haversine_km_array(origin.lat, origin.lng, lats, lons)
+    vd = haversine_km_array(destination.lat, destination.lng, lats, lons)
+    cost_km = np.maximum(ov + vd - od, 0.0)
+    if route_line is not None:
+        cost_km = cost_km + 2.0 * route_line.distance_km(lats, lons)
+    cost_min = cost_km / avg_speed_kmph * 60.0
+
+    top = heapq.nsmallest(k, range(len(located)), key=cost_min.tolist().__getitem__)
+    return [located[i] for i in top]
+
+
 def score_place_overpass(place: Dict, detour_minutes: int, veg_pref: str, max_detour: int) -> float:
     """
     Heuristic scoring for Overpass places:
@@ -564,8 +1278,7 @@ def score_place_overpass(place: Dict, detour_minutes: int, veg_pref: str, max_de
     - uses presence of 'rating' tag if present (rare)
     """
     tags = place.get("tags", {}) or {}
-    name = (tags.get("name") or "").lower()
-    cuisine = (tags.get("cuisine") or "").lower()
+    cls = place_class(place)
     rating_tag = tags.get("rating")
     rating = float(rating_tag) if rating_tag and rating_tag.replace(".", "", 1).isdigit() else None
 
@@ -573,9 +1286,9 @@ def score_place_overpass(place: Dict, detour_minutes: int, veg_pref: str, max_de
     veg_score = 0.0
     if veg_pref == "veg":
         # strong boost if cuisine or name contains vegetarian cues
-        if any(k in cuisine for k in ("vegetarian", "veg", "pure_veg", "south_indian", "north_indian")):
+        if cls["bits"] & OVERPASS_VEG_CUISINE_HIT:
             veg_score += 2.0
-        if any(k in name for k in ("veg", "vegetarian", "pure veg")):
+        if cls["bits"] & OVERPASS_VEG_NAME_HIT:
             veg_score += 1.5
 
     # base quality (use rating if exists, else default)
@@ -587,275 +1300,437 @@ def score_place_overpass(place: Dict, detour_minutes: int, veg_pref: str, max_de
     score = base_quality + veg_score - detour_penalty
 
     # small tie-breaker using number of tags (more tags -> possibly richer info)
-    tag_count = len(tags)
-    score += min(tag_count, 3) * 0.05
+    score += min(cls["tag_count"], 3) * 0.05
 
     logger.debug(f"score_place: {place.get('name')} rating={rating} veg_score={veg_score} detour={detour_minutes} penalty={detour_penalty:.2f} final={score:.2f}")
     return score
 
 
-@app.post("/trips/create", response_model=TripResponse)
-async def create_trip(tr: TripRequest):
+async def shortlist_meal_places(
+    meal_name: str,
+    point: LatLng,
+    overpass_places: Optional[List[Dict]],
+    route_line: Optional[RouteLine],
+    tr: TripRequest,
+    user_prefs: Optional[UserPreferences],
+) -> List[Tuple[Dict, LatLng]]:
     """
-    Enhanced trip creation with user preference integration
+    Filter and prefilter restaurant stops for one meal window, with their
+    locations; the pool that gets a real (OSRM) detour evaluation.
+    overpass_places comes from the trip's corridor query; when it is None the
+    meal runs its own Overpass query.
     """
-    try:
-        logger.info("=== ENHANCED create_trip with personalization ===")
-        
-        # 1. Fetch user preferences if user_id provided
-        user_prefs = None
-        personalization_used = False
-        
-        if tr.user_id:
-            user_prefs = await get_user_preferences(tr.user_id)
-            if user_prefs:
-                personalization_used = True
-                logger.info(f"Using personalization for user {tr.user_id}: {user_prefs}")
-                # Override veg_pref from user preferences if not explicitly set
-                if tr.veg_pref == "any" and user_prefs.foodPreference.lower() == "vegetarian":
-                    tr.veg_pref = "veg"
+    logger.info(f"Processing meal '{meal_name}' with personalization")
+
+    if overpass_places is None:
+        with stage("overpass"):
+            overpass_places = await search_places_tiered(point, meal_name)
+
+    if not overpass_places:
+        logger.warning(f"No places found for {meal_name}")
+        return []
+
+    # Check if we need vegetarian filtering
+    needs_veg_filter = (
+        (user_prefs and user_prefs.foodPreference.lower() == "vegetarian")
+        or tr.veg_pref == "veg"
+    )
+
+    if needs_veg_filter:
+        # SMART VEGETARIAN FILTERING - More inclusive: keep places with a veg
+        # indicator or without an explicit non-veg one (bits set at ingest)
+        filtered = []
+        for p in overpass_places:
+            bits = place_class(p)["bits"]
+            if bits & VEG_FRIENDLY or not bits & NON_VEG:
+                filtered.append(p)
             else:
-                logger.info(f"No preferences found for user {tr.user_id}, using request parameters")
+                logger.debug(f"Excluded non-veg place: {p.get('name')}")
+    else:
+        # No vegetarian filter needed, include all places
+        filtered = list(overpass_places)
+
+    logger.info(f"{len(filtered)} places after SMART preference filtering for {meal_name}")
+
+    with stage("prefilter"):
+        candidates_pool = prefilter_candidates(filtered or overpass_places, tr.source, tr.destination, route_line)
+    logger.info(f"Prefilter kept {len(candidates_pool)} of {len(filtered or overpass_places)} places for {meal_name}")
+
+    located = []
+    for p in candidates_pool:
+        pl_lat = p.get("lat") or p.get("center", {}).get("lat")
+        pl_lon = p.get("lon") or p.get("center", {}).get("lon")
+        if pl_lat is None or pl_lon is None:
+            continue
+        located.append((p, LatLng(lat=float(pl_lat), lng=float(pl_lon))))
+    return located
+
+
+def rank_meal_stops(
+    meal_name: str,
+    located: List[Tuple[Dict, LatLng]],
+    detours: List[int],
+    eta_dt: datetime,
+    tr: TripRequest,
+    user_prefs: Optional[UserPreferences],
+) -> List[Tuple[PlaceSuggestion, int]]:
+    """
+    Score a meal's shortlist (detours in minutes, aligned with located) and
+    return the top 5 suggestions, each with its position in located.
+    """
+    within = [(k, p, detour_min) for k, ((p, _), detour_min) in enumerate(zip(located, detours))
+              if detour_min <= tr.max_detour_minutes]
+
+    # Compute ENHANCED scoring
+    candidates = []
+    with stage("scoring"):
+        # ENHANCED: Use personalized scoring, compiled once per preference set
+        if user_prefs:
+            scores = CompiledScorer.for_prefs(user_prefs).score_batch(
+                [p for _, p, _ in within], [d for _, _, d in within], tr.max_detour_minutes
+            )
         else:
-            logger.info("No user_id provided, using request parameters only")
+            # Fallback to basic scoring
+            scores = [(3.0, ["Standard suggestion"]) for _ in within]
+
+        for (k, p, detour_min), (score, match_reasons) in zip(within, scores):
+            candidates.append((score, k, p, detour_min, match_reasons))
+
+        # Rank by ENHANCED score
+        candidates.sort(key=lambda x: x[0], reverse=True)
+    logger.info(f"{len(candidates)} candidates scored for {meal_name}")
+
+    # Create suggestions with personalization info
+    suggestions = []
+    for score, k, p, detour, match_reasons in candidates[:5]:  # Top 5
+        location = located[k][1]
+        eta_with_detour = eta_dt + timedelta(minutes=detour)
+        suggestion = PlaceSuggestion(
+            osm_id=str(p.get("osm_id") or p.get("id")),
+            name=p.get("name") or p.get("tags", {}).get("name", "Unknown"),
+            location=location,
+            detour_minutes=int(detour),
+            eta_iso=eta_with_detour.isoformat(),
+            tags=p.get("tags", {}),
+            personalization_score=float(score),
+            match_reasons=match_reasons
+        )
+        suggestions.append((suggestion, k))
+        logger.info(f"Selected: {suggestion.name} score={score:.2f} detour={detour}min")
 
-        # 2. Parse preferred arrival
-        try:
-            preferred_arrival = dateparser.isoparse(tr.preferred_reach_time)
-        except Exception as e:
-            logger.error(f"Invalid preferred_reach_time: {e}")
-            raise HTTPException(status_code=400, detail=f"Invalid preferred_reach_time: {e}")
+    return suggestions
 
-        # 3. Baseline OSRM route (existing logic)
-        logger.info("Fetching baseline OSRM route...")
-        route = await call_osrm_route(tr.source, tr.destination, tr.stops or [])
-        route_seconds = int(route.get("duration", 0))
-        route_distance = float(route.get("distance", 0))
-        logger.info(f"Baseline route: duration={route_seconds}s distance={route_distance}m")
-
-        # 4. Estimate departure (existing logic)
-        meal_count = len(tr.mealWindows)
-        total_meal_time_sec = meal_count * tr.meal_duration_min * 60
-        estimated_total_seconds = route_seconds + total_meal_time_sec
-        latest_start_dt = preferred_arrival - timedelta(seconds=estimated_total_seconds)
-
-        window_margin = timedelta(minutes=15)
-        recommended_window = [
-            (latest_start_dt - window_margin).isoformat(),
-            (latest_start_dt + window_margin).isoformat()
-        ]
-
-        trip_departure_dt = latest_start_dt
-        trip_estimated_arrival_dt = trip_departure_dt + timedelta(seconds=(route_seconds + total_meal_time_sec))
-
-        logger.info(f"Initial trip window: depart={trip_departure_dt.isoformat()}")
-
-        # 5. Prepare checkpoints (existing logic)
-        checkpoints = extract_checkpoints(route)
-        logger.info(f"Extracted {len(checkpoints)} checkpoints from baseline route")
-
-        # 6. Filter meal windows that intersect trip (existing logic)
-        def meal_window_intersects_trip(window: TimeWindow, depart_dt: datetime, arrive_dt: datetime) -> bool:
-            s_h, s_m = [int(x) for x in window.start.split(":")]
-            e_h, e_m = [int(x) for x in window.end.split(":")]
-            w_start = depart_dt.replace(hour=s_h, minute=s_m, second=0, microsecond=0)
-            w_end = depart_dt.replace(hour=e_h, minute=e_m, second=0, microsecond=0)
-            if w_end <= w_start:
-                w_end += timedelta(days=1)
-            latest_start = max(depart_dt, w_start)
-            earliest_end = min(arrive_dt, w_end)
-            return latest_start <= earliest_end
-
-        considered_meals = {}
-        for meal_name, tw in tr.mealWindows.items():
-            if meal_window_intersects_trip(tw, trip_departure_dt, trip_estimated_arrival_dt):
-                considered_meals[meal_name] = tw
-            else:
-                logger.info(f"Skipping meal '{meal_name}' - window doesn't intersect trip")
 
-        logger.info(f"Considering meals: {list(considered_meals.keys())}")
+async def plan_trip_events(tr: TripRequest) -> AsyncIterator[Dict[str, Any]]:
+    """
+    The /trips/create pipeline as a sequence of events, in the order their
+    data becomes available:
 
-        # 7. Process each considered meal window with ENHANCED scoring
-        meal_suggestions: Dict[str, List[PlaceSuggestion]] = {}
+      {"event": "route", ...}      baseline route summary and departure window, right after OSRM
+      {"event": "meal", ...}       one per meal, as soon as its shortlist and detours are in
+      {"event": "departure", ...}  the jointly chosen meal stops and the departure they imply
 
-        for meal_name, tw in considered_meals.items():
-            logger.info(f"Processing meal '{meal_name}' with personalization")
-
-            # Parse window times
-            try:
-                s_h, s_m = [int(x) for x in tw.start.split(":")]
-                e_h, e_m = [int(x) for x in tw.end.split(":")]
-            except Exception as e:
-                logger.error(f"Invalid meal window format for {meal_name}: {e}")
-                raise HTTPException(status_code=400, detail=f"Invalid meal window for {meal_name}: {e}")
-
-            window_start = dtime(hour=s_h, minute=s_m)
-            window_end = dtime(hour=e_h, minute=e_m)
-
-            # Find checkpoint for meal window
-            found = find_point_for_window(checkpoints, trip_departure_dt, window_start, window_end)
-            if not found:
-                logger.warning(f"No checkpoint found for {meal_name}")
-                meal_suggestions[meal_name] = []
-                continue
-
-            point, eta_dt = found
-            logger.info(f"Meal '{meal_name}' ETA: {eta_dt.isoformat()} at {point.lat},{point.lng}")
-
-            # Query Overpass with fallback radii
-            search_radii = [3000, 7000, 15000]
-            overpass_places = []
-            for r in search_radii:
-                overpass_places = await search_places(point.lat, point.lng, radius=r, query="restaurant")
-                logger.info(f"Overpass returned {len(overpass_places)} places for {meal_name} at radius={r}m")
-                for i, place in enumerate(overpass_places[:5]):  # Log first 5 places
-                    logger.debug(f"Place {i+1}: {place.get('name')} - Cuisine: {place.get('tags', {}).get('cuisine', 'unknown')}")
-                if overpass_places:
-                    break
+    create_trip collects them into a TripResponse; /trips/create/stream
+    sends each one as it happens.
+    """
+    # 1. Fetch user preferences if user_id provided
+    user_prefs = None
+    personalization_used = False
 
-            if not overpass_places:
-                logger.warning(f"No places found for {meal_name}")
-                meal_suggestions[meal_name] = []
-                continue
-
-            filtered = []
-            for p in overpass_places:
-                tags = p.get("tags", {}) or {}
-                cuisine = (tags.get("cuisine") or "").lower()
-                name = (p.get("name") or "").lower()
-
-                # Check if we need vegetarian filtering
-                needs_veg_filter = (
-                    (user_prefs and user_prefs.foodPreference.lower() == "vegetarian") 
-                    or tr.veg_pref == "veg"
-                )
-                
-                if needs_veg_filter:
-                    # SMART VEGETARIAN FILTERING - More inclusive
-                    veg_indicators = [
-                        "vegetarian", "veg", "pure_veg", "pure veg", "plant-based",
-                        "south indian", "north indian", "indian"  # Many Indian restaurants are veg-friendly
-                    ]
-                    
-                    non_veg_indicators = [
-                        "non-veg", "non veg", "chicken", "mutton", "fish", "seafood", 
-                        "meat", "bbq", "barbecue", "steak", "pork", "beef"
-                    ]
-                    
-                    # Check for positive vegetarian indicators
-                    has_veg_indicator = any(indicator in cuisine for indicator in veg_indicators) or \
-                                    any(indicator in name for indicator in veg_indicators)
-                    
-                    # Check for explicit non-vegetarian indicators
-                    has_non_veg_indicator = any(indicator in cuisine for indicator in non_veg_indicators) or \
-                                        any(indicator in name for indicator in non_veg_indicators)
-                    
-                    # Include if: has veg indicators OR doesn't have explicit non-veg indicators
-                    if has_veg_indicator or not has_non_veg_indicator:
-                        filtered.append(p)
-                    else:
-                        logger.debug(f"Excluded non-veg place: {p.get('name')}")
-                else:
-                    # No vegetarian filter needed, include all places
-                    filtered.append(p)
+    if tr.user_id:
+        with stage("preferences"):
+            user_prefs = await get_user_preferences(tr.user_id)
+        if user_prefs:
+            personalization_used = True
+            logger.debug("Using personalization for user %s: %s", tr.user_id, user_prefs)
+            # Override veg_pref from user preferences if not explicitly set
+            if tr.veg_pref == "any" and user_prefs.foodPreference.lower() == "vegetarian":
+                tr.veg_pref = "veg"
+        else:
+            logger.info(f"No preferences found for user {tr.user_id}, using request parameters")
+    else:
+        logger.info("No user_id provided, using request parameters only")
 
-            logger.info(f"{len(filtered)} places after SMART preference filtering for {meal_name}")
+    # 2. Parse preferred arrival
+    try:
+        preferred_arrival = dateparser.isoparse(tr.preferred_reach_time)
+    except Exception as e:
+        logger.error(f"Invalid preferred_reach_time: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid preferred_reach_time: {e}")
+
+    unknown_levels = [level for level in tr.geometry_levels if level not in POLYLINE_LEVELS]
+    if unknown_levels:
+        raise HTTPException(status_code=400, detail=f"Unknown geometry_levels {unknown_levels}; "
+                                                    f"expected any of {list(POLYLINE_LEVELS)}")
+    if tr.polyline_precision not in (5, 6):
+        raise HTTPException(status_code=400, detail="polyline_precision must be 5 or 6")
+
+    # 3. Baseline OSRM route (existing logic)
+    logger.info("Fetching baseline OSRM route...")
+    with stage("osrm_route"):
+        route = await call_osrm_route(tr.source, tr.destination, tr.stops or [])
+    route_seconds = int(route.get("duration", 0))
+    route_distance = float(route.get("distance", 0))
+    logger.info(f"Baseline route: duration={route_seconds}s distance={route_distance}m")
+
+    # 4. Estimate departure (existing logic)
+    meal_count = len(tr.mealWindows)
+    total_meal_time_sec = meal_count * tr.meal_duration_min * 60
+    estimated_total_seconds = route_seconds + total_meal_time_sec
+    latest_start_dt = preferred_arrival - timedelta(seconds=estimated_total_seconds)
+
+    window_margin = timedelta(minutes=15)
+    recommended_window = [
+        (latest_start_dt - window_margin).isoformat(),
+        (latest_start_dt + window_margin).isoformat()
+    ]
+
+    trip_departure_dt = latest_start_dt
+    trip_estimated_arrival_dt = trip_departure_dt + timedelta(seconds=(route_seconds + total_meal_time_sec))
+
+    logger.info(f"Initial trip window: depart={trip_departure_dt.isoformat()}")
+
+    route_key = _route_cache_key(tr.source, *(tr.stops or []), tr.destination)
+
+    # 5. Time-indexed route for locating meal windows
+    with stage("checkpoints"):
+        timeline = timeline_cache.get(route_key)
+        if timeline is None:
+            timeline = RouteTimeline(route)
+            timeline_cache.set(route_key, timeline)
+        route_coords = (route.get("geometry") or {}).get("coordinates") or []
+        route_line = RouteLine(route_coords) if len(route_coords) >= 2 else None
+    logger.info(f"Route timeline: {len(timeline)} points over {timeline.total_seconds:.0f}s")
+
+    # 6. Filter meal windows that intersect trip (existing logic)
+    def meal_window_intersects_trip(window: TimeWindow, depart_dt: datetime, arrive_dt: datetime) -> bool:
+        s_h, s_m = [int(x) for x in window.start.split(":")]
+        e_h, e_m = [int(x) for x in window.end.split(":")]
+        w_start = depart_dt.replace(hour=s_h, minute=s_m, second=0, microsecond=0)
+        w_end = depart_dt.replace(hour=e_h, minute=e_m, second=0, microsecond=0)
+        if w_end <= w_start:
+            w_end += timedelta(days=1)
+        latest_start = max(depart_dt, w_start)
+        earliest_end = min(arrive_dt, w_end)
+        return latest_start <= earliest_end
+
+    considered_meals = {}
+    for meal_name, tw in tr.mealWindows.items():
+        if meal_window_intersects_trip(tw, trip_departure_dt, trip_estimated_arrival_dt):
+            considered_meals[meal_name] = tw
+        else:
+            logger.info(f"Skipping meal '{meal_name}' - window doesn't intersect trip")
 
-            # Compute detours and ENHANCED scoring
-            candidates = []
-            candidates_pool = filtered[:12] if filtered else overpass_places[:12]
-            
-            for p in candidates_pool:
-                pl_lat = p.get("lat") or p.get("center", {}).get("lat")
-                pl_lon = p.get("lon") or p.get("center", {}).get("lon")
-                if pl_lat is None or pl_lon is None:
-                    continue
-                via = LatLng(lat=float(pl_lat), lng=float(pl_lon))
-
-                detour_min = await compute_detour_osrm(tr.source, tr.destination, via)
-                if detour_min is None or detour_min > tr.max_detour_minutes:
-                    continue
-
-                # ENHANCED: Use personalized scoring
-                if user_prefs:
-                    score, match_reasons = score_place_enhanced(p, detour_min, user_prefs, tr.max_detour_minutes)
-                else:
-                    # Fallback to basic scoring
-                    score = 3.0  # Default base score
-                    match_reasons = ["Standard suggestion"]
-
-                candidates.append((score, p, detour_min, match_reasons))
-
-            # Rank by ENHANCED score
-            candidates.sort(key=lambda x: x[0], reverse=True)
-            logger.info(f"{len(candidates)} candidates scored for {meal_name}")
-
-            # Create suggestions with personalization info
-            suggestions = []
-            for score, p, detour, match_reasons in candidates[:5]:  # Top 5
-                pl_lat = p.get("lat") or p.get("center", {}).get("lat")
-                pl_lon = p.get("lon") or p.get("center", {}).get("lon")
-                if pl_lat is None or pl_lon is None:
-                    continue
-                    
-                eta_with_detour = eta_dt + timedelta(minutes=detour)
-                suggestion = PlaceSuggestion(
-                    osm_id=str(p.get("osm_id") or p.get("id")),
-                    name=p.get("name") or p.get("tags", {}).get("name", "Unknown"),
-                    location=LatLng(lat=float(pl_lat), lng=float(pl_lon)),
-                    detour_minutes=int(detour),
-                    eta_iso=eta_with_detour.isoformat(),
-                    tags=p.get("tags", {}),
-                    personalization_score=float(score),
-                    match_reasons=match_reasons
-                )
-                suggestions.append(suggestion)
-                logger.info(f"Selected: {suggestion.name} score={score:.2f} detour={detour}min")
+    logger.info(f"Considering meals: {list(considered_meals.keys())}")
 
-            meal_suggestions[meal_name] = suggestions
+    # 7. Process each considered meal window with ENHANCED scoring
+    meal_windows: Dict[str, Tuple[dtime, dtime]] = {}
+    for meal_name, tw in considered_meals.items():
+        # Parse window times
+        try:
+            s_h, s_m = [int(x) for x in tw.start.split(":")]
+            e_h, e_m = [int(x) for x in tw.end.split(":")]
+        except Exception as e:
+            logger.error(f"Invalid meal window format for {meal_name}: {e}")
+            raise HTTPException(status_code=400, detail=f"Invalid meal window for {meal_name}: {e}")
+        meal_windows[meal_name] = (dtime(hour=s_h, minute=s_m), dtime(hour=e_h, minute=e_m))
+
+    with stage("geometry"):
+        polylines = await route_polylines(route_key, route, tr.geometry_levels, tr.polyline_precision)
+    route_summary = RouteSummary(
+        total_distance_km=route_distance / 1000.0,
+        total_duration_min=route_seconds / 60.0,
+        stops=[f"{s.lat},{s.lng}" for s in (tr.stops or [])],
+        geometry=[],  # the route is in polyline; raw coordinates are too large to send
+        polyline=polylines,
+        polyline_precision=tr.polyline_precision,
+    )
+    # Generate trip ID (will be replaced when saving to Firebase)
+    trip_id = "temp_" + datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    yield {
+        "event": "route",
+        "trip_id": trip_id,
+        "route_summary": route_summary,
+        "recommended_departure_iso": latest_start_dt.isoformat(),
+        "recommended_departure_window": recommended_window,
+        "meals": list(meal_windows),
+        "personalization_used": personalization_used,
+    }
 
-        # 8. Recompute departure with detours (existing logic)
-        added_detour_seconds = 0
-        for meal_name, suglist in meal_suggestions.items():
-            if suglist:
-                added_detour_seconds += suglist[0].detour_minutes * 60
+    meal_suggestions: Dict[str, List[PlaceSuggestion]] = {}
+    meal_points: Dict[str, Tuple[LatLng, datetime]] = {}
+    for meal_name, (window_start, window_end) in meal_windows.items():
+        # Where the trip is when the meal window opens
+        with stage("checkpoints"):
+            found = timeline.point_for_window(trip_departure_dt, window_start, window_end)
+        if not found:
+            logger.warning(f"No route point found for {meal_name}")
+            meal_suggestions[meal_name] = []
+            yield {"event": "meal", "meal": meal_name, "suggestions": []}
+            continue
+        meal_points[meal_name] = found
+        logger.info(f"Meal '{meal_name}' ETA: {found[1].isoformat()} at {found[0].lat},{found[0].lng}")
 
-        total_seconds_with_detours = route_seconds + total_meal_time_sec + added_detour_seconds
-        latest_start_dt_final = preferred_arrival - timedelta(seconds=total_seconds_with_detours)
-        recommended_window_final = [
-            (latest_start_dt_final - window_margin).isoformat(),
-            (latest_start_dt_final + window_margin).isoformat()
-        ]
+    # One Overpass request for all meals; if it fails, every meal falls
+    # back to querying its own point.
+    corridor_places: Dict[str, List[Dict]] = {}
+    if OVERPASS_CORRIDOR_MODE and meal_points:
+        try:
+            with stage("overpass"):
+                corridor_places = await search_corridor_tiered(
+                    {name: point for name, (point, _) in meal_points.items()}
+                )
+        except Exception as e:
+            logger.warning(f"Overpass corridor query failed, querying per meal: {e}")
+
+    # Every meal stop goes into the leg (between two anchors) the trip is on
+    # when the meal window opens; its detour is measured against that leg
+    anchors = [tr.source, *(tr.stops or []), tr.destination]
+    leg_seconds = [float(leg.get("duration") or 0.0) for leg in route.get("legs") or []]
+    if len(leg_seconds) != len(anchors) - 1:
+        legs = await duration_matrix(anchors, [([a], [a + 1]) for a in range(len(anchors) - 1)])
+        leg_seconds = [float(legs[a, a + 1]) for a in range(len(anchors) - 1)]
+    leg_ends = np.cumsum(leg_seconds) if leg_seconds else np.zeros(1)
+    meal_legs: Dict[str, int] = {}
+    for meal_name, (_, eta_dt) in meal_points.items():
+        elapsed = (eta_dt - trip_departure_dt).total_seconds()
+        meal_legs[meal_name] = min(int(np.searchsorted(leg_ends, elapsed, side="right")), len(anchors) - 2)
+
+    # The trip's duration matrix: anchors first, then each meal's shortlist
+    # as it arrives. Cells are cached by duration_matrix, so the final joint
+    # choice only requests the ones no meal needed for its own detours.
+    matrix_points = list(anchors)
+    offsets: Dict[str, int] = {}
+
+    # Meals are independent until the joint choice, so each is shortlisted
+    # (bounded; a meal only queries Overpass itself if the corridor query
+    # failed), gets its leg's detours from OSRM and is sent as soon as it is
+    # ready. A failing meal comes back empty instead of cancelling the others.
+    meal_semaphore = asyncio.Semaphore(MEAL_CONCURRENCY)
+
+    async def rank_meal(meal_name: str, point: LatLng, eta_dt: datetime) -> Tuple[str, List[Tuple[PlaceSuggestion, int]]]:
+        try:
+            async with meal_semaphore:
+                located = await shortlist_meal_places(
+                    meal_name, point, corridor_places.get(meal_name), route_line, tr, user_prefs
+                )
+            if not located:
+                return meal_name, []
+            offsets[meal_name] = len(matrix_points)
+            matrix_points.extend(via for _, via in located)
+            idx = list(range(offsets[meal_name], len(matrix_points)))
+            a, b = meal_legs[meal_name], meal_legs[meal_name] + 1
+            with stage("detours"):
+                durations = await duration_matrix(matrix_points, [([a], idx + [b]), (idx, [b])])
+            extra = durations[a, idx] + durations[idx, b] - durations[a, b]
+            detours = [int(math.ceil(max(0, int(x)) / 60.0)) for x in extra]
+            return meal_name, rank_meal_stops(meal_name, located, detours, eta_dt, tr, user_prefs)
+        except Exception as e:
+            logger.error(f"Meal '{meal_name}' failed: {e}", exc_info=e)
+            return meal_name, []
+
+    ranked: Dict[str, List[Tuple[PlaceSuggestion, int]]] = {}
+    for next_meal in asyncio.as_completed(
+        [rank_meal(name, point, eta_dt) for name, (point, eta_dt) in meal_points.items()]
+    ):
+        meal_name, ranked[meal_name] = await next_meal
+        meal_suggestions[meal_name] = [suggestion for suggestion, _ in ranked[meal_name]]
+        yield {"event": "meal", "meal": meal_name, "suggestions": meal_suggestions[meal_name]}
+
+    logger.info("Meal suggestion counts: %s", lazy(lambda: {m: len(v) for m, v in meal_suggestions.items()}))
+    # Full payload dumps only when LOG_LEVEL=DEBUG, rendered on the logging thread
+    logger.debug("Meal suggestions structure: %s", meal_suggestions)
+
+    # 8. Pick one stop per meal jointly: the combination with the least added
+    # driving time whose arrivals fall within the meal windows (with the same
+    # 30-minute tolerance as eta_matches_window), counted back from the
+    # preferred arrival
+    planned = sorted((name for name in ranked if ranked[name]), key=lambda name: meal_points[name][1])
+    tolerance = timedelta(minutes=30)
+    slots = []
+    for meal_name in planned:
+        window_start, window_end = meal_windows[meal_name]
+        start_dt = trip_departure_dt.replace(hour=window_start.hour, minute=window_start.minute, second=0, microsecond=0)
+        end_dt = trip_departure_dt.replace(hour=window_end.hour, minute=window_end.minute, second=0, microsecond=0)
+        if end_dt <= start_dt:
+            end_dt += timedelta(days=1)
+        slots.append((
+            meal_legs[meal_name],
+            [offsets[meal_name] + k for _, k in ranked[meal_name]],
+            ((start_dt - tolerance - preferred_arrival).total_seconds(),
+             (end_dt + tolerance - preferred_arrival).total_seconds()),
+        ))
+    plan = None
+    if slots:
+        # Besides the cells each meal already fetched, consecutive meals on
+        # the same leg need the drives between their suggestions
+        blocks = [([leg], list(stops) + [leg + 1]) for leg, stops, _ in slots]
+        blocks += [(list(stops), [leg + 1]) for leg, stops, _ in slots]
+        blocks += [(list(first[1]), list(second[1])) for first, second in zip(slots, slots[1:]) if first[0] == second[0]]
+        with stage("detours"):
+            durations = await duration_matrix(matrix_points, blocks)
+        # The chain between anchors comes from the route's own legs
+        for leg, seconds in enumerate(leg_seconds):
+            durations[leg, leg + 1] = seconds
+        with stage("sequence"):
+            plan = plan_meal_stops(durations, range(len(anchors)), slots, tr.meal_duration_min * 60)
+
+    recommended_stops: Dict[str, str] = {}
+    added_detour_seconds = 0
+    if plan is not None:
+        for meal_name, choice in zip(planned, plan.choices):
+            recommended_stops[meal_name] = ranked[meal_name][choice][0].osm_id
+        added_detour_seconds = int(plan.added_seconds)
+        if not plan.windows_met:
+            logger.warning("No combination of meal stops meets every meal window; using the quickest")
+        logger.info(f"Meal stops {recommended_stops} add {added_detour_seconds}s of driving")
+
+    total_seconds_with_detours = route_seconds + total_meal_time_sec + added_detour_seconds
+    latest_start_dt_final = preferred_arrival - timedelta(seconds=total_seconds_with_detours)
+    recommended_window_final = [
+        (latest_start_dt_final - window_margin).isoformat(),
+        (latest_start_dt_final + window_margin).isoformat()
+    ]
+    yield {
+        "event": "departure",
+        "recommended_departure_iso": latest_start_dt_final.isoformat(),
+        "recommended_departure_window": recommended_window_final,
+        "recommended_meal_stops": recommended_stops,
+    }
 
-        # 9. Build response
-        route_summary = RouteSummary(
-            total_distance_km=route_distance / 1000.0,
-            total_duration_min=route_seconds / 60.0,
-            stops=[f"{s.lat},{s.lng}" for s in (tr.stops or [])],
-            geometry=[]  # Could extract from route if needed
-        )
 
-        # Generate trip ID (will be replaced when saving to Firebase)
-        trip_id = "temp_" + datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        logger.info(f"DEBUG: Meal suggestions structure: {meal_suggestions}")
-        for meal_name, suggestions in meal_suggestions.items():
-            logger.info(f"DEBUG: {meal_name} has {len(suggestions)} suggestions")
-            for i, suggestion in enumerate(suggestions):
-                logger.info(f"DEBUG: Suggestion {i+1}: {suggestion}")
+@app.post("/trips/create", response_model=TripResponse)
+@timed("handler")
+async def create_trip(tr: TripRequest):
+    """
+    Enhanced trip creation with user preference integration
+    """
+    try:
+        logger.info("=== ENHANCED create_trip with personalization ===")
 
+        meal_suggestions: Dict[str, List[PlaceSuggestion]] = {}
+        async for event in plan_trip_events(tr):
+            if event["event"] == "route":
+                baseline = event
+            elif event["event"] == "meal":
+                meal_suggestions[event["meal"]] = event["suggestions"]
+            else:
+                departure = event
 
+        # 9. Build response
         response = TripResponse(
-            trip_id=trip_id,
-            recommended_departure_iso=latest_start_dt_final.isoformat(),
-            recommended_departure_window=recommended_window_final,
-            route_summary=route_summary,
-            meal_suggestions=meal_suggestions,
-            personalization_used=personalization_used
+            trip_id=baseline["trip_id"],
+            recommended_departure_iso=departure["recommended_departure_iso"],
+            recommended_departure_window=departure["recommended_departure_window"],
+            route_summary=baseline["route_summary"],
+            meal_suggestions={name: meal_suggestions[name] for name in baseline["meals"]},
+            recommended_meal_stops=departure["recommended_meal_stops"],
+            personalization_used=baseline["personalization_used"]
         )
-        logger.info(f"DEBUG: Final response meal_suggestions: {response.meal_suggestions}")
+        logger.debug("Final response: %s", response)
 
-
-        logger.info(f"Enhanced trip created successfully. Personalization: {personalization_used}")
+        logger.info(f"Enhanced trip created successfully. Personalization: {baseline['personalization_used']}")
         return response
 
     except HTTPException:
@@ -863,7 +1738,63 @@ async def create_trip(tr: TripRequest):
     except Exception as e:
         logger.error(f"Enhanced create_trip error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-    
+
+
+def _encode_trip_event(event: Dict[str, Any], fmt: str) -> bytes:
+    data = dumps(event)
+    if fmt == "sse":
+        return b"event: " + event["event"].encode() + b"\ndata: " + data + b"\n\n"
+    return data + b"\n"
+
+
+@app.post("/trips/create/stream")
+async def create_trip_stream(
+    tr: TripRequest,
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(ndjson|sse)$"),
+):
+    """
+    /trips/create, streamed as the plan comes together: a "route" event once
+    the baseline route is known, a "meal" event as each meal finishes, and a
+    final "departure" event. NDJSON by default; format=sse (or
+    Accept: text/event-stream) sends Server-Sent Events instead.
+    Failures after the first event arrive as an "error" event.
+    """
+    logger.info("=== Streaming create_trip ===")
+    if fmt is None:
+        fmt = "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+
+    events = plan_trip_events(tr)
+    try:
+        # Bad input and routing failures still get a proper status code
+        first = await events.__anext__()
+    except HTTPException:
+        await events.aclose()
+        raise
+    except Exception as e:
+        await events.aclose()
+        logger.error(f"Streaming create_trip error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    async def body():
+        try:
+            yield _encode_trip_event(first, fmt)
+            async for event in events:
+                yield _encode_trip_event(event, fmt)
+            logger.info(f"Streamed trip created successfully. Personalization: {first['personalization_used']}")
+        except Exception as e:
+            logger.error(f"Streaming create_trip error: {e}", exc_info=True)
+            yield _encode_trip_event({"event": "error", "detail": str(e)}, fmt)
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if fmt == "sse" else "application/x-ndjson",
+        # Keep proxies from buffering the events into one response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/trips/finalize")
 async def finalize_trip(ftr: FinalizeTripRequest):
     """
@@ -901,28 +1832,121 @@ async def finalize_trip(ftr: FinalizeTripRequest):
 # ----------------------------
 # NEW ENDPOINT: Get User Trips
 # ----------------------------
+TRIPS_PAGE_SIZE = 20
+TRIPS_PAGE_MAX = 100
+_FIELD_PATH_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+def _encode_trips_cursor(doc_id: str) -> str:
+    return base64.urlsafe_b64encode(doc_id.encode()).decode().rstrip("=")
+
+
+def _decode_trips_cursor(token: str) -> str:
+    try:
+        doc_id = base64.b64decode(token + "=" * (-len(token) % 4), altchars=b"-_", validate=True).decode()
+    except (ValueError, UnicodeDecodeError):
+        doc_id = ""
+    if not doc_id:
+        raise HTTPException(status_code=400, detail="Invalid start_after token")
+    return doc_id
+
+
+def _fetch_trips_page(user_id: str, limit: int, start_after: Optional[str],
+                      fields: Optional[List[str]]) -> Tuple[List[Dict], Optional[str]]:
+    """One page of a user's trips, newest first (trip IDs start with their timestamp). Blocking."""
+    trips_ref = (
+        db.collection("trips")
+        .where("user_id", "==", user_id)
+        .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+    )
+    if fields:
+        trips_ref = trips_ref.select(fields)
+    if start_after:
+        trips_ref = trips_ref.start_after({FieldPath.document_id(): start_after})
+    # One extra document tells us whether there is a next page
+    docs = list(trips_ref.limit(limit + 1).stream())
+
+    trips = []
+    for doc in docs[:limit]:
+        trip_data = doc.to_dict()
+        trip_data["id"] = doc.id
+        trips.append(trip_data)
+    next_token = _encode_trips_cursor(docs[limit - 1].id) if len(docs) > limit else None
+    return trips, next_token
+
+
 @app.get("/users/{user_id}/trips")
-async def get_user_trips(user_id: str):
-    """Get all trips for a user"""
+async def get_user_trips(
+    user_id: str,
+    limit: int = Query(TRIPS_PAGE_SIZE, ge=1, le=TRIPS_PAGE_MAX),
+    start_after: Optional[str] = None,
+    select: Optional[str] = None,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|json)$"),
+):
+    """
+    Get a user's trips one page at a time, newest first.
+    select: comma-separated fields to return (e.g. status,finalized_at)
+    start_after: next_page_token from the previous page
+    Streams NDJSON by default: one trip per line, then {"next_page_token": ...};
+    format=json returns {"trips": [...], "next_page_token": ...} instead.
+    """
     if not db:
-        return {"trips": [], "message": "Firebase not available"}
-    
+        if fmt == "json":
+            return {"trips": [], "next_page_token": None, "message": "Firebase not available"}
+        return StreamingResponse(
+            iter([dumps({"next_page_token": None, "message": "Firebase not available"}) + b"\n"]),
+            media_type="application/x-ndjson",
+        )
+
+    fields = [f.strip() for f in select.split(",") if f.strip()] if select else None
+    if fields and not all(_FIELD_PATH_RE.match(f) for f in fields):
+        raise HTTPException(status_code=400, detail="select must be a comma-separated list of field names")
+    cursor = _decode_trips_cursor(start_after) if start_after else None
+
     try:
-        trips_ref = db.collection("trips").where("user_id", "==", user_id)
-        docs = trips_ref.stream()
-        
-        trips = []
-        for doc in docs:
-            trip_data = doc.to_dict()
-            trip_data["id"] = doc.id
-            trips.append(trip_data)
-        
-        return {"trips": trips}
-        
+        # The Firestore query is synchronous gRPC; keep it off the event loop
+        trips, next_token = await asyncio.to_thread(_fetch_trips_page, user_id, limit, cursor, fields)
     except Exception as e:
         logger.error(f"Error fetching user trips: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching trips: {str(e)}")
 
+    if fmt == "json":
+        return {"trips": trips, "next_page_token": next_token}
+
+    def ndjson_lines():
+        for trip in trips:
+            yield dumps(trip) + b"\n"
+        yield dumps({"next_page_token": next_token}) + b"\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+# ----------------------------
+# Prometheus metrics
+# ----------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus exposition: request and per-stage latency histograms, upstream call counters"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# ----------------------------
+# Debug: cache and coalescing statistics
+# ----------------------------
+@app.get("/debug/stats")
+async def debug_stats():
+    """Hit/miss counters of the in-process caches and coalesced upstream calls"""
+    poi_cache = get_poi_cache()
+    return {
+        "route_cache": route_cache.stats(),
+        "timeline_cache": timeline_cache.stats(),
+        "polyline_cache": polyline_cache.stats(),
+        "duration_cache": duration_cache.stats(),
+        "poi_cache": await asyncio.to_thread(poi_cache.stats) if poi_cache else None,
+        "preferences": preference_service.stats() if preference_service else None,
+        "trip_writer": trip_writer.stats() if trip_writer else None,
+        "traffic_capture": traffic_recorder.stats() if traffic_recorder else None,
+        "singleflight": {upstream: sf.stats() for upstream, sf in _singleflight.items()},
+    }
+
 # ----------------------------
 # Run
 # ----------------------------
@@ -0,0 +1,128 @@
+"""
+Joint choice of one stop per meal along a trip.
+
+The trip drives through its anchors in order (source, the user's stops,
+destination). Each meal stop is inserted into one leg between two anchors,
+and meals come in route order. Given a driving-time matrix over anchors and
+candidates, plan_meal_stops picks the combination of candidates with the
+least total driving time such that each stop is reached within its meal
+window.
+
+Times are counted backwards from the preferred arrival, as the departure
+recommendation is. When a stop is reached then depends only on what comes
+after it. The dynamic program therefore runs from the last meal to the
+first, over the ways to finish the trip from each candidate. Without
+windows that is the quickest one per candidate, O(meals * candidates^2).
+With windows it keeps every feasible continuation, which at the five
+suggestions per meal the API returns is still a few hundred at most.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# (leg, candidate matrix indices, window) for one meal; the window bounds the
+# arrival at the stop in seconds relative to the preferred arrival (so both
+# are usually negative), or is None for no constraint
+MealSlot = Tuple[int, Sequence[int], Optional[Tuple[float, float]]]
+
+
+class MealPlan:
+    def __init__(self, choices: List[int], arrivals: List[float], drive_seconds: float,
+                 baseline_seconds: float, windows_met: bool):
+        self.choices = choices  # chosen position in each meal's candidate list
+        self.arrivals = arrivals  # seconds relative to the preferred arrival
+        self.drive_seconds = drive_seconds
+        self.baseline_seconds = baseline_seconds
+        self.windows_met = windows_met
+
+    @property
+    def added_seconds(self) -> float:
+        """Driving time the meal stops add to the trip (never negative)."""
+        return max(0.0, self.drive_seconds - self.baseline_seconds)
+
+    def __repr__(self):
+        return (f"MealPlan(choices={self.choices}, added_seconds={self.added_seconds:.0f}, "
+                f"windows_met={self.windows_met})")
+
+
+def plan_meal_stops(durations: np.ndarray, anchors: Sequence[int], meals: Sequence[MealSlot],
+                    meal_seconds: float) -> Optional[MealPlan]:
+    """
+    durations[i, j] is the driving time in seconds from matrix point i to j;
+    anchors are the matrix indices of source, stops and destination, so leg l
+    runs from anchors[l] to anchors[l + 1]. Every meal stop takes
+    meal_seconds, and every meal needs at least one candidate. If no
+    combination meets all windows, the quickest one is returned with
+    windows_met=False. None when there are no meals.
+    """
+    if not meals:
+        return None
+    d = np.asarray(durations, dtype=np.float64)
+    anchors = list(anchors)
+    last_leg = len(anchors) - 2
+    # chain[k]: driving time from the source to anchor k without any meal stop
+    chain = np.concatenate(([0.0], np.cumsum([d[a, b] for a, b in zip(anchors[:-1], anchors[1:])])))
+
+    legs = []
+    for leg, _, _ in meals:
+        leg = min(max(leg, legs[-1] if legs else 0, 0), last_leg)
+        legs.append(leg)
+    candidates = [np.asarray(c, dtype=np.intp) for _, c, _ in meals]
+
+    def drive(src: np.ndarray, src_leg: int, dst: np.ndarray, dst_leg: int) -> np.ndarray:
+        """Driving time from each src point to each dst point, via the anchors in between."""
+        if src_leg == dst_leg:
+            return d[np.ix_(src, dst)]
+        return (d[src, anchors[src_leg + 1]][:, None] + (chain[dst_leg] - chain[src_leg + 1])
+                + d[anchors[dst_leg], dst][None, :])
+
+    def solve(enforce_windows: bool):
+        # options[i]: every way found to finish the trip from meal i, as parallel
+        # arrays (candidate position, remaining drive seconds, option index at
+        # meal i + 1). A slower continuation can be what lets an earlier stop
+        # make its window, so all feasible ones are kept while earlier windows
+        # remain to be checked; otherwise only the quickest per candidate.
+        n = len(meals)
+        options = [None] * n
+        for i in range(n - 1, -1, -1):
+            k = len(candidates[i])
+            if i == n - 1:
+                rem = drive(candidates[i], legs[i], np.array([anchors[-1]]), last_leg)[:, 0]
+                cand, nxt = np.arange(k), np.full(k, -1)
+            else:
+                next_cand, next_rem, _ = options[i + 1]
+                block = drive(candidates[i], legs[i], candidates[i + 1], legs[i + 1])
+                rem = (block[:, next_cand] + next_rem[None, :]).ravel()
+                cand = np.repeat(np.arange(k), len(next_cand))
+                nxt = np.tile(np.arange(len(next_cand)), k)
+            window = meals[i][2]
+            if enforce_windows and window is not None:
+                arrival = -((n - i) * meal_seconds + rem)
+                ok = (arrival >= window[0]) & (arrival <= window[1])
+                cand, rem, nxt = cand[ok], rem[ok], nxt[ok]
+            if not len(cand):
+                return None
+            if not (enforce_windows and any(m[2] is not None for m in meals[:i])):
+                order = np.lexsort((rem, cand))
+                first = np.concatenate(([True], cand[order][1:] != cand[order][:-1]))
+                cand, rem, nxt = cand[order][first], rem[order][first], nxt[order][first]
+            options[i] = (cand, rem, nxt)
+
+        cand, rem, nxt = options[0]
+        total = drive(np.array([anchors[0]]), 0, candidates[0], legs[0])[0][cand] + rem
+        option = int(total.argmin())
+        choices, arrivals = [], []
+        for i in range(n):
+            cand, rem, nxt = options[i]
+            choices.append(int(cand[option]))
+            arrivals.append(float(-((n - i) * meal_seconds + rem[option])))
+            option = int(nxt[option])
+        return choices, arrivals, float(total.min())
+
+    solved = solve(enforce_windows=True)
+    windows_met = solved is not None
+    if solved is None:
+        solved = solve(enforce_windows=False)
+    choices, arrivals, drive_seconds = solved
+    return MealPlan(choices, arrivals, drive_seconds, float(chain[-1]), windows_met)
@@ -0,0 +1,168 @@
+"""
+Per-stage latency instrumentation, Prometheus exposition and Server-Timing.
+
+Counters and histograms here are tiny thread-safe in-process versions of the
+Prometheus types, rendered in the text exposition format by ``render()``
+for the ``/metrics`` endpoint.
+
+Each request gets a RequestTimings through a contextvar (set by the metrics
+middleware in main_osrm). ``with stage("osrm_route"):`` observes the stage
+histogram and adds the duration to the current request. Stages that run
+once per meal (detours, scoring, ...) are summed across the concurrent
+meals. ``record_upstream`` counts actual upstream HTTP calls. Requests
+answered from a cache or coalesced by single-flight never get that far.
+The request's timings become its ``Server-Timing`` header.
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [non-cumulative bucket counts (+Inf last), sum]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][idx] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    bucket_labels = _labels(self.labelnames, key, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total[0]!r}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+REQUEST_SECONDS = Histogram("routivity_request_seconds", "HTTP request latency", ["method", "path", "status"])
+STAGE_SECONDS = Histogram("routivity_stage_seconds", "Time spent per /trips/create stage", ["stage"])
+UPSTREAM_REQUESTS = Counter("routivity_upstream_requests_total", "Upstream HTTP calls", ["upstream", "outcome"])
+UPSTREAM_SECONDS = Histogram("routivity_upstream_request_seconds", "Upstream HTTP call latency", ["upstream"])
+
+
+# ----------------------------
+# Per-request timings
+# ----------------------------
+class RequestTimings:
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.upstream: Dict[str, List[float]] = {}  # name -> [calls, seconds]
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries += [f'upstream-{name};desc="{int(calls)} call{"" if calls == 1 else "s"}";dur={seconds * 1000:.1f}'
+                    for name, (calls, seconds) in self.upstream.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+request_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def timed(name: str):
+    """Decorator form of ``stage`` for async endpoints (FastAPI still sees the original signature)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def inner(*args, **kwargs):
+            with stage(name):
+                return await fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def record_upstream(upstream: str, seconds: float, outcome: str):
+    UPSTREAM_REQUESTS.inc(upstream=upstream, outcome=outcome)
+    UPSTREAM_SECONDS.observe(seconds, upstream=upstream)
+    timings = request_timings.get()
+    if timings is not None:
+        calls = timings.upstream.setdefault(upstream, [0, 0.0])
+        calls[0] += 1
+        calls[1] += seconds
@@ -0,0 +1,283 @@
+"""
+Offline places provider built from a local OSM extract.
+
+``build`` reads restaurants and the tourism/historic categories from a
+``.osm.pbf`` (needs the ``osmium`` package) or GeoJSON extract and writes an
+index directory of plain ``.npy`` arrays plus a JSON record blob. At runtime
+the arrays are memory-mapped, so every worker shares the same pages, and
+radius / k-nearest queries go through a uniform lat/lon grid:
+
+    python places_offline.py build southern-zone.osm.pbf -o places_index
+    python places_offline.py query places_index 12.7517 80.2033 --radius 3000 --category historic
+
+Point main_osrm at it with PLACES_PROVIDER=offline and
+OFFLINE_PLACES_INDEX=places_index. Each record carries its poi_flags
+classification, computed once here rather than per request.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from poi_flags import classify_place
+
+EARTH_RADIUS_M = 6371000.0
+INDEX_VERSION = 1
+
+# Category names double as the ``query`` argument of search_places
+CATEGORIES = ["restaurant", "attraction", "museum", "historic"]
+
+
+def categorize(tags: Dict[str, str]) -> Optional[str]:
+    if tags.get("amenity") == "restaurant":
+        return "restaurant"
+    tourism = tags.get("tourism")
+    if tourism in ("attraction", "museum"):
+        return tourism
+    if tags.get("historic"):
+        return "historic"
+    return None
+
+
+# ----------------------------
+# Extract readers
+# ----------------------------
+def _positions(coords) -> Iterator[List[float]]:
+    if coords and isinstance(coords[0], (int, float)):
+        yield coords
+    else:
+        for c in coords:
+            yield from _positions(c)
+
+
+def _read_geojson(path: str) -> Iterator[Tuple[str, float, float, Dict]]:
+    with open(path) as f:
+        data = json.load(f)
+    for i, feature in enumerate(data.get("features", [])):
+        geom = feature.get("geometry") or {}
+        props = feature.get("properties") or {}
+        tags = props.get("tags", props)
+        positions = list(_positions(geom.get("coordinates") or []))
+        if not positions:
+            continue
+        # Points use their position; lines/polygons the mean of their vertices
+        lon = sum(p[0] for p in positions) / len(positions)
+        lat = sum(p[1] for p in positions) / len(positions)
+        osm_id = str(props.get("osm_id") or props.get("@id") or feature.get("id") or i)
+        yield osm_id, float(lat), float(lon), tags
+
+
+def _read_pbf(path: str) -> Iterator[Tuple[str, float, float, Dict]]:
+    try:
+        import osmium
+    except ImportError:
+        sys.exit("Reading .osm.pbf needs the osmium package (pip install osmium)")
+
+    found: List[Tuple[str, float, float, Dict]] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            tags = dict(n.tags)
+            if categorize(tags):
+                found.append((str(n.id), n.location.lat, n.location.lon, tags))
+
+        def way(self, w):
+            tags = dict(w.tags)
+            if not categorize(tags):
+                return
+            pts = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+            if pts:
+                lat = sum(p[0] for p in pts) / len(pts)
+                lon = sum(p[1] for p in pts) / len(pts)
+                found.append((str(w.id), lat, lon, tags))
+
+    Handler().apply_file(path, locations=True)
+    yield from found
+
+
+def read_extract(path: str) -> Iterator[Tuple[str, float, float, Dict]]:
+    if path.endswith((".geojson", ".json")):
+        return _read_geojson(path)
+    return _read_pbf(path)
+
+
+# ----------------------------
+# Index build
+# ----------------------------
+def _cell_keys(lats: np.ndarray, lons: np.ndarray, cell_deg: float) -> np.ndarray:
+    rows = np.floor((lats + 90.0) / cell_deg).astype(np.int64)
+    cols = np.floor((lons + 180.0) / cell_deg).astype(np.int64)
+    return (rows << 32) | cols
+
+
+def build_index(extract_path: str, out_dir: str, cell_deg: float = 0.05) -> int:
+    records = []
+    for osm_id, lat, lon, tags in read_extract(extract_path):
+        category = categorize(tags)
+        if category is None:
+            continue
+        records.append((osm_id, lat, lon, CATEGORIES.index(category), tags))
+    if not records:
+        raise ValueError(f"No restaurant/tourism/historic places found in {extract_path}")
+
+    lats = np.array([r[1] for r in records], dtype=np.float64)
+    lons = np.array([r[2] for r in records], dtype=np.float64)
+    keys = _cell_keys(lats, lons, cell_deg)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    cell_keys, cell_starts = np.unique(keys, return_index=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    offsets = [0]
+    with open(os.path.join(out_dir, "records.jsonl"), "wb") as blob:
+        for i in order:
+            osm_id, lat, lon, _, tags = records[i]
+            place = classify_place({"osm_id": osm_id, "name": tags.get("name", "Unknown"), "tags": tags})
+            line = json.dumps(place, separators=(",", ":")).encode() + b"\n"
+            blob.write(line)
+            offsets.append(offsets[-1] + len(line))
+
+    np.save(os.path.join(out_dir, "lat.npy"), lats[order])
+    np.save(os.path.join(out_dir, "lon.npy"), lons[order])
+    np.save(os.path.join(out_dir, "category.npy"), np.array([records[i][3] for i in order], dtype=np.uint8))
+    np.save(os.path.join(out_dir, "cell_keys.npy"), cell_keys)
+    np.save(os.path.join(out_dir, "cell_starts.npy"), np.append(cell_starts, len(records)).astype(np.int64))
+    np.save(os.path.join(out_dir, "record_offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"version": INDEX_VERSION, "cell_deg": cell_deg, "categories": CATEGORIES,
+                   "count": len(records), "source": os.path.basename(extract_path)}, f, indent=2)
+    return len(records)
+
+
+# ----------------------------
+# Runtime index
+# ----------------------------
+class OfflinePlacesIndex:
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported places index version {meta.get('version')} in {index_dir}")
+        self.cell_deg = float(meta["cell_deg"])
+        self.categories = meta["categories"]
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode="r")
+
+        self.lat = load("lat.npy")
+        self.lon = load("lon.npy")
+        self.category = load("category.npy")
+        self.cell_keys = load("cell_keys.npy")
+        self.cell_starts = load("cell_starts.npy")
+        self.record_offsets = load("record_offsets.npy")
+        with open(os.path.join(index_dir, "records.jsonl"), "rb") as f:
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _cells_in_box(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Indices of every point in the grid cells overlapping a lat/lon box."""
+        r0, r1 = (int(math.floor((v + 90.0) / self.cell_deg)) for v in (south, north))
+        c0, c1 = (int(math.floor((v + 180.0) / self.cell_deg)) for v in (west, east))
+        chunks = []
+        for row in range(r0, r1 + 1):
+            lo = np.searchsorted(self.cell_keys, (row << 32) | c0, side="left")
+            hi = np.searchsorted(self.cell_keys, (row << 32) | c1, side="right")
+            if hi > lo:
+                # cells of one row are contiguous in key order, hence in point order
+                chunks.append(np.arange(self.cell_starts[lo], self.cell_starts[hi]))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+    def _distances_m(self, lat: float, lon: float, idx: np.ndarray) -> np.ndarray:
+        p1 = math.radians(lat)
+        p2 = np.radians(self.lat[idx])
+        dl = np.radians(self.lon[idx]) - math.radians(lon)
+        x = np.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(x, 1.0)))
+
+    def _box(self, lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlon = math.degrees(radius_m / (EARTH_RADIUS_M * max(math.cos(math.radians(lat)), 1e-6)))
+        return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+    def _filter_category(self, idx: np.ndarray, category: Optional[str]) -> np.ndarray:
+        if category is None or idx.size == 0:
+            return idx
+        if category not in self.categories:
+            return np.empty(0, dtype=np.int64)
+        return idx[self.category[idx] == self.categories.index(category)]
+
+    def record(self, i: int) -> Dict:
+        start, end = int(self.record_offsets[i]), int(self.record_offsets[i + 1])
+        place = json.loads(self._blob[start:end])
+        place["lat"] = float(self.lat[i])
+        place["lon"] = float(self.lon[i])
+        return place
+
+    def radius_query(self, lat: float, lon: float, radius_m: float, category: Optional[str] = None) -> List[Dict]:
+        """Places within ``radius_m`` of a point, nearest first."""
+        idx = self._filter_category(self._cells_in_box(*self._box(lat, lon, radius_m)), category)
+        if idx.size == 0:
+            return []
+        dist = self._distances_m(lat, lon, idx)
+        keep = dist <= radius_m
+        idx, dist = idx[keep], dist[keep]
+        return [self.record(int(i)) for i in idx[np.argsort(dist, kind="stable")]]
+
+    def nearest(self, lat: float, lon: float, k: int = 10, category: Optional[str] = None,
+                max_radius_m: float = 200000.0) -> List[Dict]:
+        """The ``k`` nearest places, searching outwards until the answer cannot change."""
+        radius = self.cell_deg * 111320.0
+        while True:
+            idx = self._filter_category(self._cells_in_box(*self._box(lat, lon, radius)), category)
+            dist = self._distances_m(lat, lon, idx)
+            inside = dist <= radius
+            # Everything within ``radius`` has been seen, so k hits inside it are final
+            if inside.sum() >= k or radius >= max_radius_m:
+                idx, dist = idx[inside], dist[inside]
+                top = idx[np.argsort(dist, kind="stable")[:k]]
+                return [self.record(int(i)) for i in top]
+            radius = min(radius * 2, max_radius_m)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build and query the offline places index")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="ingest an .osm.pbf or GeoJSON extract")
+    b.add_argument("extract")
+    b.add_argument("-o", "--out", default="places_index")
+    b.add_argument("--cell-deg", type=float, default=0.05, help="grid cell size in degrees")
+
+    q = sub.add_parser("query", help="radius or k-nearest lookup against a built index")
+    q.add_argument("index")
+    q.add_argument("lat", type=float)
+    q.add_argument("lon", type=float)
+    q.add_argument("--radius", type=float, default=3000)
+    q.add_argument("--category", choices=CATEGORIES)
+    q.add_argument("-k", type=int, help="k-nearest instead of radius")
+
+    args = ap.parse_args()
+    if args.command == "build":
+        count = build_index(args.extract, args.out, args.cell_deg)
+        print(f"Indexed {count} places into {args.out}")
+    else:
+        index = OfflinePlacesIndex(args.index)
+        if args.k:
+            places = index.nearest(args.lat, args.lon, args.k, args.category)
+        else:
+            places = index.radius_query(args.lat, args.lon, args.radius, args.category)
+        for p in places:
+            category = p["tags"].get("amenity") or p["tags"].get("tourism") or p["tags"].get("historic")
+            print(f"- {p['name']} ({category}) @ {p['lat']:.5f}, {p['lon']:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Disk-backed POI cache keyed by slippy-map tile and amenity type.
+
+Overpass results are stored per tile in SQLite with an R-tree over the POI
+coordinates, so a radius query becomes: work out the covering tiles, fetch
+only the tiles that are missing or expired, then answer the query locally.
+Tiles that came back empty are cached too (with their own, shorter TTL) so
+that empty countryside does not hit Overpass on every trip.
+
+The methods block on SQLite, so main_osrm calls them through
+asyncio.to_thread; one lock serializes them on the shared connection.
+"""
+
+import json
+import math
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+Tile = Tuple[int, int]
+
+EARTH_RADIUS_M = 6371000.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    query TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    poi_count INTEGER NOT NULL,
+    PRIMARY KEY (query, x, y)
+);
+CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access);
+CREATE TABLE IF NOT EXISTS pois (
+    id INTEGER PRIMARY KEY,
+    query TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pois_tile ON pois (query, x, y);
+CREATE VIRTUAL TABLE IF NOT EXISTS pois_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+
+def tile_for(lat: float, lon: float, zoom: int) -> Tile:
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bbox(x: int, y: int, zoom: int) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) of a tile, i.e. the Overpass bbox order."""
+    n = 2 ** zoom
+
+    def lat_of(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return lat_of(y + 1), x / n * 360.0 - 180.0, lat_of(y), (x + 1) / n * 360.0 - 180.0
+
+
+def _radius_bbox(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = math.degrees(radius_m / (EARTH_RADIUS_M * max(math.cos(math.radians(lat)), 1e-6)))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    x = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(x))
+
+
+class PoiCache:
+    def __init__(self, path: str, zoom: int = 12, ttl: float = 7 * 86400, negative_ttl: float = 86400,
+                 max_tiles: int = 20000):
+        self.path = path
+        self.zoom = zoom
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_tiles = max_tiles
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            tiles, pois = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(poi_count), 0) FROM tiles").fetchone()
+        return {"tile_hits": self.hits, "tile_misses": self.misses, "evictions": self.evictions,
+                "tiles": tiles, "pois": pois}
+
+    def covering_tiles(self, lat: float, lon: float, radius_m: float) -> List[Tile]:
+        south, west, north, east = _radius_bbox(lat, lon, radius_m)
+        x0, y0 = tile_for(north, west, self.zoom)
+        x1, y1 = tile_for(south, east, self.zoom)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def tile_bbox(self, tile: Tile) -> Tuple[float, float, float, float]:
+        return tile_bbox(tile[0], tile[1], self.zoom)
+
+    def missing_tiles(self, query: str, tiles: Iterable[Tile]) -> List[Tile]:
+        """Tiles that have never been fetched or whose entry has expired."""
+        now = time.time()
+        unique = list(dict.fromkeys(tiles))
+        missing = []
+        with self._lock:
+            for x, y in unique:
+                row = self._conn.execute(
+                    "SELECT fetched_at, poi_count FROM tiles WHERE query = ? AND x = ? AND y = ?", (query, x, y)
+                ).fetchone()
+                if row is None:
+                    missing.append((x, y))
+                    continue
+                fetched_at, count = row
+                if now - fetched_at > (self.ttl if count else self.negative_ttl):
+                    missing.append((x, y))
+            self.hits += len(unique) - len(missing)
+            self.misses += len(missing)
+        return missing
+
+    def put_tiles(self, query: str, tiles: List[Tile], places: List[Dict]):
+        """
+        Store a fresh fetch of ``tiles``. Places are assigned to the tile
+        containing them; places outside the fetched tiles are ignored, and
+        tiles that received nothing are stored as negative entries.
+        """
+        now = time.time()
+        wanted = set(tiles)
+        by_tile: Dict[Tile, List[Dict]] = {t: [] for t in wanted}
+        for p in places:
+            if p.get("lat") is None or p.get("lon") is None:
+                continue
+            t = tile_for(p["lat"], p["lon"], self.zoom)
+            if t in wanted:
+                by_tile[t].append(p)
+
+        with self._lock, self._conn:
+            for (x, y), tile_places in by_tile.items():
+                self._delete_tile(query, x, y)
+                for p in tile_places:
+                    cur = self._conn.execute(
+                        "INSERT INTO pois (query, x, y, data) VALUES (?, ?, ?, ?)",
+                        (query, x, y, json.dumps(p, separators=(",", ":"))),
+                    )
+                    self._conn.execute(
+                        "INSERT INTO pois_rtree VALUES (?, ?, ?, ?, ?)",
+                        (cur.lastrowid, p["lat"], p["lat"], p["lon"], p["lon"]),
+                    )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                    (query, x, y, now, now, len(tile_places)),
+                )
+            self._evict()
+
+    def query_radius(self, query: str, lat: float, lon: float, radius_m: float) -> List[Dict]:
+        """Cached places of ``query`` type within ``radius_m`` of a point, in insertion order."""
+        south, west, north, east = _radius_bbox(lat, lon, radius_m)
+        tiles = self.covering_tiles(lat, lon, radius_m)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT p.data FROM pois_rtree r JOIN pois p ON p.id = r.id
+                WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ? AND p.query = ?
+                ORDER BY p.id
+                """,
+                (south, north, west, east, query),
+            ).fetchall()
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE tiles SET last_access = ? WHERE query = ? AND x = ? AND y = ?",
+                    [(now, query, x, y) for x, y in tiles],
+                )
+
+        places = []
+        for (data,) in rows:
+            p = json.loads(data)
+            if _haversine_m(lat, lon, p["lat"], p["lon"]) <= radius_m:
+                places.append(p)
+        return places
+
+    def _delete_tile(self, query: str, x: int, y: int):
+        ids = [r[0] for r in self._conn.execute(
+            "SELECT id FROM pois WHERE query = ? AND x = ? AND y = ?", (query, x, y)
+        )]
+        if ids:
+            self._conn.executemany("DELETE FROM pois_rtree WHERE id = ?", [(i,) for i in ids])
+            self._conn.execute("DELETE FROM pois WHERE query = ? AND x = ? AND y = ?", (query, x, y))
+        self._conn.execute("DELETE FROM tiles WHERE query = ? AND x = ? AND y = ?", (query, x, y))
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM tiles").fetchone()
+        excess = count - self.max_tiles
+        if excess <= 0:
+            return
+        victims = self._conn.execute(
+            "SELECT query, x, y FROM tiles ORDER BY last_access LIMIT ?", (excess,)
+        ).fetchall()
+        for query, x, y in victims:
+            self._delete_tile(query, x, y)
+        self.evictions += len(victims)
+
@@ -0,0 +1,140 @@
+"""
+Dietary / amenity classification computed once per POI at ingest time.
+
+classify_place scans a place's name and cuisine a single time and stores
+the answers under ``place["class"]``: a bitmask of keyword hits plus the
+parsed price level, rating, wheelchair flag, cuisine set and tag count.
+Overpass results are classified in _places_from_elements (so the tile cache
+stores them classified) and the offline index classifies at build time.
+Request-time filtering and scoring then only test bits.
+
+The keyword lists are the ones the request-time code used to scan with;
+each list that was used on its own gets its own bit so the results are
+unchanged.
+"""
+
+import re
+from typing import Dict, Optional, Pattern, Sequence
+
+# Bump when bits or lists change; places cached under an older version are reclassified
+CLASS_VERSION = 1
+
+# Personalization (scoring.CompiledScorer / calculate_personalization_score)
+VEG_INDICATORS = ["vegetarian", "veg", "pure_veg", "pure veg", "plant-based"]
+ACTIVITY_KEYWORDS = {
+    "relax": ["cafe", "bakery", "tea", "coffee", "dessert"],
+    "adventure": ["local", "traditional", "street", "authentic"],
+    "social": ["bar", "pub", "brewery", "tapas"],
+    "family": ["family", "kids", "child", "friendly"],
+}
+ACTIVITY_CUISINE_MAP = {
+    "trekking": ["local", "traditional", "hearty", "comfort"],
+    "heritage": ["traditional", "local", "authentic", "cultural"],
+    "photography": ["cafe", "aesthetic", "view", "rooftop"],
+    "wellness": ["healthy", "organic", "salad", "juice", "smoothie"],
+}
+# Vegetarian filter in suggest_meal_stops (matched on place name or cuisine)
+FILTER_VEG_INDICATORS = [
+    "vegetarian", "veg", "pure_veg", "pure veg", "plant-based",
+    "south indian", "north indian", "indian",  # Many Indian restaurants are veg-friendly
+]
+FILTER_NON_VEG_INDICATORS = [
+    "non-veg", "non veg", "chicken", "mutton", "fish", "seafood",
+    "meat", "bbq", "barbecue", "steak", "pork", "beef",
+]
+# score_place_overpass veg cues
+OVERPASS_VEG_CUISINE = ["vegetarian", "veg", "pure_veg", "south_indian", "north_indian"]
+OVERPASS_VEG_NAME = ["veg", "vegetarian", "pure veg"]
+
+VEG_FRIENDLY = 1 << 0         # filter: veg indicator in name or cuisine
+NON_VEG = 1 << 1              # filter: explicit non-veg indicator in name or cuisine
+VEG_CUISINE = 1 << 2          # personalization: veg indicator in cuisine
+VEG_NAME = 1 << 3             # personalization: veg indicator in name
+OVERPASS_VEG_CUISINE_HIT = 1 << 4
+OVERPASS_VEG_NAME_HIT = 1 << 5
+WHEELCHAIR = 1 << 6           # wheelchair=yes
+
+_next_bit = 7
+MOOD_BITS: Dict[str, int] = {}
+for _mood in ACTIVITY_KEYWORDS:
+    MOOD_BITS[_mood] = 1 << _next_bit
+    _next_bit += 1
+ACTIVITY_BITS: Dict[str, int] = {}
+for _activity in ACTIVITY_CUISINE_MAP:
+    ACTIVITY_BITS[_activity] = 1 << _next_bit
+    _next_bit += 1
+
+
+def keyword_regex(keywords: Sequence[str]) -> Pattern:
+    """One alternation that matches wherever any keyword is a substring."""
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+_filter_veg_re = keyword_regex(FILTER_VEG_INDICATORS)
+_filter_non_veg_re = keyword_regex(FILTER_NON_VEG_INDICATORS)
+_veg_re = keyword_regex(VEG_INDICATORS)
+_overpass_cuisine_re = keyword_regex(OVERPASS_VEG_CUISINE)
+_overpass_name_re = keyword_regex(OVERPASS_VEG_NAME)
+_group_res = [(MOOD_BITS[m], keyword_regex(kw)) for m, kw in ACTIVITY_KEYWORDS.items()] + \
+             [(ACTIVITY_BITS[a], keyword_regex(kw)) for a, kw in ACTIVITY_CUISINE_MAP.items()]
+
+
+def _rating(rating_tag) -> Optional[float]:
+    if rating_tag:
+        try:
+            return float(rating_tag)
+        except (ValueError, TypeError):
+            pass
+    return None
+
+
+def classify(place: Dict) -> Dict:
+    tags = place.get("tags", {}) or {}
+    tag_name = (tags.get("name") or "").lower()
+    place_name = (place.get("name") or "").lower()
+    cuisine = (tags.get("cuisine") or "").lower()
+
+    bits = 0
+    if _filter_veg_re.search(cuisine) or _filter_veg_re.search(place_name):
+        bits |= VEG_FRIENDLY
+    if _filter_non_veg_re.search(cuisine) or _filter_non_veg_re.search(place_name):
+        bits |= NON_VEG
+    if _veg_re.search(cuisine):
+        bits |= VEG_CUISINE
+    if _veg_re.search(tag_name):
+        bits |= VEG_NAME
+    if _overpass_cuisine_re.search(cuisine):
+        bits |= OVERPASS_VEG_CUISINE_HIT
+    if _overpass_name_re.search(tag_name):
+        bits |= OVERPASS_VEG_NAME_HIT
+    if tags.get("wheelchair") == "yes":
+        bits |= WHEELCHAIR
+    # No keyword contains a newline, so this matches "in name or in cuisine"
+    both = tag_name + "\n" + cuisine
+    for bit, pattern in _group_res:
+        if pattern.search(both):
+            bits |= bit
+
+    price_level = tags.get("price_level")
+    return {
+        "v": CLASS_VERSION,
+        "bits": bits,
+        "cuisines": [c.strip() for c in cuisine.split(";") if c.strip()],
+        "price_level": str(price_level) if price_level else None,
+        "rating": _rating(tags.get("rating")),
+        "tag_count": len(tags),
+    }
+
+
+def classify_place(place: Dict) -> Dict:
+    """Attach the classification to ``place`` (in place) and return it."""
+    place["class"] = classify(place)
+    return place
+
+
+def place_class(place: Dict) -> Dict:
+    """The stored classification, computing it for places ingested before it existed."""
+    cls = place.get("class")
+    if cls is None or cls.get("v") != CLASS_VERSION:
+        cls = classify_place(place)["class"]
+    return cls
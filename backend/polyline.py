@@ -0,0 +1,96 @@
+"""
+Encoded polylines and Douglas-Peucker simplification for route geometry.
+
+OSRM returns the full route as GeoJSON, i.e. [lng, lat] pairs: tens of
+thousands of them for a long drive. simplify() drops every vertex that is
+within ``tolerance_m`` of the simplified line, and encode() packs what is
+left into Google's encoded polyline format (lat,lng order, precision 5 or
+6), which clients such as react-native-maps and the Google Maps SDKs decode
+directly.
+"""
+
+import math
+from typing import List, Sequence
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def simplify(coords: Sequence[Sequence[float]], tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker over [lng, lat] points; returns the kept points. Distances
+    use an equirectangular projection around the route's mean latitude, which
+    is plenty accurate at tolerances of metres to a few hundred metres.
+    """
+    pts = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    n = len(pts)
+    if n < 3 or tolerance_m <= 0:
+        return pts
+
+    lat0 = math.radians(float(pts[:, 1].mean()))
+    xy = np.radians(pts) * EARTH_RADIUS_M
+    xy[:, 0] *= math.cos(lat0)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Explicit stack: recursion depth would follow the number of kept points
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a = xy[i]
+        ab = xy[j] - a
+        rel = xy[i + 1:j] - a
+        length2 = float(ab @ ab)
+        if length2 > 0:
+            t = np.clip(rel @ ab / length2, 0.0, 1.0)
+            rel = rel - t[:, None] * ab
+        dist2 = np.einsum("ij,ij->i", rel, rel)
+        k = int(dist2.argmax())
+        if dist2[k] > tolerance_m * tolerance_m:
+            mid = i + 1 + k
+            keep[mid] = True
+            stack.append((i, mid))
+            stack.append((mid, j))
+    return pts[keep]
+
+
+def encode(coords: Sequence[Sequence[float]], precision: int = 5) -> str:
+    """Encode [lng, lat] points as a polyline string."""
+    pts = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(pts):
+        return ""
+    scaled = np.round(pts[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # zig-zag sign encoding, then 5-bit chunks from the least significant end
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+    out: List[str] = []
+    for v in values:
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
+
+
+def decode(encoded: str, precision: int = 5) -> List[List[float]]:
+    """Inverse of encode(): [lng, lat] points."""
+    values = []
+    shift = result = 0
+    for ch in encoded:
+        b = ord(ch) - 63
+        result |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            shift = result = 0
+    factor = 10 ** precision
+    lat = lng = 0
+    coords = []
+    for dlat, dlng in zip(values[::2], values[1::2]):
+        lat += dlat
+        lng += dlng
+        coords.append([lng / factor, lat / factor])
+    return coords
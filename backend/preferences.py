@@ -0,0 +1,110 @@
+"""
+Non-blocking, cached user preference lookups.
+
+Firestore's client is synchronous, so reads run in a worker thread through
+asyncio.to_thread and never hold up other requests on the event loop.
+Results (including "this user has no preferences document") are kept in a
+TTLCache, so a user's repeat plans cost no Firestore reads. After the first
+read of a user the service also attaches an ``on_snapshot`` listener to
+their document: Firestore pushes every later change from its own thread and
+the cached entry is replaced straight away, so the TTL only bounds
+staleness for users whose listener has been dropped.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from singleflight import SingleFlight
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# Cached marker for "user has no preferences document"
+_ABSENT = object()
+
+
+class PreferenceService:
+    def __init__(self, db, parse: Callable[[Dict], Any], collection: str = "preferences",
+                 ttl: float = 600, maxsize: int = 10000, watch: bool = True, max_watches: int = 1000):
+        self.db = db
+        self.parse = parse
+        self.collection = collection
+        self.cache = TTLCache(maxsize, ttl)
+        self.watch = watch
+        self.max_watches = max_watches
+        self.reads = 0
+        self.snapshot_updates = 0
+        self._flight = SingleFlight()
+        self._watches: "OrderedDict[str, Any]" = OrderedDict()
+        self._watch_lock = threading.Lock()
+
+    async def get(self, user_id: str) -> Optional[Any]:
+        cached = self.cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            return None if cached is _ABSENT else cached
+        # Concurrent first requests for one user share a single read
+        return await self._flight.do(user_id, lambda: asyncio.to_thread(self._load, user_id))
+
+    def invalidate(self, user_id: str):
+        self.cache.delete(user_id)
+
+    def _load(self, user_id: str) -> Optional[Any]:
+        doc_ref = self.db.collection(self.collection).document(user_id)
+        doc = doc_ref.get()
+        self.reads += 1
+        prefs = self._store(user_id, doc.to_dict() if doc.exists else None)
+        if self.watch:
+            self._subscribe(user_id, doc_ref)
+        return prefs
+
+    def _store(self, user_id: str, data: Optional[Dict]) -> Optional[Any]:
+        prefs = self.parse(data) if data is not None else None
+        self.cache.set(user_id, _ABSENT if prefs is None else prefs)
+        return prefs
+
+    def _subscribe(self, user_id: str, doc_ref):
+        with self._watch_lock:
+            if user_id in self._watches:
+                self._watches.move_to_end(user_id)
+                return
+        try:
+            watch = doc_ref.on_snapshot(lambda docs, changes, read_time: self._on_snapshot(user_id, docs))
+        except Exception as e:
+            logger.warning(f"Could not watch preferences of {user_id}, relying on TTL: {e}")
+            return
+        with self._watch_lock:
+            self._watches[user_id] = watch
+            dropped = []
+            while len(self._watches) > self.max_watches:
+                dropped.append(self._watches.popitem(last=False))
+        for old_user, old_watch in dropped:
+            old_watch.unsubscribe()
+            # Without a listener the entry could go stale; the next request re-reads it
+            self.invalidate(old_user)
+
+    def _on_snapshot(self, user_id: str, docs):
+        """Runs on Firestore's watch thread; the first call carries the current state."""
+        doc = docs[0] if docs else None
+        try:
+            self._store(user_id, doc.to_dict() if doc is not None and doc.exists else None)
+        except Exception as e:
+            logger.error(f"Bad preferences snapshot for {user_id}: {e}")
+            self.invalidate(user_id)
+        self.snapshot_updates += 1
+
+    def close(self):
+        with self._watch_lock:
+            watches, self._watches = list(self._watches.values()), OrderedDict()
+        for watch in watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.warning(f"Error closing preferences listener: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.cache.stats(), "firestore_reads": self.reads, "listeners": len(self._watches),
+                "snapshot_updates": self.snapshot_updates, **{f"singleflight_{k}": v for k, v in self._flight.stats().items()}}
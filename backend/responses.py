@@ -0,0 +1,190 @@
+"""
+Response encoding: orjson for JSON, optional MessagePack, and compression.
+
+- ``dumps`` encodes with orjson (json as a fallback when it is not
+  installed). Pydantic models and types orjson does not know, e.g.
+  Firestore timestamps, go through FastAPI's jsonable_encoder.
+- ``FastJSONResponse`` is the app's default response class. Endpoints with
+  a response_model keep FastAPI's own fast path, which dumps the model to
+  JSON bytes in pydantic's Rust core and beats both.
+- ``to_msgpack`` re-encodes a JSON body for clients that send
+  ``Accept: application/msgpack`` (needs the msgpack package).
+- ``CompressionMiddleware`` gzips, or brotli-compresses when the brotli
+  package is installed and the client accepts it, every compressible
+  response of at least ``minimum_size`` bytes. Streamed responses are
+  compressed chunk by chunk with a sync flush, so NDJSON/SSE events still
+  reach the client as they are produced.
+"""
+
+import json
+import zlib
+from typing import Any, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+MSGPACK_AVAILABLE = msgpack is not None
+BROTLI_AVAILABLE = brotli is not None
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", MSGPACK_MEDIA_TYPE, "text/")
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    return jsonable_encoder(obj)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def to_msgpack(json_body: bytes) -> bytes:
+    return msgpack.packb(loads(json_body))
+
+
+def accepts_msgpack(accept: str) -> bool:
+    return MSGPACK_AVAILABLE and MSGPACK_MEDIA_TYPE in accept
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """"br" or "gzip" from an Accept-Encoding header, preferring brotli; None for identity."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    if BROTLI_AVAILABLE and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._c = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush, so everything so far is decodable by the client."""
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.finish()
+        return self._c.compress(data) + self._c.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+        buffered: Optional[list] = None  # body parts of a response with a known length
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough, buffered
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if compressor is None:
+                content_type = headers.get("content-type", "")
+                length = int(headers.get("content-length", len(body) if not more_body else -1))
+                if ("content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES)
+                        or 0 <= length < self.minimum_size):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if length >= 0:
+                    # Whole body is coming (middlewares re-chunk even plain responses): compress it in one go
+                    buffered = []
+                else:
+                    del headers["Content-Length"]
+                    await send(start_message)
+
+            if buffered is not None:
+                buffered.append(body)
+                if more_body:
+                    return
+                data = compressor.finish(b"".join(buffered))
+                headers["Content-Length"] = str(len(data))
+                await send(start_message)
+                await send({"type": "http.response.body", "body": data})
+                return
+
+            data = compressor.chunk(body) if more_body else compressor.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,115 @@
+"""
+Personalization scoring compiled once per set of user preferences.
+
+calculate_personalization_score / score_place_enhanced in main_osrm rebuild
+their lookup tables and rescan name and cuisine once per keyword for every
+place. CompiledScorer resolves everything that only depends on the
+preferences up front (budget row, pace multiplier, the classification bits
+to test) and scores a whole candidate batch in one call against the
+per-place classification from poi_flags. Scores and match_reasons are
+identical to the reference functions, including the order of the
+floating-point additions; test_scorer_equivalence.py checks this.
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+from poi_flags import ACTIVITY_BITS, MOOD_BITS, VEG_CUISINE, VEG_NAME, WHEELCHAIR, place_class
+
+BUDGET_MAPPING = {
+    "budget": {"1": 2.0, "2": 1.0, "3": -1.0, "4": -2.0},
+    "moderate": {"1": 0.5, "2": 2.0, "3": 1.5, "4": -1.0},
+    "luxury": {"1": -1.0, "2": 0.5, "3": 2.0, "4": 3.0},
+}
+
+PACE_PENALTY_MULTIPLIER = {"relaxed": 0.7, "balanced": 1.0, "fast": 1.3}
+
+
+class CompiledScorer:
+    def __init__(self, food_preference: str, budget: str, pace: str, mood: str,
+                 activities: Sequence[str], accessibility: str):
+        self.veg = food_preference.lower() == "vegetarian"
+
+        self.budget_row = BUDGET_MAPPING.get(budget.lower()) if budget else None
+        self.budget_reason = f"Matches {budget} budget"
+
+        self.mood_bit = MOOD_BITS.get(mood.lower(), 0)
+        self.mood_reason = f"Great for {mood} mood"
+
+        # Duplicated activities score twice in the reference, so keep them all
+        self.activity_rules: List[Tuple[int, str]] = [
+            (ACTIVITY_BITS[a.lower()], f"Matches {a} interest")
+            for a in activities if a.lower() in ACTIVITY_BITS
+        ]
+
+        self.pace_multiplier = PACE_PENALTY_MULTIPLIER.get(pace.lower(), 1.0)
+        self.accessibility = accessibility.lower() != "none"
+
+    @classmethod
+    def for_prefs(cls, prefs) -> "CompiledScorer":
+        return _compiled(prefs.foodPreference, prefs.budget, prefs.pace, prefs.mood,
+                         tuple(prefs.activities), prefs.accessibility)
+
+    def personalization(self, cls: Dict, detour_minutes: int, max_detour: int) -> Tuple[float, List[str]]:
+        """Same result as calculate_personalization_score, from a poi_flags classification."""
+        bits = cls["bits"]
+        score = 0.0
+        reasons = []
+
+        if self.veg:
+            if bits & VEG_CUISINE:
+                score += 3.0
+                reasons.append("Vegetarian-friendly")
+            elif bits & VEG_NAME:
+                score += 2.5
+                reasons.append("Vegetarian in name")
+            else:
+                score -= 2.0
+
+        price_level = cls["price_level"]
+        if price_level and self.budget_row is not None:
+            budget_score = self.budget_row.get(price_level, 0)
+            score += budget_score
+            if budget_score > 0:
+                reasons.append(self.budget_reason)
+
+        if bits & self.mood_bit:
+            score += 1.5
+            reasons.append(self.mood_reason)
+
+        for bit, reason in self.activity_rules:
+            if bits & bit:
+                score += 1.0
+                reasons.append(reason)
+
+        rating = cls["rating"]
+        if rating is not None:
+            score += (rating - 3.0) * 0.5
+
+        score -= (detour_minutes / max(1, max_detour)) * 5.0 * self.pace_multiplier
+
+        if self.accessibility and bits & WHEELCHAIR:
+            score += 1.0
+            reasons.append("Accessibility friendly")
+
+        return max(score, 0.1), reasons
+
+    def score(self, place: Dict, detour_minutes: int, max_detour: int) -> Tuple[float, List[str]]:
+        """Same result as score_place_enhanced."""
+        cls = place_class(place)
+        personalization, reasons = self.personalization(cls, detour_minutes, max_detour)
+        rating = cls["rating"]
+        base_quality = rating if rating is not None else 3.0
+        final_score = (personalization * 0.7) + (base_quality * 0.3)
+        final_score += min(cls["tag_count"], 5) * 0.1
+        return final_score, reasons
+
+    def score_batch(self, places: Sequence[Dict], detours: Sequence[int],
+                    max_detour: int) -> List[Tuple[float, List[str]]]:
+        return [self.score(p, d, max_detour) for p, d in zip(places, detours)]
+
+
+@lru_cache(maxsize=256)
+def _compiled(food_preference: str, budget: str, pace: str, mood: str,
+              activities: Tuple[str, ...], accessibility: str) -> CompiledScorer:
+    return CompiledScorer(food_preference, budget, pace, mood, activities, accessibility)
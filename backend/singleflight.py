@@ -0,0 +1,46 @@
+"""
+In-process single-flight: concurrent calls with the same key share one
+in-flight upstream request.
+
+The first caller starts the work as its own task; everyone (including the
+first caller) awaits it through ``asyncio.shield``, so a caller that gets
+cancelled does not cancel the request the others are waiting on. Results and
+exceptions reach every waiter.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, "asyncio.Task"] = {}
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: "asyncio.Task"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Every waiter may have been cancelled; don't log "exception never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "inflight": self.inflight}
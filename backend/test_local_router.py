@@ -0,0 +1,219 @@
+"""
+The offline router (local_router.py) on a small synthetic town: a grid of
+junctions joined by curvy one-way and two-way streets of mixed classes,
+plus a dead-end spur, a closed loop and nodes that are on no road.
+Hierarchy distances are checked against a plain Dijkstra on the
+compressed graph, and table() and route() against a Dijkstra over every
+OSM node of the extract.
+
+    cd backend && python test_local_router.py      (or: python -m pytest test_local_router.py)
+"""
+
+import heapq
+import math
+import os
+import random
+import tempfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from local_router import LocalRouter, _haversine_m, _read_osm_xml, build_graph, way_direction, way_speed_kmh
+
+N = 12
+
+
+def _write_town(path):
+    rng = random.Random(5)
+    junction = lambda i, j: 1 + i * N + j
+    nodes = {junction(i, j): (12.9 + i * 0.01 + rng.uniform(-0.002, 0.002), 77.5 + j * 0.01 + rng.uniform(-0.002, 0.002))
+             for i in range(N) for j in range(N)}
+    next_id = [10000]
+
+    def shape_points(a, b):
+        # 0-3 bends between two junctions, each a node of this street only
+        (lat1, lon1), (lat2, lon2) = nodes[a], nodes[b]
+        ids = []
+        for k in range(1, rng.randint(0, 3) + 1):
+            f = k / 4
+            next_id[0] += 1
+            nodes[next_id[0]] = (lat1 + (lat2 - lat1) * f + rng.uniform(-0.001, 0.001),
+                                 lon1 + (lon2 - lon1) * f + rng.uniform(-0.001, 0.001))
+            ids.append(next_id[0])
+        return ids
+
+    def street(junctions):
+        refs = [junctions[0]]
+        for a, b in zip(junctions, junctions[1:]):
+            refs += shape_points(a, b) + [b]
+        return refs
+
+    ways = []
+    special = {}
+    for k in range(N):
+        for js, oneway in (([junction(k, j) for j in range(N)], "yes" if k % 4 == 1 else None),
+                           ([junction(i, k) for i in range(N)], "-1" if k % 5 == 2 else None)):
+            kind = "primary" if k % 6 == 0 else rng.choice(["residential", "tertiary", "secondary"])
+            ways.append((street(js), {"highway": kind, **({"oneway": oneway} if oneway else {})}))
+            if oneway == "yes" and "one_way" not in special:
+                bends = [r for r in ways[-1][0] if r >= 10000]
+                special["one_way"] = bends[1:3]
+    # a dead-end spur and a closed loop, both hanging off one junction
+    spur_start, loop_start = junction(3, 3), junction(8, 8)
+    for start, closed in ((spur_start, False), (loop_start, True)):
+        refs = [start]
+        lat, lon = nodes[start]
+        for k in range(5):
+            next_id[0] += 1
+            angle = k * 1.2
+            nodes[next_id[0]] = (lat + 0.002 * math.sin(angle) + 0.001, lon + 0.002 * math.cos(angle) + 0.001)
+            refs.append(next_id[0])
+        ways.append((refs + ([start] if closed else []), {"highway": "residential"}))
+        special["loop" if closed else "spur"] = refs[3]
+    # a footpath and a stray node: neither is part of the road graph
+    next_id[0] += 1
+    nodes[next_id[0]] = (12.95, 77.55)
+    ways.append(([junction(0, 0), next_id[0]], {"highway": "footway"}))
+    next_id[0] += 1
+    nodes[next_id[0]] = (12.96, 77.56)
+
+    lines = ['<?xml version="1.0"?>', '<osm version="0.6">']
+    lines += [f'<node id="{nid}" lat="{lat:.7f}" lon="{lon:.7f}"/>' for nid, (lat, lon) in nodes.items()]
+    for w, (refs, tags) in enumerate(ways, start=1):
+        lines.append(f'<way id="{w}">' + "".join(f'<nd ref="{r}"/>' for r in refs)
+                     + "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items()) + "</way>")
+    lines.append("</osm>")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    return special
+
+
+def _router(tmp):
+    extract = os.path.join(tmp, "town.osm")
+    special = _write_town(extract)
+    build_graph(extract, os.path.join(tmp, "graph"))
+    return LocalRouter(os.path.join(tmp, "graph")), extract, special
+
+
+def _dijkstra(adjacency, sources):
+    dist = dict(sources)
+    heap = [(d, v) for v, d in sources.items()]
+    heapq.heapify(heap)
+    while heap:
+        du, u = heapq.heappop(heap)
+        if du > dist[u]:
+            continue
+        for v, w in adjacency.get(u, ()):
+            if du + w < dist.get(v, math.inf):
+                dist[v] = du + w
+                heapq.heappush(heap, (du + w, v))
+    return dist
+
+
+def _compressed_graph(graph_dir):
+    indptr, indices, duration = (np.load(os.path.join(graph_dir, f"fwd_{k}.npy"))
+                                 for k in ("indptr", "indices", "duration"))
+    return {u: [(int(indices[e]), float(duration[e])) for e in range(indptr[u], indptr[u + 1])]
+            for u in range(len(indptr) - 1)}
+
+
+def _osm_graph(extract):
+    """Every drivable OSM segment of the extract: adjacency and coordinates by node ID."""
+    root = ET.parse(extract).getroot()
+    coords = {int(n.get("id")): (float(n.get("lat")), float(n.get("lon"))) for n in root.iter("node")}
+    adjacency = {}
+    for way in root.iter("way"):
+        tags = {t.get("k"): t.get("v") for t in way.iter("tag")}
+        if way_speed_kmh(tags) is None:
+            continue
+        refs = [int(nd.get("ref")) for nd in way.iter("nd")]
+        direction = way_direction(tags)
+        for a, b in zip(refs, refs[1:]):
+            seconds = _haversine_m(*coords[a], *coords[b]) / (way_speed_kmh(tags) / 3.6)
+            if direction >= 0:
+                adjacency.setdefault(a, []).append((b, seconds))
+            if direction <= 0:
+                adjacency.setdefault(b, []).append((a, seconds))
+    return adjacency, coords
+
+
+def _nearest_osm_node(adjacency, coords, lat, lon):
+    on_roads = set(adjacency) | {v for edges in adjacency.values() for v, _ in edges}
+    return min(on_roads, key=lambda n: (math.radians(coords[n][0] - lat) ** 2
+                                        + (math.radians(coords[n][1] - lon) * math.cos(math.radians(lat))) ** 2))
+
+
+def test_chains_are_compressed_and_stray_nodes_dropped():
+    with tempfile.TemporaryDirectory() as tmp:
+        router, extract, _ = _router(tmp)
+        adjacency, coords = _osm_graph(extract)
+        road_nodes = set(adjacency) | {v for edges in adjacency.values() for v, _ in edges}
+        kept, ways = _read_osm_xml(extract)
+        assert set(kept) == {r for refs, _ in ways for r in refs} == road_nodes
+        # the grid's junctions, the spur's dead end, and nothing else
+        assert len(router) == N * N + 1
+        # every road node survives as a shape point
+        assert set(zip(router.point_lat.tolist(), router.point_lon.tolist())) == {coords[n] for n in road_nodes}
+        try:
+            build_graph(extract, os.path.join(tmp, "too_big"), max_nodes=100)
+            raise AssertionError("an oversized graph was built")
+        except ValueError as e:
+            assert "145 road junctions" in str(e)
+
+
+def test_hierarchy_distances_match_plain_dijkstra():
+    with tempfile.TemporaryDirectory() as tmp:
+        router, _, _ = _router(tmp)
+        graph = _compressed_graph(os.path.join(tmp, "graph"))
+        nodes = list(range(len(router)))
+        sample = random.Random(1).sample(nodes, 15)
+        found = router._many_to_many([{s: 0.0} for s in sample], [{t: 0.0} for t in nodes])
+        for s, row in zip(sample, found):
+            expected = _dijkstra(graph, {s: 0.0})
+            for t, seconds in zip(nodes, row):
+                assert math.isclose(seconds, expected.get(t, math.inf), rel_tol=1e-6), (s, t)
+            # the unpacked path is made of road edges and costs the same
+            t = max(expected, key=expected.get)
+            cost, path = router._shortest_path({s: 0.0}, {t: 0.0})
+            assert path[0] == s and path[-1] == t and math.isclose(cost, expected[t], rel_tol=1e-6)
+            assert math.isclose(sum(router._edge(a, b)[0] for a, b in zip(path[:-1], path[1:])), expected[t], rel_tol=1e-6)
+
+
+def test_table_and_route_match_dijkstra_over_every_osm_node():
+    with tempfile.TemporaryDirectory() as tmp:
+        router, extract, special = _router(tmp)
+        adjacency, coords = _osm_graph(extract)
+        by_position = {(round(lon, 6), round(lat, 6)): n for n, (lat, lon) in coords.items()}
+        rng = random.Random(2)
+        points = [(77.5 + rng.uniform(0, 0.11), 12.9 + rng.uniform(0, 0.11)) for _ in range(10)]  # (lon, lat)
+        # on the spur, on the loop, and two bends of one one-way street
+        points += [(coords[n][1] + 1e-5, coords[n][0]) for n in [special["spur"], special["loop"]] + special["one_way"]]
+        osm_nodes = [_nearest_osm_node(adjacency, coords, lat, lon) for lon, lat in points]
+        table = router.table(points)["durations"]
+        for i, a in enumerate(points):
+            expected = _dijkstra(adjacency, {osm_nodes[i]: 0.0})
+            for j, b in enumerate(points):
+                seconds = expected.get(osm_nodes[j])
+                if seconds is None:
+                    assert table[i][j] is None, (i, j)
+                    continue
+                assert abs(table[i][j] - seconds) <= 0.05 + 1e-3, (i, j, table[i][j], seconds)
+                if i == j:
+                    continue
+                route = router.route([a, b])["routes"][0]
+                # the geometry walks real road segments from one snapped node to the other
+                path = [by_position[(round(lon, 6), round(lat, 6))] for lon, lat in route["geometry"]["coordinates"]]
+                assert path[0] == osm_nodes[i] and path[-1] == osm_nodes[j]
+                annotation = route["legs"][0]["annotation"]["duration"]
+                assert len(annotation) == len(path) - 1
+                for (p, q), d in zip(zip(path, path[1:]), annotation):
+                    assert abs(min(w for v, w in adjacency[p] if v == q) - d) <= 0.05 + 1e-3, (p, q)
+                # route() rounds each segment to 0.1 s, table() only the total
+                assert abs(table[i][j] - route["duration"]) <= 0.05 * len(annotation) + 0.1, (i, j)
+
+
+if __name__ == "__main__":
+    test_chains_are_compressed_and_stray_nodes_dropped()
+    test_hierarchy_distances_match_plain_dijkstra()
+    test_table_and_route_match_dijkstra_over_every_osm_node()
+    print("OK")
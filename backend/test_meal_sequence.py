@@ -0,0 +1,172 @@
+"""
+Joint meal-stop selection (meal_sequence.py) against brute force over every
+combination of candidates, and the trip-wide duration matrix it runs on
+(main_osrm.trip_duration_matrix).
+
+    cd backend && python test_meal_sequence.py      (or: python -m pytest test_meal_sequence.py)
+"""
+
+import asyncio
+import itertools
+
+import numpy as np
+
+import main_osrm
+from main_osrm import LatLng, duration_matrix, trip_duration_matrix
+from meal_sequence import plan_meal_stops
+
+MEAL_SECONDS = 1800.0
+
+
+def _brute_force(d, anchors, meals, enforce_windows=True):
+    """Walk each combination stop by stop: (drive seconds, choices), or None."""
+    best = None
+    for combo in itertools.product(*(range(len(c)) for _, c, _ in meals)):
+        # the visiting order: anchors of a leg come before the meals inserted into it
+        path, leg = [anchors[0]], 0
+        for (meal_leg, candidates, _), k in zip(meals, combo):
+            while leg < meal_leg:
+                leg += 1
+                path.append(anchors[leg])
+            path.append(candidates[k])
+        path.extend(anchors[leg + 1:])
+        drive = sum(d[a, b] for a, b in zip(path[:-1], path[1:]))
+
+        feasible = True
+        remaining, t = 0.0, 0.0
+        # arrival at each meal stop, counted back from the preferred arrival
+        for pos in range(len(path) - 1, 0, -1):
+            remaining += d[path[pos - 1], path[pos]]
+            for i, ((_, candidates, window), k) in enumerate(zip(meals, combo)):
+                if path[pos - 1] == candidates[k] and window is not None:
+                    t = -((len(meals) - i) * MEAL_SECONDS + remaining)
+                    feasible &= window[0] <= t <= window[1]
+        if enforce_windows and not feasible:
+            continue
+        if best is None or drive < best[0] - 1e-9:
+            best = (drive, list(combo))
+    return best
+
+
+def _random_case(rng, n_stops, n_meals, per_meal):
+    n = 2 + n_stops + n_meals * per_meal
+    xy = rng.uniform(0, 200_000, size=(n, 2))
+    d = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1)) / 20.0
+    d *= rng.uniform(1.0, 1.4, size=d.shape)  # asymmetric, slightly non-metric road times
+    np.fill_diagonal(d, 0.0)
+    anchors = list(range(n_stops + 2))
+    legs = sorted(rng.integers(0, n_stops + 1, size=n_meals))
+    meals, next_idx = [], n_stops + 2
+    for leg in legs:
+        candidates = list(range(next_idx, next_idx + per_meal))
+        next_idx += per_meal
+        start = -rng.uniform(3, 12) * 3600
+        meals.append((int(leg), candidates, (start, start + rng.uniform(1, 4) * 3600)))
+    return d, anchors, meals
+
+
+def test_matches_brute_force():
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        d, anchors, meals = _random_case(rng, n_stops=int(rng.integers(0, 3)), n_meals=int(rng.integers(1, 4)),
+                                         per_meal=int(rng.integers(1, 5)))
+        plan = plan_meal_stops(d, anchors, meals, MEAL_SECONDS)
+        expected = _brute_force(d, anchors, meals)
+        assert plan.windows_met == (expected is not None)
+        if expected is None:
+            expected = _brute_force(d, anchors, meals, enforce_windows=False)
+        assert abs(plan.drive_seconds - expected[0]) < 1e-6
+        # the reported choices really cost that much
+        assert abs(_brute_force(d, anchors, [(leg, [c[k]], None) for (leg, c, _), k in zip(meals, plan.choices)])[0]
+                   - plan.drive_seconds) < 1e-6
+
+
+def test_joint_choice_beats_independent_detours():
+    # source 0, destination 1; lunch candidates 2, 3; dinner candidates 4, 5.
+    # Alone, lunch 2 and dinner 4 each have the smallest detour, but going from
+    # lunch 3 to dinner 5 is much quicker than from 2 to 4.
+    d = np.full((6, 6), 5000.0)
+    np.fill_diagonal(d, 0.0)
+    d[0, 2], d[0, 3] = 1000.0, 1100.0
+    d[2, 4], d[3, 5], d[3, 4], d[2, 5] = 4000.0, 1500.0, 4000.0, 4000.0
+    d[4, 1], d[5, 1] = 1000.0, 1100.0
+    d[2, 1], d[3, 1], d[0, 4], d[0, 5], d[0, 1] = 4000.0, 4100.0, 4000.0, 4100.0, 5000.0
+    meals = [(0, [2, 3], None), (0, [4, 5], None)]
+    plan = plan_meal_stops(d, [0, 1], meals, MEAL_SECONDS)
+    assert plan.choices == [1, 1] and plan.drive_seconds == 3700.0
+    assert plan.baseline_seconds == 5000.0 and plan.added_seconds == 0.0
+    assert plan.arrivals == [-(2 * MEAL_SECONDS + 2600.0), -(MEAL_SECONDS + 1100.0)]
+
+    # a dinner window that only candidate 4 can make forces the other pairing
+    arrival_via_4 = -(MEAL_SECONDS + 1000.0)
+    plan = plan_meal_stops(d, [0, 1], [meals[0], (0, [4, 5], (arrival_via_4 - 10, arrival_via_4 + 10))], MEAL_SECONDS)
+    assert plan.windows_met and plan.choices[1] == 0
+    assert plan_meal_stops(d, [0, 1], [], MEAL_SECONDS) is None
+
+
+def test_matrix_rows_of_candidates_after_the_destination_come_from_the_table():
+    # plan_trip_events' layout: source, a stop, destination, then meal candidates
+    points = [LatLng(lat=12.9716 + i / 10, lng=77.5946 + i / 7) for i in range(6)]
+    destination = 2
+    calls = []
+
+    async def fake_table(coords, sources=None, destinations=None, **kwargs):
+        calls.append((sources, destinations))
+        return {"durations": [[1000.0 * i + j for j in destinations] for i in sources]}
+
+    original = main_osrm._osrm_table_request
+    main_osrm._osrm_table_request = fake_table
+    main_osrm.duration_cache.clear()
+    try:
+        matrix = asyncio.run(trip_duration_matrix(points, origin=0, destination=destination))
+        assert calls == [([0, 1, 3, 4, 5], [1, 2, 3, 4, 5])]
+        for i in range(len(points)):
+            for j in range(len(points)):
+                if i != j and i != destination and j != 0:
+                    assert matrix[i, j] == 1000.0 * i + j, (i, j)
+        # every needed cell is cached now: no second request
+        assert (asyncio.run(trip_duration_matrix(points, origin=0, destination=destination)) == matrix).all()
+        assert len(calls) == 1
+    finally:
+        main_osrm._osrm_table_request = original
+        main_osrm.duration_cache.clear()
+
+
+def test_duration_matrix_fetches_only_uncached_rows_in_table_sized_requests():
+    points = [LatLng(lat=12.0 + i / 100, lng=77.0 + i / 100) for i in range(10)]
+    calls = []
+
+    async def fake_table(coords, sources=None, destinations=None, **kwargs):
+        # map request positions back to point indices through the latitude
+        index = [round((float(c.split(",")[1]) - 12.0) * 100) for c in coords.split(";")]
+        calls.append(([index[i] for i in sources], [index[j] for j in destinations], len(index)))
+        return {"durations": [[1000.0 * index[i] + index[j] for j in destinations] for i in sources]}
+
+    original = main_osrm._osrm_table_request, main_osrm.OSRM_TABLE_MAX_COORDS
+    main_osrm._osrm_table_request, main_osrm.OSRM_TABLE_MAX_COORDS = fake_table, 4
+    main_osrm.duration_cache.clear()
+    try:
+        # a meal's own leg first: one small request
+        asyncio.run(duration_matrix(points, [([0], [2, 3, 1]), ([2, 3], [1])]))
+        assert calls == [([0, 2, 3], [1, 2, 3], 4)]
+        # the whole table is split to fit 4 coordinates, without the cached cells' rows
+        calls.clear()
+        matrix = asyncio.run(duration_matrix(points, [(range(10), range(10))]))
+        assert calls and all(n <= 4 for _, _, n in calls)
+        for i in range(10):
+            for j in range(10):
+                assert matrix[i, j] == (0.0 if i == j else 1000.0 * i + j), (i, j)
+        calls.clear()
+        asyncio.run(duration_matrix(points, [(range(10), range(10))]))
+        assert calls == []
+    finally:
+        main_osrm._osrm_table_request, main_osrm.OSRM_TABLE_MAX_COORDS = original
+        main_osrm.duration_cache.clear()
+
+
+if __name__ == "__main__":
+    test_matches_brute_force()
+    test_joint_choice_beats_independent_detours()
+    test_matrix_rows_of_candidates_after_the_destination_come_from_the_table()
+    test_duration_matrix_fetches_only_uncached_rows_in_table_sized_requests()
+    print("OK")
@@ -0,0 +1,104 @@
+"""
+The offline places index (places_offline.py) built from a small GeoJSON
+extract: radius_query and nearest against a brute-force haversine scan,
+with and without a category filter, including queries over empty cells.
+
+    cd backend && python test_places_offline.py      (or: python -m pytest test_places_offline.py)
+"""
+
+import json
+import math
+import os
+import random
+import tempfile
+
+from places_offline import CATEGORIES, OfflinePlacesIndex, build_index
+
+TAGS = {
+    "restaurant": {"amenity": "restaurant", "cuisine": "south_indian"},
+    "attraction": {"tourism": "attraction"},
+    "museum": {"tourism": "museum"},
+    "historic": {"historic": "monument"},
+}
+
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    x = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000.0 * math.asin(math.sqrt(x))
+
+
+def _places():
+    rng = random.Random(3)
+    places = []
+    for i in range(400):
+        category = rng.choice(CATEGORIES)
+        # two clusters with nothing in between, so some cells stay empty
+        lat0, lon0 = rng.choice([(12.95, 77.55), (13.35, 78.05)])
+        places.append((f"node/{i}", lat0 + rng.uniform(-0.12, 0.12), lon0 + rng.uniform(-0.12, 0.12), category))
+    return places
+
+
+def _index(tmp, places):
+    features = [{"type": "Feature", "id": osm_id, "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                 "properties": dict(TAGS[category], name=f"Place {osm_id}")}
+                for osm_id, lat, lon, category in places]
+    # a polygon feature is indexed at the mean of its vertices; an untagged one is skipped
+    features.append({"type": "Feature", "id": "way/1", "properties": {"tourism": "museum", "name": "Fort"},
+                     "geometry": {"type": "Polygon", "coordinates": [[[77.5, 12.9], [77.6, 12.9], [77.6, 13.0], [77.5, 13.0]]]}})
+    features.append({"type": "Feature", "id": "node/x", "properties": {"shop": "bakery"},
+                     "geometry": {"type": "Point", "coordinates": [77.55, 12.95]}})
+    extract = os.path.join(tmp, "extract.geojson")
+    with open(extract, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    assert build_index(extract, os.path.join(tmp, "index"), cell_deg=0.05) == len(places) + 1
+    return OfflinePlacesIndex(os.path.join(tmp, "index"))
+
+
+def _brute_force(places, lat, lon, category=None):
+    found = [(_haversine_m(lat, lon, p_lat, p_lon), osm_id) for osm_id, p_lat, p_lon, c in places
+             if category is None or c == category]
+    return sorted(found)
+
+
+def test_radius_query_matches_brute_force():
+    places = _places()
+    rng = random.Random(4)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = _index(tmp, places)
+        places = places + [("way/1", 12.95, 77.55, "museum")]
+        for _ in range(30):
+            lat, lon = rng.uniform(12.8, 13.5), rng.uniform(77.4, 78.2)
+            radius = rng.choice([500, 3000, 12000])
+            for category in (None, "restaurant", "museum"):
+                expected = [osm_id for d, osm_id in _brute_force(places, lat, lon, category) if d <= radius]
+                found = index.radius_query(lat, lon, radius, category)
+                assert [p["osm_id"] for p in found] == expected, (lat, lon, radius, category)
+                assert all(p["tags"] and "name" in p for p in found)
+        # between the clusters and far from both: empty cells, no places
+        assert index.radius_query(13.15, 77.8, 2000) == []
+        assert index.radius_query(12.95, 77.55, 5000, "fuel") == []
+
+
+def test_nearest_matches_brute_force():
+    places = _places()
+    rng = random.Random(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = _index(tmp, places)
+        places = places + [("way/1", 12.95, 77.55, "museum")]
+        for _ in range(30):
+            # also from empty cells, where the search has to widen
+            lat, lon = rng.uniform(12.8, 13.5), rng.uniform(77.4, 78.2)
+            for category in (None, "historic"):
+                expected = _brute_force(places, lat, lon, category)[:7]
+                found = index.nearest(lat, lon, k=7, category=category)
+                assert [p["osm_id"] for p in found] == [osm_id for _, osm_id in expected], (lat, lon, category)
+                for p, (d, _) in zip(found, expected):
+                    assert math.isclose(_haversine_m(lat, lon, p["lat"], p["lon"]), d, abs_tol=1e-6)
+
+
+if __name__ == "__main__":
+    test_radius_query_matches_brute_force()
+    test_nearest_matches_brute_force()
+    print("OK")
@@ -0,0 +1,63 @@
+"""
+The Overpass tile cache (poi_cache.py, filled by main_osrm._fill_poi_cache):
+a complete answer is cached per tile, an incomplete one is not cached at all.
+
+    cd backend && python test_poi_cache.py      (or: python -m pytest test_poi_cache.py)
+"""
+
+import asyncio
+import os
+import tempfile
+
+import main_osrm
+from poi_cache import PoiCache
+
+LAT, LON = 12.9716, 77.5946
+
+RESTAURANT = {"type": "node", "id": 1, "lat": LAT, "lon": LON, "tags": {"amenity": "restaurant", "name": "MTR"}}
+
+
+def _search_with_overpass_answer(cache, answer):
+    calls = []
+
+    async def fake_upstream_json(upstream, method, url, params=None, data=None, timeout=None):
+        calls.append(upstream)
+        return answer
+
+    original = main_osrm.upstream_json, main_osrm._poi_cache
+    main_osrm.upstream_json, main_osrm._poi_cache = fake_upstream_json, cache
+    try:
+        return asyncio.run(main_osrm.search_places(LAT, LON, radius=2000)), calls
+    finally:
+        main_osrm.upstream_json, main_osrm._poi_cache = original
+
+
+def test_incomplete_overpass_answer_is_not_cached():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PoiCache(os.path.join(tmp, "poi.sqlite3"))
+        tiles = cache.covering_tiles(LAT, LON, 2000)
+        timed_out = {
+            "elements": [RESTAURANT],
+            "remark": 'runtime error: Query timed out in "query" at line 3 after 61 seconds.',
+        }
+        try:
+            _search_with_overpass_answer(cache, timed_out)
+            raise AssertionError("an incomplete answer was accepted")
+        except RuntimeError as e:
+            assert "timed out" in str(e)
+        # neither the partial places nor negative entries for the empty tiles
+        assert cache.missing_tiles("restaurant", tiles) == tiles
+        assert cache.stats()["tiles"] == 0
+
+        places, calls = _search_with_overpass_answer(cache, {"elements": [RESTAURANT]})
+        assert [p["name"] for p in places] == ["MTR"] and calls == ["overpass"]
+        assert cache.missing_tiles("restaurant", tiles) == []
+        # now served from the cache
+        places, calls = _search_with_overpass_answer(cache, {"elements": []})
+        assert [p["name"] for p in places] == ["MTR"] and calls == []
+        cache.close()
+
+
+if __name__ == "__main__":
+    test_incomplete_overpass_answer_is_not_cached()
+    print("OK")
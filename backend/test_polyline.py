@@ -0,0 +1,56 @@
+"""
+Encoded polylines and Douglas-Peucker simplification (polyline.py).
+"""
+
+import math
+
+import numpy as np
+
+from polyline import decode, encode, simplify
+
+
+def test_matches_reference_encoding():
+    # The example from Google's polyline algorithm documentation ([lng, lat] here)
+    coords = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    assert encode(coords) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decode("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == coords
+    assert encode([]) == "" and decode("") == []
+
+
+def test_round_trip_at_precision_6():
+    rng = np.random.default_rng(1)
+    coords = np.column_stack((rng.uniform(-180, 180, 500), rng.uniform(-85, 85, 500)))
+    decoded = np.array(decode(encode(coords, precision=6), precision=6))
+    assert np.abs(decoded - coords).max() <= 0.5e-6 + 1e-12
+
+
+def _distance_to_line_m(point, line):
+    lat0 = math.radians(point[1])
+    scale = np.array([math.cos(lat0), 1.0]) * math.radians(1) * 6371000.0
+    p = np.asarray(point) * scale
+    pts = np.asarray(line) * scale
+    best = float("inf")
+    for a, b in zip(pts[:-1], pts[1:]):
+        ab = b - a
+        t = 0.0 if not ab.any() else min(max(float((p - a) @ ab / (ab @ ab)), 0.0), 1.0)
+        best = min(best, float(np.hypot(*(p - (a + t * ab)))))
+    return best
+
+
+def test_simplified_route_stays_within_tolerance():
+    t = np.linspace(0, 1, 3000)
+    coords = np.column_stack((77.59 + 2.68 * t + 0.05 * np.sin(t * 40), 12.97 + 0.11 * t + 0.08 * np.sin(t * 13)))
+    for tolerance in (5.0, 30.0, 200.0):
+        kept = simplify(coords, tolerance)
+        assert 2 <= len(kept) < len(coords)
+        assert (kept[0] == coords[0]).all() and (kept[-1] == coords[-1]).all()
+        # every dropped vertex is within the tolerance of the simplified line (plus projection slack)
+        assert max(_distance_to_line_m(p, kept) for p in coords[::7]) <= tolerance * 1.01
+    assert len(simplify(coords, 0)) == len(coords)
+
+
+if __name__ == "__main__":
+    test_matches_reference_encoding()
+    test_round_trip_at_precision_6()
+    test_simplified_route_stays_within_tolerance()
+    print("OK")
@@ -0,0 +1,177 @@
+"""
+PreferenceService caching and snapshot invalidation.
+
+The first two checks use a small in-memory stand-in for a Firestore
+document (get + on_snapshot). The last one runs against the Firestore
+emulator when FIRESTORE_EMULATOR_HOST is set:
+
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python test_preference_service.py
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+from preferences import PreferenceService
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeWatch:
+    def __init__(self, doc, callback):
+        self.doc, self.callback = doc, callback
+
+    def unsubscribe(self):
+        self.doc.watches.remove(self)
+
+
+class FakeDocument:
+    def __init__(self):
+        self.data = None
+        self.gets = 0
+        self.watches = []
+
+    def get(self):
+        self.gets += 1
+        time.sleep(0.01)  # a blocking round-trip, like the real client
+        return FakeSnapshot(self.data)
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self, callback)
+        self.watches.append(watch)
+        self._push(watch)
+        return watch
+
+    def set(self, data):
+        self.data = data
+        for watch in list(self.watches):
+            self._push(watch)
+
+    def _push(self, watch):
+        # Firestore delivers snapshots from its own thread
+        docs = [FakeSnapshot(self.data)] if self.data is not None else []
+        t = threading.Thread(target=watch.callback, args=(docs, [], None))
+        t.start()
+        t.join()
+
+
+class FakeDb:
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return self.docs.setdefault(doc_id, FakeDocument())
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for snapshot")
+        time.sleep(0.05)
+
+
+def test_repeat_lookups_cost_one_read():
+    async def run():
+        db = FakeDb()
+        db.document("u1").data = {"foodPreference": "vegetarian"}
+        service = PreferenceService(db, dict, ttl=60)
+        results = await asyncio.gather(*(service.get("u1") for _ in range(10)))
+        results.append(await service.get("u1"))
+        assert all(r == {"foodPreference": "vegetarian"} for r in results)
+        assert db.document("u1").gets == 1 and service.reads == 1
+
+        # "No document" is cached as well
+        assert await service.get("nobody") is None
+        assert await service.get("nobody") is None
+        assert service.reads == 2
+        service.close()
+        assert not db.document("u1").watches
+
+    asyncio.run(run())
+
+
+def test_snapshot_replaces_cached_entry():
+    async def run():
+        db = FakeDb()
+        db.document("u2").data = {"budget": "budget"}
+        service = PreferenceService(db, dict, ttl=60)
+        assert (await service.get("u2"))["budget"] == "budget"
+
+        db.document("u2").set({"budget": "luxury"})
+        assert (await service.get("u2"))["budget"] == "luxury"
+        db.document("u2").set(None)
+        assert await service.get("u2") is None
+        assert service.reads == 1
+        service.close()
+
+    asyncio.run(run())
+
+
+def test_listener_limit_drops_oldest():
+    async def run():
+        db = FakeDb()
+        service = PreferenceService(db, dict, ttl=60, max_watches=2)
+        for user in ("a", "b", "c"):
+            db.document(user).data = {"mood": user}
+            await service.get(user)
+        assert not db.document("a").watches and service.stats()["listeners"] == 2
+        # "a" lost its listener, so it is read again rather than served stale
+        await service.get("a")
+        assert db.document("a").gets == 2
+        service.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="FIRESTORE_EMULATOR_HOST not set")
+def test_emulator_round_trip():
+    from google.cloud import firestore
+
+    db = firestore.Client(project=os.getenv("GCLOUD_PROJECT", "routivity-test"))
+    user_id = f"test_{uuid.uuid4().hex[:8]}"
+    doc = db.collection("preferences").document(user_id)
+    doc.set({"foodPreference": "any", "mood": "relax"})
+
+    async def run():
+        service = PreferenceService(db, dict, ttl=600)
+        try:
+            assert (await service.get(user_id))["mood"] == "relax"
+            assert (await service.get(user_id))["mood"] == "relax"
+            assert service.reads == 1
+
+            doc.update({"mood": "social"})
+            wait_for(lambda: service.cache.get(user_id, {}).get("mood") == "social")
+            assert (await service.get(user_id))["mood"] == "social"
+            assert service.reads == 1
+        finally:
+            service.close()
+            doc.delete()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_repeat_lookups_cost_one_read()
+    test_snapshot_replaces_cached_entry()
+    test_listener_limit_drops_oldest()
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        test_emulator_round_trip()
+    else:
+        print("FIRESTORE_EMULATOR_HOST not set, skipping emulator test")
+    print("OK")
@@ -0,0 +1,85 @@
+"""
+Content negotiation and compression (responses.py).
+"""
+
+import asyncio
+import zlib
+
+import msgpack
+
+from responses import CompressionMiddleware, choose_encoding, dumps, loads, to_msgpack
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, deflate") is None
+    assert choose_encoding("") is None
+
+
+def test_msgpack_matches_json():
+    doc = {"trip_id": "t1", "meal_suggestions": {"lunch": [{"name": "Adyar Ananda Bhavan", "detour_minutes": 4.5}]}}
+    body = dumps(doc)
+    assert loads(body) == doc
+    assert msgpack.unpackb(to_msgpack(body)) == doc
+
+
+def _run(app, accept_encoding="gzip"):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=100)(scope, receive, send))
+    headers = {k.decode().lower(): v.decode() for k, v in sent[0]["headers"]}
+    return headers, [m["body"] for m in sent[1:]]
+
+
+def _app(chunks, content_type=b"application/json", length=None):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type)]
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return app
+
+
+def test_compresses_body_of_known_length():
+    body = dumps({"stops": [{"lat": 12.97, "lng": 77.59}] * 50})
+    headers, parts = _run(_app([body[:300], body[300:]], length=len(body)))
+    assert headers["content-encoding"] == "gzip" and "accept-encoding" in headers["vary"].lower()
+    assert len(parts) == 1 and int(headers["content-length"]) == len(parts[0]) < len(body)
+    assert zlib.decompress(parts[0], 31) == body
+
+
+def test_leaves_small_and_uncompressible_responses_alone():
+    headers, parts = _run(_app([b'{"ok":true}'], length=11))
+    assert "content-encoding" not in headers and parts == [b'{"ok":true}']
+    headers, parts = _run(_app([b"\x89PNG" * 100], content_type=b"image/png", length=400))
+    assert "content-encoding" not in headers
+    headers, parts = _run(_app([b"x" * 400], length=400), accept_encoding="identity")
+    assert "content-encoding" not in headers
+
+
+def test_streamed_chunks_decode_as_they_arrive():
+    events = [dumps({"event": "meal", "n": i}) + b"\n" for i in range(3)]
+    headers, parts = _run(_app(events, content_type=b"application/x-ndjson"))
+    assert headers["content-encoding"] == "gzip" and "content-length" not in headers
+    d = zlib.decompressobj(31)
+    # each event is fully decodable from the compressed bytes sent so far
+    for event, part in zip(events, parts):
+        assert d.decompress(part) == event
+
+
+if __name__ == "__main__":
+    test_choose_encoding()
+    test_msgpack_matches_json()
+    test_compresses_body_of_known_length()
+    test_leaves_small_and_uncompressible_responses_alone()
+    test_streamed_chunks_decode_as_they_arrive()
+    print("OK")
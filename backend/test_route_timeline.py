@@ -0,0 +1,89 @@
+"""
+RouteTimeline (main_osrm): position after departure from OSRM per-segment
+duration annotations, and the meal-window lookup built on it.
+
+    cd backend && python test_route_timeline.py      (or: python -m pytest test_route_timeline.py)
+"""
+
+from datetime import datetime, time as dtime
+
+from benchmarks.fake_upstreams import synthetic_route
+from main_osrm import RouteTimeline
+
+DEPARTURE = datetime(2024, 1, 15, 10, 0)
+
+
+def highway_route():
+    """Three segments of 600 s, 3000 s and 600 s, all inside a single OSRM step."""
+    coords = [[77.0, 12.0], [77.1, 12.0], [77.6, 12.0], [77.7, 12.0]]
+    return {
+        "duration": 4200.0,
+        "distance": 77000.0,
+        "geometry": {"type": "LineString", "coordinates": coords},
+        "legs": [{
+            "steps": [{"maneuver": {"location": coords[0]}, "duration": 4200.0},
+                      {"maneuver": {"location": coords[-1]}, "duration": 0.0}],
+            "annotation": {"duration": [600.0, 3000.0, 600.0]},
+        }],
+    }
+
+
+def close(a, b, eps=1e-9):
+    return abs(a - b) <= eps
+
+
+def test_position_interpolates_within_a_step():
+    timeline = RouteTimeline(highway_route())
+    assert len(timeline) == 4 and timeline.total_seconds == 4200.0
+    assert close(timeline.position_at(0).lng, 77.0)
+    assert close(timeline.position_at(300).lng, 77.05)
+    # halfway through the long middle segment
+    assert close(timeline.position_at(600 + 1500).lng, 77.35)
+    assert close(timeline.position_at(4200).lng, 77.7)
+    # clamped to the route ends
+    assert close(timeline.position_at(-50).lng, 77.0) and close(timeline.position_at(10 ** 6).lng, 77.7)
+
+
+def test_window_lookup_is_exact_to_the_second():
+    timeline = RouteTimeline(highway_route())
+    # 10:45 is 2700 s after departure: 2100 s into the middle segment
+    point, eta = timeline.point_for_window(DEPARTURE, dtime(10, 45), dtime(11, 30))
+    assert eta == datetime(2024, 1, 15, 10, 45)
+    assert close(point.lng, 77.1 + 0.5 * 2100 / 3000)
+
+    # A window that opened before departure starts at the origin
+    point, eta = timeline.point_for_window(DEPARTURE, dtime(9, 30), dtime(10, 30))
+    assert eta == DEPARTURE and close(point.lng, 77.0)
+
+    # Windows the trip never drives through fall back to the closer route end
+    point, eta = timeline.point_for_window(DEPARTURE, dtime(19, 0), dtime(21, 0))
+    assert eta == datetime(2024, 1, 15, 11, 10) and close(point.lng, 77.7)
+    point, eta = timeline.point_for_window(DEPARTURE, dtime(7, 0), dtime(8, 0))
+    assert eta == DEPARTURE
+
+
+def test_routes_without_annotations():
+    route = synthetic_route([(77.5946, 12.9716), (80.2707, 13.0827)])
+    annotated = RouteTimeline(route)
+    for leg in route["legs"]:
+        del leg["annotation"]
+    # Constant speed along the geometry: the synthetic route is constant speed too
+    # (up to the planar approximation of segment lengths, a few tens of metres)
+    by_distance = RouteTimeline(route)
+    assert abs(by_distance.total_seconds - annotated.total_seconds) < 1e-6
+    for t in (0.0, 1234.5, 9000.0, annotated.total_seconds):
+        a, b = annotated.position_at(t), by_distance.position_at(t)
+        assert abs(a.lat - b.lat) < 5e-4 and abs(a.lng - b.lng) < 5e-4
+
+    # Without geometry only the step maneuvers are left
+    route["geometry"] = None
+    by_steps = RouteTimeline(route)
+    assert len(by_steps) == len(route["legs"][0]["steps"])
+    assert RouteTimeline({"legs": []}).point_for_window(DEPARTURE, dtime(12, 0), dtime(13, 0)) is None
+
+
+if __name__ == "__main__":
+    test_position_interpolates_within_a_step()
+    test_window_lookup_is_exact_to_the_second()
+    test_routes_without_annotations()
+    print("OK")
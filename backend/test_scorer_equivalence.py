@@ -0,0 +1,131 @@
+"""
+Check that scoring.CompiledScorer returns exactly the scores and
+match_reasons of the reference calculate_personalization_score /
+score_place_enhanced in main_osrm, over every preference combination and a
+randomized batch of places including malformed tags. Also checks that the
+vegetarian filter's bit test on the poi_flags classification keeps the same
+places as the keyword scan it replaced.
+
+    cd backend && python test_scorer_equivalence.py      (or: python -m pytest test_scorer_equivalence.py)
+"""
+
+import itertools
+import random
+
+from main_osrm import UserPreferences, calculate_personalization_score, score_place_enhanced
+from poi_flags import CLASS_VERSION, NON_VEG, VEG_FRIENDLY, classify_place, place_class
+from scoring import CompiledScorer
+
+NAME_WORDS = ["Sri", "Pure Veg", "Vegetarian", "Cafe", "Street", "Family", "Bar", "Rooftop", "Kids",
+              "Organic", "Chicken", "BBQ", "Tea", "Heritage", "Local", "Plant-Based", "Juice", ""]
+CUISINES = ["", "vegetarian", "indian;vegetarian", "south_indian", "pure_veg", "coffee_shop", "pub",
+            "local;traditional", "salad", "seafood", "tapas", "dessert", "VEGAN", "authentic;comfort"]
+RATINGS = [None, "", "4.5", "3", "2.1", "five", "4.", "0", 4, 0, 3.7, "nan"]
+PRICE_LEVELS = [None, "", "1", "2", "3", "4", "5", 1, 2, 0, "$$"]
+WHEELCHAIR = [None, "yes", "no", "limited"]
+
+FOOD = ["any", "vegetarian", "Vegetarian", "vegan"]
+BUDGETS = ["budget", "moderate", "Luxury", "", "cheap"]
+PACES = ["relaxed", "balanced", "fast", "Fast", "sprint"]
+MOODS = ["relax", "adventure", "Social", "family", "romantic"]
+ACTIVITY_SETS = [[], ["trekking"], ["heritage", "photography"], ["Wellness", "wellness", "karaoke"],
+                 ["trekking", "heritage", "photography", "wellness"]]
+ACCESSIBILITY = ["none", "wheelchair", "None"]
+
+
+def same(a, b) -> bool:
+    """Bit-for-bit score comparison; repr also treats a "nan" rating's NaN as equal to itself."""
+    return repr(a[0]) == repr(b[0]) and a[1] == b[1]
+
+
+def random_place(rng: random.Random, i: int) -> dict:
+    tags = {"amenity": "restaurant"}
+    name = " ".join(rng.sample(NAME_WORDS, rng.randint(0, 3))).strip()
+    if name or rng.random() < 0.5:
+        tags["name"] = name
+    for key, pool in (("cuisine", CUISINES), ("rating", RATINGS), ("price_level", PRICE_LEVELS),
+                      ("wheelchair", WHEELCHAIR)):
+        value = rng.choice(pool)
+        if value is not None:
+            tags[key] = value
+    for extra in range(rng.randint(0, 4)):
+        tags[f"extra:{extra}"] = "x"
+    place = {"osm_id": str(i), "name": tags.get("name", "Unknown"), "tags": tags}
+    if rng.random() < 0.05:
+        place["tags"] = None
+    return place
+
+
+def all_prefs():
+    for food, budget, pace, mood, activities, access in itertools.product(
+        FOOD, BUDGETS, PACES, MOODS, ACTIVITY_SETS, ACCESSIBILITY
+    ):
+        yield UserPreferences(foodPreference=food, budget=budget, pace=pace, mood=mood,
+                              activities=activities, accessibility=access)
+
+
+def check_all_preferences() -> int:
+    rng = random.Random(1234)
+    places = [random_place(rng, i) for i in range(30)]
+    detours = [rng.randint(0, 20) for _ in places]
+    checked = 0
+    for prefs in all_prefs():
+        max_detour = rng.choice([0, 5, 15])
+        scorer = CompiledScorer.for_prefs(prefs)
+        batch = scorer.score_batch(places, detours, max_detour)
+        for place, detour, got in zip(places, detours, batch):
+            expected = score_place_enhanced(place, detour, prefs, max_detour)
+            assert same(got, expected), (prefs, place, detour, got, expected)
+
+            personal = scorer.personalization(place_class(place), detour, max_detour)
+            assert same(personal, calculate_personalization_score(place, prefs, detour, max_detour))
+            checked += 1
+    return checked
+
+
+def test_compiled_scorer_matches_reference():
+    check_all_preferences()
+
+
+def reference_veg_keep(place: dict) -> bool:
+    """The keyword scan suggest_meal_stops ran on every request before classification."""
+    tags = place.get("tags", {}) or {}
+    cuisine = (tags.get("cuisine") or "").lower()
+    name = (place.get("name") or "").lower()
+    veg_indicators = ["vegetarian", "veg", "pure_veg", "pure veg", "plant-based",
+                      "south indian", "north indian", "indian"]
+    non_veg_indicators = ["non-veg", "non veg", "chicken", "mutton", "fish", "seafood",
+                          "meat", "bbq", "barbecue", "steak", "pork", "beef"]
+    has_veg = any(i in cuisine for i in veg_indicators) or any(i in name for i in veg_indicators)
+    has_non_veg = any(i in cuisine for i in non_veg_indicators) or any(i in name for i in non_veg_indicators)
+    return has_veg or not has_non_veg
+
+
+def test_veg_filter_bits_match_keyword_scan():
+    rng = random.Random(99)
+    for i in range(2000):
+        place = classify_place(random_place(rng, i))
+        bits = place["class"]["bits"]
+        assert bool(bits & VEG_FRIENDLY or not bits & NON_VEG) == reference_veg_keep(place), place
+
+
+def test_stale_classification_is_recomputed():
+    place = {"name": "Pure Veg Cafe", "tags": {"name": "Pure Veg Cafe", "cuisine": "vegetarian"},
+             "class": {"v": CLASS_VERSION - 1, "bits": 0}}
+    assert place_class(place)["bits"] & VEG_FRIENDLY
+    assert place["class"]["v"] == CLASS_VERSION
+
+
+def test_scorer_is_compiled_once_per_preferences():
+    a = UserPreferences(activities=["heritage"])
+    b = UserPreferences(activities=["heritage"])
+    assert CompiledScorer.for_prefs(a) is CompiledScorer.for_prefs(b)
+    assert CompiledScorer.for_prefs(a) is not CompiledScorer.for_prefs(UserPreferences(activities=["trekking"]))
+
+
+if __name__ == "__main__":
+    n = check_all_preferences()
+    test_scorer_is_compiled_once_per_preferences()
+    test_veg_filter_bits_match_keyword_scan()
+    test_stale_classification_is_recomputed()
+    print(f"OK: {n} (preferences, place) pairs scored identically")
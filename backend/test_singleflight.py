@@ -0,0 +1,105 @@
+"""
+Single-flight request coalescing (singleflight.py): concurrent callers with
+one key share a single call, its result and its exception; a cancelled
+caller leaves the shared call running; the key is free again afterwards.
+
+    cd backend && python test_singleflight.py      (or: python -m pytest test_singleflight.py)
+"""
+
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"routes": [len(calls)]}
+
+        results = await asyncio.gather(*(flight.do("route", fetch) for _ in range(5)),
+                                       flight.do("table", fetch))
+        assert len(calls) == 2
+        assert all(r is results[0] for r in results[:5]) and results[5] is not results[0]
+        assert flight.stats() == {"calls": 2, "coalesced": 4, "inflight": 0}
+
+    asyncio.run(run())
+
+
+def test_exception_reaches_every_waiter():
+    async def run():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream 502")
+
+        results = await asyncio.gather(*(flight.do("route", fail) for _ in range(3)), return_exceptions=True)
+        assert [str(r) for r in results] == ["upstream 502"] * 3
+        assert results[0] is results[1] is results[2]
+        assert flight.calls == 1 and flight.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        finished = []
+
+        async def fetch():
+            await release.wait()
+            finished.append(1)
+            return "ok"
+
+        first = asyncio.ensure_future(flight.do("route", fetch))
+        second = asyncio.ensure_future(flight.do("route", fetch))
+        await asyncio.sleep(0)
+        # the caller that started the call goes away
+        first.cancel()
+        await asyncio.sleep(0)
+        assert first.cancelled() and flight.inflight == 1
+        release.set()
+        assert await second == "ok" and finished == [1]
+        assert flight.calls == 1
+
+    asyncio.run(run())
+
+
+def test_key_is_released_after_the_call():
+    async def run():
+        flight = SingleFlight()
+        answers = iter(["first", "second"])
+
+        async def fetch():
+            return next(answers)
+
+        assert await flight.do("route", fetch) == "first"
+        assert flight.inflight == 0
+        # a later call runs again instead of reusing the finished one
+        assert await flight.do("route", fetch) == "second"
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        try:
+            await flight.do("table", fail)
+            raise AssertionError("the error was swallowed")
+        except RuntimeError:
+            pass
+        assert flight.inflight == 0 and flight.stats()["calls"] == 3
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_concurrent_callers_share_one_call()
+    test_exception_reaches_every_waiter()
+    test_cancelled_waiter_does_not_cancel_the_shared_call()
+    test_key_is_released_after_the_call()
+    print("OK")
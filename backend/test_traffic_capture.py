@@ -0,0 +1,123 @@
+"""
+Traffic capture (traffic_capture.py) writes sanitized, replayable JSONL,
+and benchmarks/replay_traffic.py reads it back across rotated files.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import main_osrm
+from benchmarks.replay_traffic import load_capture
+import traffic_capture
+from traffic_capture import TrafficRecorder
+
+CREATE_BODY = {
+    "source": {"lat": 12.971598, "lng": 77.594562},
+    "destination": {"lat": 13.082680, "lng": 80.270718},
+    "stops": [{"lat": 12.5, "lng": 78.123456}],
+    "mealPreferences": ["dinner"],
+    "mealWindows": {"dinner": {"start": "19:00", "end": "21:00"}},
+    "preferred_reach_time": "2024-01-15T21:00:00",
+    "user_id": "72uY6EAy3rQUJjdRqM5vZN2kJ163",
+}
+
+
+def test_bodies_are_sanitized():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traffic.jsonl")
+        recorder = TrafficRecorder(path, salt="s")
+        recorder.record("POST", "/trips/create", json.dumps(CREATE_BODY).encode(), 200, 0.5, ts=100.0)
+        recorder.record("POST", "/trips/finalize", b'{"trip_id": "trip_1", "user_id": "72uY6EAy3rQUJjdRqM5vZN2kJ163",'
+                                                   b' "selected_meals": {}}', 200, 0.01, ts=101.0)
+        recorder.record("POST", "/trips/create", b"not json", 422, 0.001)
+        recorder.close()
+
+        with open(path) as f:
+            text = f.read()
+        assert "72uY6EAy3rQUJjdRqM5vZN2kJ163" not in text and "trip_1" not in text
+        create, finalize = (json.loads(line) for line in text.splitlines())
+        assert create["body"]["source"] == {"lat": 12.972, "lng": 77.595}
+        assert create["body"]["stops"] == [{"lat": 12.5, "lng": 78.123}]
+        assert create["body"]["mealWindows"] == CREATE_BODY["mealWindows"]
+        # The same user maps to the same pseudonym everywhere
+        assert create["body"]["user_id"] == finalize["body"]["user_id"]
+        assert create["body"]["user_id"].startswith("anon_")
+        assert recorder.stats()["captured"] == 2 and recorder.stats()["dropped"] == 1
+
+
+def test_bodies_are_parsed_on_the_writer_thread():
+    threads = []
+    original = traffic_capture._round_coords
+
+    def spy(value):
+        threads.append(threading.current_thread())
+        return original(value)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        traffic_capture._round_coords = spy
+        try:
+            recorder = TrafficRecorder(os.path.join(tmp, "traffic.jsonl"))
+            recorder.record("POST", "/trips/create", json.dumps(CREATE_BODY).encode(), 200, 0.5)
+            recorder.close()
+        finally:
+            traffic_capture._round_coords = original
+    assert threads and threading.main_thread() not in threads
+    assert recorder.stats()["captured"] == 1
+
+
+def test_replay_reads_rotated_files_in_order():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traffic.jsonl")
+        recorder = TrafficRecorder(path, max_bytes=1000, backup_count=10)
+        for i in range(12):
+            recorder.record("POST", "/trips/create", json.dumps(CREATE_BODY).encode(), 200, 0.1, ts=1000.0 + i)
+        recorder.close()
+        assert os.path.exists(path + ".2")
+
+        entries = load_capture(path)
+        assert [e["ts"] for e in entries] == [1000.0 + i for i in range(12)]
+
+
+def test_streamed_trips_are_captured_when_the_stream_ends():
+    app = FastAPI()
+    app.middleware("http")(main_osrm.traffic_capture_middleware)
+
+    @app.post("/trips/create/stream")
+    async def stream():
+        async def events():
+            for name in ("route", "meal", "departure"):
+                await asyncio.sleep(0.05)
+                yield json.dumps({"event": name}).encode() + b"\n"
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traffic.jsonl")
+        original = main_osrm.traffic_recorder
+        main_osrm.traffic_recorder = TrafficRecorder(path)
+        try:
+            response = TestClient(app).post("/trips/create/stream", json=CREATE_BODY)
+            assert len(response.text.splitlines()) == 3
+        finally:
+            main_osrm.traffic_recorder.close()
+            main_osrm.traffic_recorder = original
+
+        (entry,) = load_capture(path)
+        assert entry["path"] == "/trips/create/stream" and entry["status"] == 200
+        assert entry["body"]["user_id"].startswith("anon_")
+        # timed to the last event, not to the headers
+        assert entry["duration_ms"] >= 150
+
+
+if __name__ == "__main__":
+    test_bodies_are_sanitized()
+    test_bodies_are_parsed_on_the_writer_thread()
+    test_replay_reads_rotated_files_in_order()
+    test_streamed_trips_are_captured_when_the_stream_ends()
+    print("OK")
@@ -0,0 +1,131 @@
+"""
+/trips/create/stream end to end, with OSRM and Overpass answered by the
+benchmarks' synthetic upstreams: NDJSON and SSE framing, Accept
+negotiation, a status code for failures before the first event, an
+"error" event for failures after it, and request latency measured to the
+end of the stream.
+
+    cd backend && python test_trip_stream.py      (or: python -m pytest test_trip_stream.py)
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from urllib.parse import urlencode, urlsplit
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import main_osrm
+from benchmarks.fake_upstreams import synthetic_handler
+from metrics import REQUEST_SECONDS
+from poi_cache import PoiCache
+
+CREATE_BODY = {
+    "source": {"lat": 12.971598, "lng": 77.594562},
+    "destination": {"lat": 13.082680, "lng": 80.270718},
+    "stops": [{"lat": 12.7, "lng": 78.6}],
+    "mealPreferences": ["lunch", "dinner"],
+    "mealWindows": {"lunch": {"start": "15:00", "end": "17:00"}, "dinner": {"start": "18:30", "end": "20:30"}},
+    "preferred_reach_time": "2024-01-15T21:00:00",
+}
+
+
+def _post(body=CREATE_BODY, fail_sequence=False, **kwargs):
+    async def fake_upstream_json(upstream, method, url, params=None, data=None, timeout=None):
+        status, payload = await synthetic_handler(method, urlsplit(url).path, params or {},
+                                                  urlencode(data or {}).encode())
+        assert status == 200, payload
+        return payload
+
+    def failing_plan(*args, **kwargs):
+        raise RuntimeError("sequencing failed")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        original = main_osrm.upstream_json, main_osrm._poi_cache, main_osrm.plan_meal_stops
+        main_osrm.upstream_json = fake_upstream_json
+        main_osrm._poi_cache = PoiCache(os.path.join(tmp, "poi.sqlite3"))
+        if fail_sequence:
+            main_osrm.plan_meal_stops = failing_plan
+        try:
+            return TestClient(main_osrm.app).post("/trips/create/stream", json=body, **kwargs)
+        finally:
+            main_osrm._poi_cache.close()
+            main_osrm.upstream_json, main_osrm._poi_cache, main_osrm.plan_meal_stops = original
+            for cache in (main_osrm.route_cache, main_osrm.duration_cache, main_osrm.timeline_cache):
+                cache.clear()
+
+
+def _sse_events(text):
+    events = []
+    for block in text.split("\n\n"):
+        if block:
+            name, data = block.split("\n")
+            assert name.startswith("event: ") and data.startswith("data: ")
+            events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_ndjson_events_arrive_in_order():
+    response = _post()
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["event"] == "route" and events[-1]["event"] == "departure"
+    assert sorted(e["meal"] for e in events[1:-1]) == ["dinner", "lunch"]
+    assert all(e["suggestions"] for e in events[1:-1])
+    assert set(events[-1]["recommended_meal_stops"]) == {"lunch", "dinner"}
+
+
+def test_sse_by_accept_header_or_format():
+    for kwargs in ({"headers": {"Accept": "text/event-stream"}}, {"params": {"format": "sse"}}):
+        response = _post(**kwargs)
+        assert response.headers["content-type"].startswith("text/event-stream"), kwargs
+        events = _sse_events(response.text)
+        assert [name for name, _ in events] == [data["event"] for _, data in events]
+        assert events[0][0] == "route" and events[-1][0] == "departure"
+
+
+def test_bad_request_fails_before_the_first_event():
+    response = _post(dict(CREATE_BODY, preferred_reach_time="not a time"))
+    assert response.status_code == 400
+    assert "preferred_reach_time" in response.json()["detail"]
+
+
+def test_later_failure_becomes_an_error_event():
+    response = _post(fail_sequence=True)
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0]["event"] == "route"
+    assert events[-1] == {"event": "error", "detail": "sequencing failed"}
+
+
+def test_request_latency_covers_the_whole_stream():
+    app = FastAPI()
+    app.middleware("http")(main_osrm.metrics_middleware)
+
+    @app.post("/slow-stream")
+    async def slow_stream():
+        async def events():
+            for name in ("route", "meal", "departure"):
+                await asyncio.sleep(0.05)
+                yield json.dumps({"event": name}).encode() + b"\n"
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    response = TestClient(app).post("/slow-stream")
+    assert len(response.text.splitlines()) == 3
+    # the header only sees the time to the first byte; the histogram waits for the last
+    assert "total;dur=" in response.headers["Server-Timing"]
+    counts, total = REQUEST_SECONDS._series[("POST", "/slow-stream", "200")]
+    assert sum(counts) == 1 and total[0] >= 0.15
+
+
+if __name__ == "__main__":
+    test_ndjson_events_arrive_in_order()
+    test_sse_by_accept_header_or_format()
+    test_bad_request_fails_before_the_first_event()
+    test_later_failure_becomes_an_error_event()
+    test_request_latency_covers_the_whole_stream()
+    print("OK")
@@ -0,0 +1,153 @@
+"""
+Durability semantics of the write-behind trip queue (trip_writer.py):
+everything acknowledged by submit() is committed by close(), writes are
+grouped by size and by time, and failed commits are retried.
+
+The first checks use an in-memory stand-in for Firestore's batch API. The
+last one runs against the Firestore emulator when FIRESTORE_EMULATOR_HOST
+is set:
+
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python test_trip_writer.py
+"""
+
+import asyncio
+import os
+import time
+import uuid
+
+import pytest
+
+from trip_writer import WriteBehindQueue
+
+
+class FakeDb:
+    def __init__(self, fail_first: int = 0, commit_delay: float = 0.0):
+        self.docs = {}
+        self.commits = []
+        self.fail_first = fail_first
+        self.commit_delay = commit_delay
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def document(self, doc_id):
+        return (self.name, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        time.sleep(self.db.commit_delay)
+        if self.db.fail_first > 0:
+            self.db.fail_first -= 1
+            raise ConnectionError("deadline exceeded")
+        for ref, data in self.writes:
+            self.db.docs[ref] = data
+        self.db.commits.append(len(self.writes))
+
+
+def test_close_commits_everything_acknowledged():
+    async def run():
+        db = FakeDb(commit_delay=0.01)
+        writer = WriteBehindQueue(db, max_batch=10, max_delay=0.05)
+        start = time.perf_counter()
+        for i in range(95):
+            writer.submit(f"trip_{i}", {"n": i})
+        # submit never waits for Firestore
+        assert time.perf_counter() - start < 0.05
+        await writer.close()
+        assert len(db.docs) == 95 and db.docs[("trips", "trip_42")] == {"n": 42}
+        assert max(db.commits) <= 10 and sum(db.commits) == 95
+        stats = writer.stats()
+        assert stats["committed"] == 95 and stats["queue_depth"] == 0 and stats["failed"] == 0
+
+    asyncio.run(run())
+
+
+def test_partial_batch_commits_after_max_delay():
+    async def run():
+        db = FakeDb()
+        writer = WriteBehindQueue(db, max_batch=100, max_delay=0.05)
+        writer.submit("trip_a", {})
+        writer.submit("trip_b", {})
+        await asyncio.sleep(0.3)
+        assert db.commits == [2]
+        await writer.close()
+
+    asyncio.run(run())
+
+
+def test_failed_commit_is_retried():
+    async def run():
+        db = FakeDb(fail_first=2)
+        writer = WriteBehindQueue(db, max_delay=0.01, backoff=0.01)
+        writer.submit("trip_r", {"x": 1})
+        await writer.flush()
+        assert db.docs == {("trips", "trip_r"): {"x": 1}}
+        assert writer.stats()["retries"] == 2
+        await writer.close()
+
+    asyncio.run(run())
+
+
+def test_gives_up_after_max_retries():
+    async def run():
+        db = FakeDb(fail_first=10)
+        writer = WriteBehindQueue(db, max_delay=0.01, max_retries=1, backoff=0.01)
+        writer.submit("trip_x", {})
+        await writer.close()
+        assert not db.docs and writer.stats()["failed"] == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="FIRESTORE_EMULATOR_HOST not set")
+def test_emulator_round_trip():
+    from google.cloud import firestore
+
+    db = firestore.Client(project=os.getenv("GCLOUD_PROJECT", "routivity-test"))
+    prefix = f"test_{uuid.uuid4().hex[:8]}"
+    ids = [f"{prefix}_{i}" for i in range(250)]
+
+    async def run():
+        writer = WriteBehindQueue(db, "trips", max_batch=100, max_delay=0.05)
+        for i, doc_id in enumerate(ids):
+            writer.submit(doc_id, {"n": i, "created_at": firestore.SERVER_TIMESTAMP})
+        await writer.close()
+        assert writer.stats()["committed"] == len(ids)
+
+    asyncio.run(run())
+    try:
+        snapshots = list(db.get_all([db.collection("trips").document(doc_id) for doc_id in ids]))
+        assert all(s.exists for s in snapshots) and len(snapshots) == len(ids)
+        assert snapshots[0].to_dict()["created_at"] is not None
+    finally:
+        for doc_id in ids:
+            db.collection("trips").document(doc_id).delete()
+
+
+if __name__ == "__main__":
+    test_close_commits_everything_acknowledged()
+    test_partial_batch_commits_after_max_delay()
+    test_failed_commit_is_retried()
+    test_gives_up_after_max_retries()
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        test_emulator_round_trip()
+    else:
+        print("FIRESTORE_EMULATOR_HOST not set, skipping emulator test")
+    print("OK")
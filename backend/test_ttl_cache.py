@@ -0,0 +1,100 @@
+"""
+The route/duration cache (ttl_cache.py): per-entry TTL, LRU eviction at
+maxsize, hit/miss/eviction counters and coordinate quantization. Time is a
+fake clock swapped in for the module's ``time``, so nothing sleeps.
+
+    cd backend && python test_ttl_cache.py      (or: python -m pytest test_ttl_cache.py)
+"""
+
+import ttl_cache
+from ttl_cache import TTLCache, quantize
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _with_clock(test):
+    def run():
+        clock = FakeClock()
+        original = ttl_cache.time
+        ttl_cache.time = clock
+        try:
+            test(clock)
+        finally:
+            ttl_cache.time = original
+    run.__name__ = test.__name__
+    return run
+
+
+@_with_clock
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("route", "default ttl")
+    cache.set("table", "short ttl", ttl=5)
+    clock.now += 5
+    assert cache.get("route") == "default ttl" and cache.get("table") == "short ttl"
+    clock.now += 0.001
+    assert cache.get("table") is None
+    assert cache.get("table", "gone") == "gone"
+    clock.now += 55
+    assert cache.get("route") is None
+    # expired entries are dropped when looked up
+    assert len(cache) == 0
+    # setting again restarts the clock
+    cache.set("route", "fresh")
+    clock.now += 59
+    assert cache.get("route") == "fresh"
+
+
+@_with_clock
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=3, ttl=60)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") == "A"  # "b" is now the oldest
+    cache.set("d", "D")
+    assert len(cache) == 3 and cache.get("b") is None
+    cache.set("c", "C2")  # overwriting refreshes too
+    cache.set("e", "E")
+    assert cache.get("a") is None
+    assert [cache.get(k) for k in "cde"] == ["C2", "D", "E"]
+    assert cache.evictions == 2
+
+
+@_with_clock
+def test_hit_and_miss_counters(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.get("route")
+    cache.set("route", 1)
+    cache.get("route")
+    cache.get("route")
+    clock.now += 11
+    cache.get("route")  # expired counts as a miss
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 2, "evictions": 1}
+    cache.delete("c")
+    cache.clear()
+    assert cache.stats()["size"] == 0 and cache.stats()["hits"] == 2
+
+
+def test_quantize_rounds_to_precision():
+    assert quantize(12.971598, 77.594562, 4) == (12.9716, 77.5946)
+    assert quantize(12.97164, 77.59457, 4) == quantize(12.97156, 77.59463, 4)
+    assert quantize(12.97164, 77.5946, 4) != quantize(12.97166, 77.5946, 4)
+    assert quantize(-33.868820, 151.209296, 3) == (-33.869, 151.209)
+    assert quantize(12.971598, 77.594562, 0) == (13.0, 78.0)
+
+
+if __name__ == "__main__":
+    test_entries_expire_after_their_ttl()
+    test_least_recently_used_entry_is_evicted()
+    test_hit_and_miss_counters()
+    test_quantize_rounds_to_precision()
+    print("OK")
@@ -0,0 +1,115 @@
+"""
+Capture of production /trips traffic for later replay.
+
+TrafficRecorder appends one JSON object per captured request to a
+size-rotated JSONL file:
+
+    {"ts": 1718000000.123, "method": "POST", "path": "/trips/create",
+     "status": 200, "duration_ms": 812.4, "body": {...}}
+
+Bodies are sanitized before they are written. User IDs become stable
+pseudonyms (the same user always maps to the same ``anon_…`` ID, so a
+replay keeps each user's share of the traffic), trip IDs are hashed the
+same way, and coordinates are rounded to CAPTURE_COORD_DECIMALS places.
+Writes go through a queue to a listener thread, the same way as the log
+pipeline. The request only enqueues the raw body; parsing, sanitizing and
+encoding happen on that thread, so ``captured``/``dropped`` lag behind
+until the queue drains.
+
+benchmarks/replay_traffic.py reads these files back.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from typing import Any, Dict, Optional
+
+CAPTURE_COORD_DECIMALS = 3  # ~100 m
+
+CAPTURED_PATHS = ("/trips/create", "/trips/create/stream", "/trips/finalize")
+
+
+def _round_coords(value: Any) -> Any:
+    if isinstance(value, dict):
+        if set(value) >= {"lat", "lng"}:
+            return {**value, "lat": round(value["lat"], CAPTURE_COORD_DECIMALS),
+                    "lng": round(value["lng"], CAPTURE_COORD_DECIMALS)}
+        return {k: _round_coords(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_round_coords(v) for v in value]
+    return value
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5,
+                 sample_rate: float = 1.0, salt: str = ""):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._salt = salt.encode()
+        self.captured = 0
+        self.dropped = 0
+
+        sink = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        sink.setFormatter(logging.Formatter("%(message)s"))
+        sink.addFilter(self._to_entry)
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._listener: Optional[logging.handlers.QueueListener] = logging.handlers.QueueListener(self._queue, sink)
+        self._listener.start()
+
+    def pseudonym(self, value: str) -> str:
+        return "anon_" + hmac.new(self._salt, value.encode(), hashlib.sha256).hexdigest()[:16]
+
+    def sanitize(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        body = _round_coords(body)
+        for key in ("user_id", "trip_id"):
+            if body.get(key):
+                body[key] = self.pseudonym(str(body[key]))
+        return body
+
+    def wants(self, method: str, path: str) -> bool:
+        return method == "POST" and path in CAPTURED_PATHS and (
+            self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        )
+
+    def record(self, method: str, path: str, raw_body: bytes, status: int, duration: float,
+               ts: Optional[float] = None):
+        """Queue one request; bodies that are not a JSON object are skipped by the writer."""
+        record = logging.LogRecord("traffic", logging.INFO, path, 0, raw_body, None, None)
+        record.entry = {
+            "ts": round(ts if ts is not None else time.time(), 3),
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(duration * 1000, 1),
+        }
+        self._queue.put_nowait(record)
+
+    def _to_entry(self, record: logging.LogRecord) -> bool:
+        """Handler filter, run on the listener thread: raw body -> sanitized JSONL line."""
+        try:
+            body = json.loads(record.msg)
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self.dropped += 1
+            return False
+        record.msg = json.dumps({**record.entry, "body": self.sanitize(body)}, separators=(",", ":"))
+        self.captured += 1
+        return True
+
+    def close(self):
+        """Flush everything queued; safe to call more than once."""
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "sample_rate": self.sample_rate,
+                "captured": self.captured, "dropped": self.dropped}
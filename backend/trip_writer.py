@@ -0,0 +1,143 @@
+"""
+Write-behind persistence of trip documents.
+
+submit() queues a document and returns at once, so /trips/finalize answers
+with its trip_id without waiting for Firestore. A single background task
+drains the queue, grouping pending writes into one Firestore WriteBatch
+once ``max_batch`` documents are waiting or the oldest has waited
+``max_delay`` seconds. The commit itself runs in a worker thread. Failed
+commits are retried with exponential backoff; a batch that still fails is
+logged with its document ids and counted as failed. close() drains
+everything already acknowledged before shutdown.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_MAX_BATCH = 500
+
+Write = Tuple[str, Dict[str, Any]]
+
+
+class WriteBehindQueue:
+    def __init__(self, db, collection: str = "trips", max_batch: int = 100, max_delay: float = 0.25,
+                 max_queue: int = 10000, max_retries: int = 5, backoff: float = 0.5):
+        self.db = db
+        self.collection = collection
+        self.max_batch = min(max_batch, FIRESTORE_MAX_BATCH)
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+        self.retries = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self._commit_ms_total = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, doc_id: str, data: Dict[str, Any]):
+        """Queue a document write; raises asyncio.QueueFull when the backlog is at max_queue."""
+        self.start()
+        self._queue.put_nowait((doc_id, data))
+        self.submitted += 1
+
+    async def flush(self):
+        """Wait until everything submitted so far has been committed or given up on."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self, timeout: float = 10.0):
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Trip writer closed with {self.depth} writes still queued")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._commit_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit_with_retry(self, batch: List[Write]):
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._commit, batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(batch)
+                    logger.error(f"Giving up on {len(batch)} trip writes after {attempt + 1} attempts: {e}; "
+                                 f"ids={[doc_id for doc_id, _ in batch]}")
+                    return
+                self.retries += 1
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"Trip batch commit failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.batches += 1
+            self.committed += len(batch)
+            self.last_commit_ms = elapsed_ms
+            self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+            self._commit_ms_total += elapsed_ms
+            logger.info(f"Committed {len(batch)} trips in {elapsed_ms:.0f}ms")
+            return
+
+    def _commit(self, batch: List[Write]):
+        write_batch = self.db.batch()
+        collection = self.db.collection(self.collection)
+        for doc_id, data in batch:
+            write_batch.set(collection.document(doc_id), data)
+        write_batch.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "submitted": self.submitted,
+            "committed": self.committed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "retries": self.retries,
+            "last_commit_ms": round(self.last_commit_ms, 1),
+            "avg_commit_ms": round(self._commit_ms_total / self.batches, 1) if self.batches else 0.0,
+            "max_commit_ms": round(self.max_commit_ms, 1),
+        }